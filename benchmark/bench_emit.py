@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+# Micro-benchmark for the emission backend of the code generator.
+#
+# test/common/many-types.xml is scaled up by replicating its interface
+# N times (with unique names), and the complete stub and promise sets are
+# generated twice:
+#
+#   unbuffered -- every emit() goes straight to an open file, and the
+#                 introspection XML is written one character at a time
+#                 (the way the generator used to work)
+#   buffered   -- output.OutputFile collects the code in memory and every
+#                 file is flushed with a single write
+#
+# The number of write() calls reaching the files and the wall time are
+# printed for both.
+#
+# usage: bench_emit.py [--copies N] [--repeat R]
+
+import optparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from codegen_glibmm import codegen
+from codegen_glibmm import output
+from codegen_glibmm import parser
+
+MANY_TYPES_XML = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              '..', 'test', 'common', 'many-types.xml')
+
+OUTPUTS = ['proxy_h', 'proxy_cpp', 'stub_cpp', 'stub_h', 'promise_cpp',
+           'promise_h', 'common_cpp', 'common_h', 'metadata_h']
+
+class CountingFile:
+    """ A real file which counts the write() calls made on it """
+    def __init__(self, name):
+        self.name = name
+        self.writes = 0
+        self._f = open(name, 'w')
+
+    def write(self, text):
+        self.writes += 1
+        self._f.write(text)
+
+    def close(self):
+        self._f.close()
+
+class CountingOutputFile(output.OutputFile):
+    """ output.OutputFile, counting the writes of save() on the real file """
+    def __init__(self, name):
+        output.OutputFile.__init__(self, name)
+        self.writes = 0
+
+    def save(self):
+        output.OutputFile.save(self)
+        self.writes += 1
+
+class UnbufferedCodeGenerator(codegen.CodeGenerator):
+    """ The previous emission strategy: one or two writes per emit() and
+        the introspection XML emitted one character at a time """
+    def emit(self, dest, text, newline = True):
+        dest.write(text)
+        if newline:
+            dest.write("\n")
+
+    def generate_stub_introspection(self):
+        for i in range(0, len(self.node_xmls)):
+            self.emit_cpp_s("static const char interfaceXml%d[] = R\"XML_DELIMITER(" % i, False)
+            for char in self.node_xmls[i]:
+                self.emit_cpp_s(char, False)
+            self.emit_cpp_s(")XML_DELIMITER\";")
+
+    def generate_promise_introspection(self):
+        for i in range(0, len(self.node_xmls)):
+            self.emit_metadata("static const char interfaceXml%d[] = R\"XML_DELIMITER(" % i, False)
+            for char in self.node_xmls[i]:
+                self.emit_metadata(char, False)
+            self.emit_metadata(")XML_DELIMITER\";")
+
+def scaled_xml(copies):
+    """ Replicate the interface of many-types.xml 'copies' times """
+    f = open(MANY_TYPES_XML, 'rb')
+    xml_data = f.read()
+    f.close()
+    match = re.search(r'(<interface name="([^"]+)">.*</interface>)', xml_data, re.S)
+    iface, name = match.group(1), match.group(2)
+    ifaces = [iface.replace(name, '%s%d' % (name, n), 1) for n in range(copies)]
+    return xml_data[:match.start(1)] + '\n'.join(ifaces) + xml_data[match.end(1):]
+
+def run(outdir, xml_data, promise, file_class, generator_class):
+    ifaces = parser.parse_dbus_xml(xml_data)
+    for i in ifaces:
+        i.post_process([''], '')
+
+    prefix = os.path.join(outdir, 'bench')
+    mode = promise and '_promise' or '_stub'
+    names = {'proxy_h': '_proxy.h', 'proxy_cpp': '_proxy.cpp',
+             'stub_cpp': mode + '.cpp', 'stub_h': mode + '.h',
+             'promise_cpp': mode + '.cpp', 'promise_h': mode + '.h',
+             'common_cpp': '_common.cpp', 'common_h': '_common.h',
+             'metadata_h': '_metadata.h'}
+    files = {}
+    for key in OUTPUTS:
+        if (key.startswith('stub') and promise) or (key.startswith('promise') and not promise):
+            files[key] = None
+        else:
+            files[key] = file_class(prefix + names[key])
+
+    start = time.time()
+    gen = generator_class(ifaces, '', [''], [xml_data],
+                          files['proxy_h'], files['proxy_cpp'],
+                          files['stub_cpp'], files['stub_h'],
+                          promise, files['promise_cpp'], files['promise_h'],
+                          files['common_cpp'], files['common_h'],
+                          files['metadata_h'])
+    gen.generate()
+    writes = 0
+    for f in files.values():
+        if f is None:
+            continue
+        if hasattr(f, 'save'):
+            f.save()
+        else:
+            f.close()
+        writes += f.writes
+    return writes, time.time() - start
+
+def main():
+    arg_parser = optparse.OptionParser('%prog [options]')
+    arg_parser.add_option('', '--copies', type='int', default=50,
+                          help='Number of copies of the many-types interface')
+    arg_parser.add_option('', '--repeat', type='int', default=3,
+                          help='Number of runs, the best time is reported')
+    (opts, args) = arg_parser.parse_args()
+
+    xml_data = scaled_xml(opts.copies)
+    outdir = tempfile.mkdtemp(prefix='bench-emit-')
+    # The generator prints warnings for oversized signals, keep them quiet
+    stdout = sys.stdout
+    try:
+        print 'many-types.xml x %d (%d bytes of XML)' % (opts.copies, len(xml_data))
+        print '%-8s %-11s %12s %10s' % ('mode', 'backend', 'writes', 'seconds')
+        for promise in (None, True):
+            for label, file_class, generator_class in (
+                    ('unbuffered', CountingFile, UnbufferedCodeGenerator),
+                    ('buffered', CountingOutputFile, codegen.CodeGenerator)):
+                best = None
+                for r in range(opts.repeat):
+                    sys.stdout = open(os.devnull, 'w')
+                    writes, elapsed = run(outdir, xml_data, promise, file_class, generator_class)
+                    sys.stdout.close()
+                    sys.stdout = stdout
+                    if best is None or elapsed < best:
+                        best = elapsed
+                print '%-8s %-11s %12d %10.3f' % (promise and 'promise' or 'stub', label, writes, best)
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(outdir)
+
+if __name__ == '__main__':
+    main()
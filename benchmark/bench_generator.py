@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+# Benchmark of the complete generator on synthetic introspection XML.
+#
+# The XML (see synthxml.py) is parsed, post-processed and generated in stub
+# and in promise mode. Parsing, post-processing and every phase of
+# CodeGenerator.generate() (the generate_*, declare_* and define_*
+# methods, summed over all interfaces, as reported by --timings) are timed
+# separately. The best time
+# of all runs is reported per phase, as JSON, so results can be compared
+# between releases:
+#
+#   {
+#     "version": "2.42.0",
+#     "python": "2.7.18",
+#     "config": { "interfaces": 10, "methods": 100, ... },
+#     "xml_bytes": 123456,
+#     "parse": 0.1,
+#     "post_process": 0.01,
+#     "generate": {
+#       "stub":    { "total": 0.5, "phases": { "declare_types_proxy": 0.01, ... } },
+#       "promise": { ... }
+#     }
+#   }
+#
+# usage: bench_generator.py [--interfaces N] [--methods M] [--args K]
+#                           [--properties P] [--signals S] [--repeat R]
+#                           [--output FILE]
+
+import json
+import optparse
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from codegen_glibmm import codegen
+from codegen_glibmm import config
+from codegen_glibmm import output
+from codegen_glibmm import parser
+from codegen_glibmm import timings
+
+import synthxml
+
+def generate(ifaces, xml_data, promise):
+    """ Run the code generator, timing each phase
+        @return (total seconds, dict of phase name to seconds)
+    """
+    files = {}
+    for name in ('proxy_h', 'proxy_cpp', 'stub_h', 'stub_cpp', 'promise_h',
+                 'promise_cpp', 'common_h', 'common_cpp', 'metadata_h'):
+        files[name] = output.OutputFile('bench_' + name)
+    if promise:
+        (files['stub_h'], files['stub_cpp']) = (None, None)
+    else:
+        (files['promise_h'], files['promise_cpp']) = (None, None)
+
+    gen = codegen.CodeGenerator(ifaces, '', [''], [xml_data],
+                                files['proxy_h'], files['proxy_cpp'],
+                                files['stub_cpp'], files['stub_h'],
+                                promise, files['promise_cpp'], files['promise_h'],
+                                files['common_cpp'], files['common_h'],
+                                files['metadata_h'])
+    gen_timings = timings.enable()
+    start = time.time()
+    try:
+        gen.generate()
+    finally:
+        timings.disable()
+    elapsed = time.time() - start
+    return (elapsed, dict([(name.replace('codegen: ', ''), seconds)
+                           for (name, seconds) in gen_timings.seconds.items()]))
+
+def best(results):
+    """ Minimum of a list of numbers or of dicts of numbers """
+    if isinstance(results[0], dict):
+        return dict([(key, min([r[key] for r in results])) for key in results[0]])
+    return min(results)
+
+def main():
+    arg_parser = optparse.OptionParser('%prog [options]')
+    arg_parser.add_option('', '--interfaces', type='int', default=10,
+                          help='Number of interfaces')
+    arg_parser.add_option('', '--methods', type='int', default=100,
+                          help='Number of methods per interface')
+    arg_parser.add_option('', '--args', type='int', default=3,
+                          help='Number of in and of out arguments per method, and of arguments per signal')
+    arg_parser.add_option('', '--properties', type='int', default=20,
+                          help='Number of properties per interface')
+    arg_parser.add_option('', '--signals', type='int', default=20,
+                          help='Number of signals per interface')
+    arg_parser.add_option('', '--seed', type='int', default=0,
+                          help='Seed for the choice of signatures')
+    arg_parser.add_option('', '--repeat', type='int', default=3,
+                          help='Number of runs, the best time is reported')
+    arg_parser.add_option('', '--output', metavar='FILE',
+                          help='Write the JSON result to FILE instead of stdout')
+    (opts, args) = arg_parser.parse_args()
+
+    xml_data = synthxml.synthesize(opts.interfaces, opts.methods, opts.args,
+                                   opts.properties, opts.signals, opts.seed)
+    parse_times = []
+    post_process_times = []
+    generate_times = { 'stub': [], 'promise': [] }
+    phase_times = { 'stub': [], 'promise': [] }
+
+    # Keep the warnings of the generator out of the JSON output
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        for r in range(opts.repeat):
+            start = time.time()
+            ifaces = parser.parse_dbus_xml(xml_data)
+            parse_times.append(time.time() - start)
+
+            start = time.time()
+            for i in ifaces:
+                i.post_process([''], '')
+            post_process_times.append(time.time() - start)
+
+            for mode in ('stub', 'promise'):
+                (total, phases) = generate(ifaces, xml_data, mode == 'promise')
+                generate_times[mode].append(total)
+                phase_times[mode].append(phases)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    result = {
+        'version':      config.VERSION,
+        'python':       platform.python_version(),
+        'config':       { 'interfaces': opts.interfaces,
+                          'methods':    opts.methods,
+                          'args':       opts.args,
+                          'properties': opts.properties,
+                          'signals':    opts.signals,
+                          'seed':       opts.seed,
+                          'repeat':     opts.repeat },
+        'xml_bytes':    len(xml_data),
+        'parse':        best(parse_times),
+        'post_process': best(post_process_times),
+        'generate':     dict([(mode, { 'total':  best(generate_times[mode]),
+                                       'phases': best(phase_times[mode]) })
+                              for mode in ('stub', 'promise')]),
+    }
+
+    text = json.dumps(result, indent=2, separators=(',', ': '), sort_keys=True) + '\n'
+    if opts.output:
+        f = open(opts.output, 'w')
+        f.write(text)
+        f.close()
+    else:
+        sys.stdout.write(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+# Micro-benchmark for the code templates of the generator.
+#
+# A synthetic interface with N methods (default 2000, plus a property and a
+# signal per 10 methods, see synthxml.py) is generated in stub and in
+# promise mode, using
+#
+#   ad-hoc    -- textwrap.dedent() and str.format() on every use of a
+#                template (the way the generator used to work)
+#   compiled  -- templates.template(), dedenting and compiling each
+#                template once
+#
+# The best wall time of the code generation is printed for both.
+#
+# usage: bench_templates.py [--methods N] [--repeat R]
+
+import optparse
+import os
+import sys
+import textwrap
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from codegen_glibmm import codegen
+from codegen_glibmm import parser
+from codegen_glibmm import target
+from codegen_glibmm import templates
+
+import synthxml
+
+class AdHocTemplate:
+    """ The previous template handling: dedent and parse on every use """
+    def __init__(self, text):
+        self.text = text
+
+    def format(*args, **fields):
+        return textwrap.dedent(args[0].text).format(**fields)
+
+def run(xml_data, promise):
+    ifaces = parser.parse_dbus_xml(xml_data)
+    for i in ifaces:
+        i.post_process([''], '')
+    start = time.time()
+    target.generate_code(ifaces, [xml_data], 'bench', '', [''], promise)
+    return time.time() - start
+
+def main():
+    arg_parser = optparse.OptionParser('%prog [options]')
+    arg_parser.add_option('', '--methods', type='int', default=2000,
+                          help='Number of methods of the interface')
+    arg_parser.add_option('', '--repeat', type='int', default=5,
+                          help='Number of runs, the best time is reported')
+    (opts, args) = arg_parser.parse_args()
+
+    xml_data = synthxml.synthesize(1, opts.methods, 2, opts.methods / 10, opts.methods / 10)
+    print '%d methods (%d bytes of XML)' % (opts.methods, len(xml_data))
+    print '%-8s %-9s %10s' % ('mode', 'templates', 'seconds')
+    for promise in (False, True):
+        timings = {}
+        for label, factory, dedent in (('ad-hoc', AdHocTemplate, textwrap.dedent),
+                                       ('compiled', templates.template, templates.dedent)):
+            (codegen.template, codegen.dedent) = (factory, dedent)
+            try:
+                timings[label] = min([run(xml_data, promise) for r in range(opts.repeat)])
+            finally:
+                (codegen.template, codegen.dedent) = (templates.template, templates.dedent)
+            print '%-8s %-9s %10.3f' % (promise and 'promise' or 'stub', label, timings[label])
+        print '%-8s speedup %.2fx' % ('', timings['ad-hoc'] / timings['compiled'])
+
+if __name__ == '__main__':
+    main()
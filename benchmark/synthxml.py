@@ -0,0 +1,55 @@
+# Synthetic introspection XML for the benchmarks.
+#
+# The interfaces use a deterministic mix (seeded) of the D-Bus signatures
+# the generator maps to C++ types, see
+# dbustypes.TypeWrap.cppSignatureForDbusSignature.
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from codegen_glibmm import dbustypes
+
+# Candidate signatures, only the ones supported by the generator are used
+CANDIDATE_SIGNATURES = ['b', 'y', 'n', 'q', 'i', 'u', 'x', 't', 'd', 's', 'o',
+                        'g', 'v', 'ay', 'as', 'ao', 'aay']
+
+def supported_signatures():
+    return [sig for sig in CANDIDATE_SIGNATURES
+            if dbustypes.TypeWrap.cppSignatureForDbusSignature(sig)[0] is not None]
+
+def synthesize(interfaces = 1, methods = 100, args = 3, properties = 10,
+               signals = 10, seed = 0):
+    """ Introspection XML for 'interfaces' interfaces, each with 'methods'
+        methods taking 'args' in and 'args' out arguments, 'properties'
+        properties and 'signals' signals with 'args' arguments
+    """
+    rnd = random.Random(seed)
+    signatures = supported_signatures()
+    access = ['read', 'write', 'readwrite']
+    # Signals have at most codegen.SIGNAL_MAX_PARAM arguments
+    signal_args = min(args, 10)
+
+    lines = ['<node>']
+    for n in range(interfaces):
+        lines.append('  <interface name="org.gdbus.codegen.glibmm.Synth%d">' % n)
+        for m in range(methods):
+            lines.append('    <method name="Method%d">' % m)
+            for direction in ('in', 'out'):
+                for a in range(args):
+                    lines.append('      <arg type="%s" name="%s%d" direction="%s"/>'
+                                 % (rnd.choice(signatures), direction, a, direction))
+            lines.append('    </method>')
+        for p in range(properties):
+            lines.append('    <property name="Property%d" type="%s" access="%s"/>'
+                         % (p, rnd.choice(signatures), rnd.choice(access)))
+        for s in range(signals):
+            lines.append('    <signal name="Signal%d">' % s)
+            for a in range(signal_args):
+                lines.append('      <arg type="%s" name="arg%d"/>' % (rnd.choice(signatures), a))
+            lines.append('    </signal>')
+        lines.append('  </interface>')
+    lines.append('</node>')
+    return '\n'.join(lines) + '\n'
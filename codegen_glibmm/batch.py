@@ -0,0 +1,88 @@
+# -*- Mode: Python -*-
+
+# GDBus - GLib D-Bus Library
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+from . import target
+
+# Keys accepted for each target of a manifest, with their defaults
+TARGET_KEYS = { 'xml':              None,
+                'output':           None,
+                'cpp_namespace':    '',
+                'interface_prefix': '',
+                'promise':          False }
+
+def _str(value):
+    """ json returns unicode strings on Python 2, the generator works on str """
+    if not isinstance(value, str):
+        value = value.encode('utf-8')
+    return value
+
+def parse_manifest(data, toml_format = False):
+    """ Parse a batch manifest. The manifest holds a list of targets:
+
+        {
+          "targets": [
+            { "xml": ["bar.xml"], "output": "generated/bar",
+              "cpp_namespace": "", "interface_prefix": "", "promise": false },
+            ...
+          ]
+        }
+
+        "xml" and "output" correspond to the positional arguments and
+        --generate-cpp-code, the remaining keys to the options with the
+        same name and are optional. Paths are used as given, exactly as
+        on the command line.
+
+        @return list of target.Target
+    """
+    if toml_format:
+        try:
+            import toml
+        except ImportError:
+            raise RuntimeError('The "toml" module is required for TOML manifests')
+        manifest = toml.loads(data)
+    else:
+        manifest = json.loads(data)
+
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('targets'), list):
+        raise RuntimeError('Manifest must contain a list of "targets"')
+
+    targets = []
+    for n, entry in enumerate(manifest['targets']):
+        for key in entry:
+            if key not in TARGET_KEYS:
+                raise RuntimeError('Unknown key "%s" in target %d of manifest' % (key, n))
+        for key in ('xml', 'output'):
+            if not entry.get(key):
+                raise RuntimeError('Missing "%s" in target %d of manifest' % (key, n))
+
+        xml_files = entry['xml']
+        if not isinstance(xml_files, list):
+            xml_files = [xml_files]
+        targets.append(target.Target([_str(fname) for fname in xml_files],
+                                     _str(entry['output']),
+                                     _str(entry.get('cpp_namespace', TARGET_KEYS['cpp_namespace'])),
+                                     _str(entry.get('interface_prefix', TARGET_KEYS['interface_prefix'])),
+                                     entry.get('promise', TARGET_KEYS['promise'])))
+    return targets
+
+def load_manifest(fname):
+    f = open(fname, 'r')
+    data = f.read()
+    f.close()
+    return parse_manifest(data, fname.endswith('.toml'))
@@ -0,0 +1,151 @@
+# -*- Mode: Python -*-
+
+# GDBus - GLib D-Bus Library
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, see <http://www.gnu.org/licenses/>.
+
+import glob
+import hashlib
+import os
+import tempfile
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from . import config
+
+CACHE_SUFFIX = '.cache'
+
+_generator_digest = None
+
+def generator_digest():
+    """ Digest of the generator itself: config.VERSION plus the source of
+        this package, so that cached output is never reused across
+        generator changes, even when the version is not bumped.
+    """
+    global _generator_digest
+    if _generator_digest is None:
+        digest = hashlib.sha1(config.VERSION)
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(glob.glob(os.path.join(package_dir, '*.py'))):
+            f = open(name, 'rb')
+            digest.update(f.read())
+            f.close()
+        _generator_digest = digest.hexdigest()
+    return _generator_digest
+
+class OutputCache:
+    """ On-disk cache of rendered generator output.
+
+        An entry holds the complete output (file names and content) of one
+        generator run and is keyed by the XML input, the options and the
+        generator version. A hit therefore skips parsing, type mapping and
+        code generation entirely.
+
+        Entries are evicted when they have not been used for max_age
+        seconds, and the least recently used ones are evicted while the
+        cache is larger than max_size bytes.
+    """
+    def __init__(self, directory, max_size = None, max_age = None):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, node_xmls, options):
+        """ Compute the cache key
+            @param node_xmls list of XML input, as read from the files
+            @param options dict with all options influencing the output
+        """
+        digest = hashlib.sha1(generator_digest())
+        for name in sorted(options):
+            digest.update('%s=%r\n' % (name, options[name]))
+        for xml_data in node_xmls:
+            digest.update('%d\n' % len(xml_data))
+            digest.update(xml_data)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def load(self, key):
+        """ Return the cached list of (file name, content) tuples for key,
+            or None on a cache miss
+        """
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                entry = pickle.load(f)
+            finally:
+                f.close()
+        except Exception:
+            # Truncated or otherwise broken entry, treat it as a miss
+            return None
+        # Mark the entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry
+
+    def store(self, key, outputs):
+        """ Store the list of (file name, content) tuples for key """
+        fd, tmp_name = tempfile.mkstemp(prefix='.tmp-', dir=self.directory)
+        try:
+            f = os.fdopen(fd, 'wb')
+            pickle.dump(outputs, f, 2)
+            f.close()
+            if os.name == 'nt' and os.path.exists(self._path(key)):
+                os.remove(self._path(key))
+            os.rename(tmp_name, self._path(key))
+        except:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+        self.evict()
+
+    def evict(self):
+        """ Remove expired entries, then the least recently used ones until
+            the cache fits max_size
+        """
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, '*' + CACHE_SUFFIX)):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+
+        now = time.time()
+        total = sum([size for (mtime, size, path) in entries])
+        for (mtime, size, path) in entries:
+            expired = self.max_age is not None and now - mtime > self.max_age
+            too_big = self.max_size is not None and total > self.max_size
+            if not expired and not too_big:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                # Removed concurrently by another generator process
+                pass
+            total -= size
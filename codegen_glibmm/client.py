@@ -0,0 +1,52 @@
+# -*- Mode: Python -*-
+
+# GDBus - GLib D-Bus Library
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, see <http://www.gnu.org/licenses/>.
+
+# Client side of the generator daemon (--server), see server.py for the
+# protocol.
+
+import json
+import os
+import socket
+
+def request(path, args):
+    """ Send a generate request for the command line arguments args to the
+        daemon listening on the Unix socket path
+        @return the response (a dict with status, stdout, stderr and files),
+                or None if the daemon could not be reached
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(path)
+            sock.sendall(json.dumps({ 'cwd': os.getcwd(), 'args': args }) + '\n')
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except socket.error:
+            return None
+    finally:
+        sock.close()
+
+    try:
+        response = json.loads(''.join(chunks))
+    except ValueError:
+        # The daemon went away while handling the request
+        return None
+    return response
@@ -23,11 +23,11 @@
 
 import sys
 
-from textwrap import dedent
-
 from . import config
 from . import utils
 from . import dbustypes
+from . import timings
+from .templates import dedent, template
 
 # ----------------------------------------------------------------------------------------------------
 
@@ -43,8 +43,14 @@ class CodeGenerator:
                  stub_cpp, stub_h,
                  if_promises, promise_cpp, promise_h,
                  common_cpp, common_h,
-                 metadata_h):
+                 metadata_h,
+                 xml_index = None):
+        """ @param xml_index dict of interface name to the index in node_xmls
+                   of the XML declaring it, all interfaces are in the first
+                   XML if None
+        """
         self.ifaces = ifaces
+        self.xml_index = xml_index or {}
 
         self.proxy_h = proxy_h
         self.proxy_cpp = proxy_cpp
@@ -64,13 +70,15 @@ class CodeGenerator:
         pass
 
     def emit (self, dest, text, newline = True):
-        """ Emit code to the specified file
+        """ Emit code to the specified output (normally an
+            output.OutputFile, which buffers the code in memory)
             @param newline boolean indicating whether to append a newline to
                            generated code
         """
-        dest.write (text)
         if newline:
-            dest.write ("\n")
+            dest.write (text + "\n")
+        else:
+            dest.write (text)
 
     def emit_h_p (self, text, newline = True):
         """ Emit code to proxy header file
@@ -162,7 +170,7 @@ class CodeGenerator:
         for i in self.ifaces:
             for ns in i.cpp_namespace_name.split("::")[:-1]:
                 self.emit_h_p ("namespace %s {" % ns)
-            self.emit_h_p(dedent('''
+            self.emit_h_p(template('''
             class {i.cpp_class_name} : public Glib::ObjectBase {{
             public:
                 static void createForBus (Gio::DBus::BusType busType,
@@ -180,7 +188,7 @@ class CodeGenerator:
                 # Flag method as templated if there is a variant arg
                 templated = False
                 for a in m.in_args:
-                    if "v" in a.signature:
+                    if a.signature == "v":
                         templated = True
 
                 if templated is True:
@@ -191,10 +199,12 @@ class CodeGenerator:
                     self.emit_h_p("    void %s(" % m.name)
                     for a in m.in_args:
                         # Variants needs special attention
-                        if "v" in a.signature:
+                        if a.signature == "v":
                             self.emit_h_p("        T %s," % (a.name))
                         else:
                             self.emit_h_p("        %s %s," % (a.cpptype_in, a.name))
+                    if m.in_unix_fds:
+                        self.emit_h_p("        const Glib::RefPtr<Gio::UnixFDList> &fd_list,")
                     self.emit_h_p("        const Gio::SlotAsyncReady &callback)")
                     self.emit_h_p("    {")
                     # End method signature
@@ -206,7 +216,7 @@ class CodeGenerator:
                     if (len(m.in_args) > 1):
                         self.emit_h_p("        std::vector<Glib::VariantBase> params;")
                         for a in m.in_args:
-                            if "v" in a.signature:
+                            if a.signature == "v":
                                 self.emit_h_p("        Glib::Variant<Glib::Variant<T> > %s_variantValue;" % (a.name))
                                 self.emit_h_p("        %s_variantValue = Glib::Variant<Glib::Variant<T> >::create(Glib::Variant<T>::create(%s_param));" % (a.name, a.name))
                                 self.emit_h_p("        params.push_back(%s_variantValue);" % (a.name))
@@ -215,7 +225,7 @@ class CodeGenerator:
                                 self.emit_h_p("        params.push_back(%s_param);" % (a.name))
                     elif (len(m.in_args) == 1):
                         for a in m.in_args:
-                            if "v" in a.signature:
+                            if a.signature == "v":
                                 self.emit_h_p("        Glib::Variant<Glib::Variant<T> > variantValue;")
                                 self.emit_h_p("        variantValue = Glib::Variant<Glib::Variant<T> >::create(Glib::Variant<T>::create(%s));" % (a.name))
                                 self.emit_h_p("        Glib::VariantBase params = variantValue;")
@@ -224,12 +234,21 @@ class CodeGenerator:
                     if (len(m.in_args) > 0):
                         self.emit_h_p("        base = Glib::VariantContainerBase::create_tuple(params);")
 
-                    self.emit_h_p(dedent('''
-                            m_proxy->call(
-                                "{m.name}",
-                                callback,
-                                base);
-                        }}''').format(**locals()))
+                    if m.in_unix_fds:
+                        self.emit_h_p(template('''
+                                m_proxy->call(
+                                    "{m.name}",
+                                    base,
+                                    callback,
+                                    fd_list);
+                            }}''').format(**locals()))
+                    else:
+                        self.emit_h_p(template('''
+                                m_proxy->call(
+                                    "{m.name}",
+                                    callback,
+                                    base);
+                            }}''').format(**locals()))
                     # End method implementation
 
                 else:
@@ -237,14 +256,40 @@ class CodeGenerator:
                     self.emit_h_p("    void %s (" % m.name)
                     for a in m.in_args:
                         self.emit_h_p("        %s %s," % (a.cpptype_in, a.name))
+                    if m.in_unix_fds:
+                        self.emit_h_p("        const Glib::RefPtr<Gio::UnixFDList> &fd_list,")
                     self.emit_h_p("        const Gio::SlotAsyncReady &slot);")
 
+                    # With a cancellable, and a timeout instead of the default one
+                    self.emit_h_p("    void %s (" % m.name)
+                    for a in m.in_args:
+                        self.emit_h_p("        %s %s," % (a.cpptype_in, a.name))
+                    if m.in_unix_fds:
+                        self.emit_h_p("        const Glib::RefPtr<Gio::UnixFDList> &fd_list,")
+                    self.emit_h_p("        const Gio::SlotAsyncReady &slot,")
+                    self.emit_h_p("        const Glib::RefPtr<Gio::Cancellable> &cancellable,")
+                    self.emit_h_p("        int timeout_ms);")
+
+                    # Blocking call, throwing a Glib::Error on failure
+                    self.emit_h_p("    void %s_sync (" % m.name)
+                    for a in m.in_args:
+                        self.emit_h_p("        %s %s," % (a.cpptype_in, a.name))
+                    if m.in_unix_fds:
+                        self.emit_h_p("        const Glib::RefPtr<Gio::UnixFDList> &fd_list,")
+                    for a in m.out_args:
+                        self.emit_h_p("        %s& out_%s," % (a.cpptype_out, a.name))
+                    if m.out_unix_fds:
+                        self.emit_h_p("        Glib::RefPtr<Gio::UnixFDList>& out_fd_list,")
+                    self.emit_h_p("        int timeout_ms = -1);")
+
                 self.emit_h_p("")
 
                 # _finish method
                 self.emit_h_p("    void %s_finish (" % m.name)
                 for a in m.out_args:
                     self.emit_h_p("        %s& %s," % (a.cpptype_out, a.name))
+                if m.out_unix_fds:
+                    self.emit_h_p("        Glib::RefPtr<Gio::UnixFDList>& fd_list,")
                 self.emit_h_p("        const Glib::RefPtr<Gio::AsyncResult>& res);")
 
                 self.emit_h_p("")
@@ -257,6 +302,13 @@ class CodeGenerator:
                     self.emit_h_p("     void {p.name}_set({p.cpptype_in}, const Gio::SlotAsyncReady &);".format(**locals()))
                     self.emit_h_p("     void {p.name}_set_finish(const Glib::RefPtr<Gio::AsyncResult>&);".format(**locals()))
 
+            # The properties are cached, see generate_property_cache_proxy()
+            self.emit_h_p("")
+            self.emit_h_p("    /* Update the cached properties with a single GetAll call */")
+            self.emit_h_p("    void refresh_properties(const Gio::SlotAsyncReady &slot);")
+            self.emit_h_p("    void refresh_properties_finish(const Glib::RefPtr<Gio::AsyncResult> &res);")
+            self.emit_h_p("")
+
 
             # Generate all signals for this interface
             for s in i.signals:
@@ -271,20 +323,35 @@ class CodeGenerator:
                 for a in s.args:
                     params.append(a.cpptype_out)
                 params = ", ".join(params)
-                self.emit_h_p(dedent('''sigc::signal<void, {params} > {s.name}_signal;''').format(**locals()))
+                self.emit_h_p(template('''sigc::signal<void, {params} > {s.name}_signal;''').format(**locals()))
+
+            # Typed cache of the readable properties, see update_property()
+            cache = []
+            for p in i.properties:
+                if p.readable:
+                    cache.append("    {p.cpptype_out} m_{p.name}Value{{}};".format(**locals()))
+                    cache.append("    bool m_{p.name}Cached = false;".format(**locals()))
+            cache = "\n".join(cache)
 
             # Reference handling (needed for creating Glib::RefPtr, signal handler and private constructor
-            self.emit_h_p(dedent('''
+            self.emit_h_p(template('''
                 void reference() {{}}
                 void unreference() {{}}
                 void handle_signal (const Glib::ustring& sender_name, const Glib::ustring& signal_name, const Glib::VariantContainerBase& parameters);
+                void handle_properties_changed (const Gio::DBus::Proxy::MapChangedProperties& changed_properties,
+                                                const std::vector<Glib::ustring>& invalidated_properties);
 
                 private:
                 {i.cpp_class_name} (Glib::RefPtr<Gio::DBus::Proxy> proxy) : Glib::ObjectBase() {{
                     this->m_proxy = proxy;
                     this->m_proxy->signal_signal().connect(sigc::mem_fun(this, &{i.cpp_class_name}::handle_signal));
+                    this->m_proxy->signal_properties_changed().connect(sigc::mem_fun(this, &{i.cpp_class_name}::handle_properties_changed));
+                    load_cached_properties();
                 }}
+                void load_cached_properties();
+                void update_property(const Glib::ustring& property_name, const Glib::VariantBase& value);
                 Glib::RefPtr<Gio::DBus::Proxy> m_proxy;
+            {cache}
             }};''').format(**locals()))
 
             # Close namespaces, in reversed order
@@ -302,84 +369,182 @@ class CodeGenerator:
             # Flag method as templated if there is a variant arg
             templated = False
             for a in m.in_args:
-                if "v" in a.signature:
+                if a.signature == "v":
                     templated = True
 
             # Only generate code if this is a non-templated method
             if templated is False:
                 # async begin
                 self.emit_cpp_p('void %s::%s(' % (i.cpp_namespace_name, m.camel_name))
-                for a in m.in_args:
-                    self.emit_cpp_p('        %s arg_%s,'%(a.cpptype_in, a.name))
+                self.emit_in_args_proxy(m)
                 self.emit_cpp_p('        const Gio::SlotAsyncReady &callback)')
                 self.emit_cpp_p('{')
-                self.emit_cpp_p("    Glib::VariantContainerBase base;");
+                self.emit_call_params_proxy(i, m)
+
+                if m.in_unix_fds:
+                    self.emit_cpp_p(template('''
+                        m_proxy->call(
+                            "{m.name}",
+                            base,
+                            callback,
+                            fd_list);
+                    }}''').format(**locals()))
+                else:
+                    self.emit_cpp_p(template('''
+                        m_proxy->call(
+                            "{m.name}",
+                            callback,
+                            base);
+                    }}''').format(**locals()))
 
-                if (len(m.in_args) > 1):
-                    self.emit_cpp_p("std::vector<Glib::VariantBase> params;")
-                    for a in m.in_args:
-                        self.emit_cpp_p("  " + a.cpptype_send(a.name + "_param", a.name, i.cpp_class_name)+ "")
-                        self.emit_cpp_p("  params.push_back(%s_param);" % a.name)
-                elif (len (m.in_args) == 1):
-                    for a in m.in_args:
-                        self.emit_cpp_p("    " + a.cpptype_send("params", a.name, i.cpp_class_name) + "")
+                self.emit_cpp_p("")
 
-                if (len(m.in_args) > 0):
-                    self.emit_cpp_p("    base = Glib::VariantContainerBase::create_tuple(params);")
+                # async with a cancellable and a timeout
+                self.emit_cpp_p('void %s::%s(' % (i.cpp_namespace_name, m.camel_name))
+                self.emit_in_args_proxy(m)
+                self.emit_cpp_p('        const Gio::SlotAsyncReady &callback,')
+                self.emit_cpp_p('        const Glib::RefPtr<Gio::Cancellable> &cancellable,')
+                self.emit_cpp_p('        int timeout_ms)')
+                self.emit_cpp_p('{')
+                self.emit_call_params_proxy(i, m)
+
+                if m.in_unix_fds:
+                    self.emit_cpp_p(template('''
+                        m_proxy->call(
+                            "{m.name}",
+                            base,
+                            callback,
+                            cancellable,
+                            fd_list,
+                            timeout_ms);
+                    }}''').format(**locals()))
+                else:
+                    self.emit_cpp_p(template('''
+                        m_proxy->call(
+                            "{m.name}",
+                            callback,
+                            cancellable,
+                            base,
+                            timeout_ms);
+                    }}''').format(**locals()))
 
-                self.emit_cpp_p(dedent('''
-                    m_proxy->call(
-                        "{m.name}",
-                        callback,
-                        base);
-                }}''').format(**locals()))
+                self.emit_cpp_p("")
 
+                # sync, returning the out arguments like _finish
+                self.emit_cpp_p('void %s::%s_sync(' % (i.cpp_namespace_name, m.camel_name))
+                self.emit_in_args_proxy(m)
+                for a in m.out_args:
+                    self.emit_cpp_p('        %s& out_%s,'%(a.cpptype_out, a.name))
+                if m.out_unix_fds:
+                    self.emit_cpp_p('        Glib::RefPtr<Gio::UnixFDList>& out_fd_list,')
+                self.emit_cpp_p('        int timeout_ms)')
+                self.emit_cpp_p('{')
+                self.emit_call_params_proxy(i, m)
+                self.emit_cpp_p("    Glib::VariantContainerBase wrapped;")
+                if m.in_unix_fds or m.out_unix_fds:
+                    if not m.in_unix_fds:
+                        self.emit_cpp_p("    Glib::RefPtr<Gio::UnixFDList> fd_list;")
+                    if not m.out_unix_fds:
+                        self.emit_cpp_p("    Glib::RefPtr<Gio::UnixFDList> out_fd_list;")
+                    self.emit_cpp_p('    wrapped = m_proxy->call_sync("%s", base, fd_list, out_fd_list, timeout_ms);' % m.name)
+                else:
+                    self.emit_cpp_p('    wrapped = m_proxy->call_sync("%s", base, timeout_ms);' % m.name)
+                self.emit_cpp_p("")
+                self.emit_out_args_proxy(i, m)
+                self.emit_cpp_p("}")
                 self.emit_cpp_p("")
 
             # Generate _finish function for above method call, we want this for templated methods as well
             self.emit_cpp_p('void %s::%s_finish(' %(i.cpp_namespace_name, m.camel_name))
             for a in m.out_args:
                 self.emit_cpp_p('        %s& out_%s,'%(a.cpptype_out, a.name))
-            self.emit_cpp_p(dedent('''
-                    const Glib::RefPtr<Gio::AsyncResult>& result)
-            {{
-                Glib::VariantContainerBase wrapped;
-                wrapped = m_proxy->call_finish(result);
-            ''').format(**locals()))
+            if m.out_unix_fds:
+                self.emit_cpp_p(template('''
+                        Glib::RefPtr<Gio::UnixFDList>& out_fd_list,
+                        const Glib::RefPtr<Gio::AsyncResult>& result)
+                {{
+                    Glib::VariantContainerBase wrapped;
+                    wrapped = m_proxy->call_finish(result, out_fd_list);
+                ''').format(**locals()))
+            else:
+                self.emit_cpp_p(template('''
+                        const Glib::RefPtr<Gio::AsyncResult>& result)
+                {{
+                    Glib::VariantContainerBase wrapped;
+                    wrapped = m_proxy->call_finish(result);
+                ''').format(**locals()))
 
-            for arg_index in range(0, len(m.out_args)):
-                a = m.out_args[arg_index]
-                varname = a.name + "_variant"
-                outvar = "out_" + a.name
-                self.emit_cpp_p("    " + a.cppvalue_get(varname, outvar, str(arg_index), i.cpp_class_name))
-                self.emit_cpp_p("")
+            self.emit_out_args_proxy(i, m)
             self.emit_cpp_p("}")
             self.emit_cpp_p("")
 
+    def emit_in_args_proxy(self, m):
+        """ Emit the in arguments of a proxy call of method m, and the file
+        descriptors sent along with them
+        """
+        for a in m.in_args:
+            self.emit_cpp_p('        %s arg_%s,'%(a.cpptype_in, a.name))
+        if m.in_unix_fds:
+            self.emit_cpp_p('        const Glib::RefPtr<Gio::UnixFDList> &fd_list,')
+
+    def emit_call_params_proxy(self, i, m):
+        """ Emit the marshalling of the in arguments of method m into the
+        tuple 'base'
+        """
+        self.emit_cpp_p("    Glib::VariantContainerBase base;");
+
+        if (len(m.in_args) > 1):
+            self.emit_cpp_p("std::vector<Glib::VariantBase> params;")
+            for a in m.in_args:
+                self.emit_cpp_p("  " + a.cpptype_send(a.name + "_param", a.name, i.cpp_class_name)+ "")
+                self.emit_cpp_p("  params.push_back(%s_param);" % a.name)
+        elif (len (m.in_args) == 1):
+            for a in m.in_args:
+                self.emit_cpp_p("    " + a.cpptype_send("params", a.name, i.cpp_class_name) + "")
+
+        if (len(m.in_args) > 0):
+            self.emit_cpp_p("    base = Glib::VariantContainerBase::create_tuple(params);")
+
+    def emit_out_args_proxy(self, i, m):
+        """ Emit the unmarshalling of the reply 'wrapped' of method m into the
+        out_ arguments
+        """
+        for arg_index in range(0, len(m.out_args)):
+            a = m.out_args[arg_index]
+            varname = a.name + "_variant"
+            outvar = "out_" + a.name
+            self.emit_cpp_p("    " + a.cppvalue_get(varname, outvar, str(arg_index), i.cpp_class_name))
+            self.emit_cpp_p("")
+
     def generate_property_handlers_proxy(self, i):
+            self.generate_property_cache_proxy(i)
             for p in i.properties:
                 if p.readable:
-                    self.emit_cpp_p(dedent('''
+                    self.emit_cpp_p(template('''
                     {p.cpptype_out} {i.cpp_namespace_name}::{p.name}_get() {{
-                        std::vector<Glib::ustring> props = m_proxy->get_cached_property_names();
-                        Glib::Variant<{p.cpptype_get} > b;
-                        if (std::find(props.begin(), props.end(), "{p.name}") != props.end()) {{
-                            m_proxy->get_cached_property(b, "{p.name}");
-                        }} else {{
-                            g_print ("Todo: lookup value\\n");
-                        }}''').format(**locals()))
-                    cpptype_cast = p.cpptype_get_cast
-                    # Prepend the class name if this is the generic "TypeWrap" class
-                    if cpptype_cast.startswith("TypeWrap"):
-                        cpptype_cast = i.cpp_class_name + cpptype_cast
-                    self.emit_cpp_p(dedent('''
-                        return {cpptype_cast}(b.get());
+                        if (!m_{p.name}Cached) {{
+                            // Not received with GetAll, or invalidated since
+                            try {{
+                                std::vector<Glib::VariantBase> paramsVec;
+                                paramsVec.push_back (Glib::Variant<Glib::ustring>::create("{i.name}"));
+                                paramsVec.push_back (Glib::Variant<Glib::ustring>::create("{p.name}"));
+                                Glib::VariantContainerBase result =
+                                    m_proxy->call_sync("org.freedesktop.DBus.Properties.Get",
+                                                       Glib::VariantContainerBase::create_tuple(paramsVec));
+                                Glib::Variant<Glib::VariantBase> value;
+                                result.get_child(value, 0);
+                                update_property("{p.name}", value.get());
+                            }} catch (const Glib::Error &ex) {{
+                                g_warning("Unable to get the property {p.name}: %s", ex.what().c_str());
+                            }}
+                        }}
+                        return m_{p.name}Value;
                     }}''').format(**locals()))
                 cpptype_to_dbus = p.cpptype_to_dbus
                 if cpptype_to_dbus.startswith("TypeWrap"):
                     cpptype_to_dbus = i.cpp_class_name + cpptype_to_dbus
                 if p.writable:
-                    self.emit_cpp_p(dedent('''
+                    self.emit_cpp_p(template('''
 
                     void {i.cpp_namespace_name}::{p.name}_set({p.cpptype_in} value, const Gio::SlotAsyncReady &cb) {{
                         std::vector<Glib::VariantBase> paramsVec;
@@ -397,6 +562,81 @@ class CodeGenerator:
                     }}
                     ''').format(**locals()))
 
+    def generate_property_cache_proxy(self, i):
+        """ Generate the typed property cache of the proxy: the conversion of
+        the received values, dispatched on the property name, the handler of
+        PropertiesChanged and refresh_properties()
+        @param i Interface to generate the property cache for
+        """
+        self.emit_cpp_p(template('''
+        void {i.cpp_namespace_name}::update_property(const Glib::ustring& property_name,
+                                                    const Glib::VariantBase& value) {{''').format(**locals()))
+        properties = dict([(p.name, p) for p in i.properties])
+        def emit_case(name, indent):
+            p = properties[name]
+            cpptype_cast = p.cpptype_get_cast
+            # Prepend the class name if this is the generic "TypeWrap" class
+            if cpptype_cast.startswith("TypeWrap"):
+                cpptype_cast = i.cpp_class_name + cpptype_cast
+            emit = self.emit_cpp_p
+            emit("%stry {" % indent)
+            emit("%s    Glib::Variant<%s > castValue = Glib::VariantBase::cast_dynamic<Glib::Variant<%s > >(value);"
+                 % (indent, p.cpptype_get, p.cpptype_get))
+            emit("%s    m_%sValue = %s(castValue.get());" % (indent, p.name, cpptype_cast))
+            emit("%s    m_%sCached = true;" % (indent, p.name))
+            emit("%s} catch (std::bad_cast e) {" % indent)
+            emit('%s    g_warning ("Bad cast when casting %s");' % (indent, p.name))
+            emit("%s}" % indent)
+        self.emit_name_switch(self.emit_cpp_p, "property_name",
+                              [p.name for p in i.properties if p.readable], emit_case)
+        self.emit_cpp_p("}")
+
+        self.emit_cpp_p(template('''
+        void {i.cpp_namespace_name}::load_cached_properties() {{
+            // The properties received by Gio::DBus::Proxy on creation
+            std::vector<Glib::ustring> names = m_proxy->get_cached_property_names();
+            for (const Glib::ustring &name : names) {{
+                Glib::VariantBase value;
+                m_proxy->get_cached_property(value, name);
+                update_property(name, value);
+            }}
+        }}
+
+        void {i.cpp_namespace_name}::handle_properties_changed (const Gio::DBus::Proxy::MapChangedProperties& changed_properties,
+                                                                const std::vector<Glib::ustring>& invalidated_properties) {{
+            for (const auto &property : changed_properties) {{
+                update_property(property.first, property.second);
+            }}''').format(**locals()))
+        def emit_invalidated(name, indent):
+            self.emit_cpp_p("%sm_%sCached = false;" % (indent, name))
+        readable = [p.name for p in i.properties if p.readable]
+        if readable:
+            self.emit_cpp_p("    // Invalidated properties are fetched on the next read")
+            self.emit_cpp_p("    for (const Glib::ustring &property_name : invalidated_properties) {")
+            self.emit_name_switch(self.emit_cpp_p, "property_name", readable,
+                                  emit_invalidated, '        ')
+            self.emit_cpp_p("    }")
+        self.emit_cpp_p(template('''
+        }}
+
+        void {i.cpp_namespace_name}::refresh_properties(const Gio::SlotAsyncReady &slot) {{
+            std::vector<Glib::VariantBase> paramsVec;
+            paramsVec.push_back (Glib::Variant<Glib::ustring>::create("{i.name}"));
+            m_proxy->call("org.freedesktop.DBus.Properties.GetAll",
+                          slot,
+                          Glib::VariantContainerBase::create_tuple(paramsVec));
+        }}
+
+        void {i.cpp_namespace_name}::refresh_properties_finish(const Glib::RefPtr<Gio::AsyncResult> &res) {{
+            Glib::VariantContainerBase result = m_proxy->call_finish(res);
+            Glib::Variant<std::map<Glib::ustring, Glib::VariantBase> > properties;
+            result.get_child(properties, 0);
+            for (const auto &property : properties.get()) {{
+                update_property(property.first, property.second);
+            }}
+        }}
+        ''').format(**locals()))
+
     def generate_signal_handler_proxy(self, i):
         """ Generate a signal handler for Interface i. The signal handler
         dispatches D-Bus signals on internal sigc signals, which application
@@ -404,13 +644,14 @@ class CodeGenerator:
         D-Bus signal, with the _signal suffix appended.
         @param i Interface to generate signal handlers for
         """
-        self.emit_cpp_p(dedent('''
+        self.emit_cpp_p(template('''
             void {i.cpp_namespace_name}::handle_signal (const Glib::ustring& sender_name,
                                                         const Glib::ustring& signal_name,
                                                         const Glib::VariantContainerBase& parameters) {{
         ''').format(**locals()))
 
         # Generate signal handlers for all signals in Interface i
+        signals = {}
         for s in i.signals:
             # Sigc does not allow an infinite number of parameters for signals.
             # The maximum number of signals is specified in SIGNAL_MAX_PARAM. A
@@ -419,20 +660,22 @@ class CodeGenerator:
             if (len(s.args) > SIGNAL_MAX_PARAM):
                 print "WARNING: signal %s has too many parameters, skipping" % s.name
                 continue
+            signals[s.name] = s
 
-            self.emit_cpp_p(dedent('''
-                if (signal_name == "{s.name}") {{''').format(**locals()))
-
+        def emit_case(name, indent):
+            s = signals[name]
             paramsList = []
 
+            if len(s.args) > 0:
+                self.emit_cpp_p("%sif (parameters.get_n_children() != %d) { return; }" % (indent, len(s.args)))
+
             # Generate marshalling code, converting GVariants to std:: types
             for ai in range(len(s.args)):
                 a = s.args[ai]
-                self.emit_cpp_p("        if (parameters.get_n_children() != " + str(len(s.args)) + ") { return; }")
-                self.emit_cpp_p("        Glib::Variant<%s > base_%s;" % (a.cpptype_get, a.name))
-                self.emit_cpp_p("        parameters.get_child(base_%s, %d);" % (a.name, ai))
-                self.emit_cpp_p("        %s p_%s;" % (a.cpptype_get, a.name))
-                self.emit_cpp_p("        p_%s = base_%s.get();" % (a.name, a.name))
+                self.emit_cpp_p("%sGlib::Variant<%s > base_%s;" % (indent, a.cpptype_get, a.name))
+                self.emit_cpp_p("%sparameters.get_child(base_%s, %d);" % (indent, a.name, ai))
+                self.emit_cpp_p("%s%s p_%s;" % (indent, a.cpptype_get, a.name))
+                self.emit_cpp_p("%sp_%s = base_%s.get();" % (indent, a.name, a.name))
                 cpptype_cast = a.cpptype_get_cast
                 # Prepend the class name if this is the generic "TypeWrap" class
                 if cpptype_cast.startswith("TypeWrap"):
@@ -440,10 +683,12 @@ class CodeGenerator:
                 paramsList.append("%s(p_%s)" % (cpptype_cast, a.name))
 
             paramsList = ', '.join(paramsList)
-            self.emit_cpp_p('''        {s.name}_signal.emit({paramsList});'''.format(**locals()))
-            self.emit_cpp_p("}")
+            self.emit_cpp_p('%s%s_signal.emit(%s);' % (indent, s.name, paramsList))
 
-        self.emit_cpp_p(dedent('''
+        self.emit_name_switch(self.emit_cpp_p, "signal_name",
+                              [s.name for s in i.signals if s.name in signals], emit_case)
+
+        self.emit_cpp_p(template('''
             }}
         ''').format(**locals()))
 
@@ -453,7 +698,7 @@ class CodeGenerator:
         the only legal way to create a new proxy.
         @param i Interface to generate creation function for
         """
-        self.emit_cpp_p(dedent('''
+        self.emit_cpp_p(template('''
         void {i.cpp_namespace_name}::createForBus (
             Gio::DBus::BusType busType,
             Gio::DBus::ProxyFlags proxyFlags,
@@ -484,20 +729,20 @@ class CodeGenerator:
             # to avoid any formatting issues when embedding the introspection
             # data in the stub file.
             self.emit_cpp_s ("static const char interfaceXml%d[] = R\"XML_DELIMITER(" % i, False)
-            for char in node_xml:
-                self.emit_cpp_s (char, False)
+            self.emit_cpp_s (node_xml, False)
             self.emit_cpp_s (")XML_DELIMITER\";")
 
     def generate_stub_intro(self):
         """ Generate introduction for stub cpp file """
         self.emit_cpp_s ('#include "%s"' % self.stub_h.name)
+        self.generate_introspection_lookup(self.emit_cpp_s)
 
     def declare_types_stub(self):
         """ Generate types and classes for the stub. This will generate the
         complete class needed for implementing the stub. The code is placed in
         the header file for the stub.
         """
-        self.emit_h_s(dedent('''
+        self.emit_h_s(template('''
         #pragma once
         #include <string>
         #include <glibmm.h>
@@ -510,7 +755,7 @@ class CodeGenerator:
             for ns in i.cpp_namespace_name.split("::")[:-1]:
                 self.emit_h_s ("namespace %s {" % ns)
 
-            self.emit_h_s(dedent('''
+            self.emit_h_s(template('''
             class {i.cpp_class_name} {{
             public:
                 {i.cpp_class_name}();
@@ -519,11 +764,33 @@ class CodeGenerator:
                 guint register_object(const Glib::RefPtr<Gio::DBus::Connection> &connection,
                                       const Glib::ustring &object_path);
 
+                /* Serve the objects <root_path>/<name>, added with add_object(),
+                 * with this single instance. The root implements
+                 * org.freedesktop.DBus.ObjectManager. The properties of each
+                 * object are kept by the instance, see
+                 * <Property>_set(object_path, value). */
+                guint register_subtree(const Glib::RefPtr<Gio::DBus::Connection> &connection,
+                                       const Glib::ustring &root_path);
+                void add_object(const std::string &name);
+                void remove_object(const std::string &name);
+                std::string object_path(const std::string &name) const;
+
+                /* Coalesce the PropertiesChanged signals, see
+                 * gdbus::PropertiesChangedPolicy */
+                void set_properties_changed_policy(gdbus::PropertiesChangedPolicy policy,
+                                                   guint max_latency_ms = 0);
+                void flush();
+
                 // deprecated:
                 void connect(Gio::DBus::BusType, std::string);
             ''').format(**locals()))
             for p in i.properties:
                 self.emit_h_s("    bool {p.name}_set({p.cpptype_in} value);".format(**locals()))
+            # The properties of the objects of a subtree, or of the registered
+            # object if object_path is its path
+            for p in i.properties:
+                self.emit_h_s("    bool {p.name}_set(const std::string &object_path, {p.cpptype_in} value);".format(**locals()))
+                self.emit_h_s("    {p.cpptype_out} {p.name}_get_object(const std::string &object_path);".format(**locals()))
 
             self.emit_h_s("protected:")
 
@@ -547,6 +814,12 @@ class CodeGenerator:
                         * Should return true on sucess and false otherwise.
                         */'''))
                 self.emit_h_s("virtual bool {p.name}_setHandler({p.cpptype_in} value) = 0;".format(**locals()))
+                self.emit_h_s(dedent('''
+                    /* Handle the setting of a property of an object of a subtree, by
+                        * <PropName>_set(object_path, value) or over D-Bus, before it is
+                        * stored. Returns true by default, false rejects the value.
+                        */'''))
+                self.emit_h_s("virtual bool {p.name}_setHandler(const std::string &object_path, {p.cpptype_in} value);".format(**locals()))
 
             # Generate all signals
             for s in i.signals:
@@ -559,10 +832,16 @@ class CodeGenerator:
                     args.append(a.cpptype_out)
 
                 argsStr = ", ".join(args)
-                self.emit_h_s(dedent('''
+                pathArgsStr = ", ".join(["const std::string &object_path"] + args)
+                self.emit_h_s(template('''
                 void {s.name}_emitter({argsStr});
+                void {s.name}_emitter({pathArgsStr});
                 sigc::signal<void, {argsStr} > {s.name}_signal;''').format(**locals()))
 
+            # Unmarshalling of the parameters of the methods
+            self.declare_method_handlers(i, self.emit_h_s)
+            self.declare_object_properties(i, self.emit_h_s)
+
             # Generate the rest of the event handlers
             self.emit_h_s(dedent("""
             void on_bus_acquired(const Glib::RefPtr<Gio::DBus::Connection>& connection,
@@ -597,14 +876,61 @@ class CodeGenerator:
                    const Glib::ustring& property_name,
                    const Glib::VariantBase& value);
 
-            private:
-            bool emitSignal(const std::string& propName, Glib::VariantBase& value);
+            void on_object_manager_call(const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+                               const Glib::ustring& /* sender */,
+                               const Glib::ustring& /* object_path */,
+                               const Glib::ustring& /* interface_name */,
+                               const Glib::ustring& method_name,
+                               const Glib::VariantContainerBase& /* parameters */,
+                               const Glib::RefPtr<Gio::DBus::MethodInvocation>& invocation);
+
+            std::vector<Glib::ustring> on_subtree_enumerate(
+                   const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+                   const Glib::ustring& /* sender */,
+                   const Glib::ustring& /* object_path */);
+
+            std::vector<Glib::RefPtr<Gio::DBus::InterfaceInfo> > on_subtree_introspect(
+                   const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+                   const Glib::ustring& /* sender */,
+                   const Glib::ustring& /* object_path */,
+                   const Glib::ustring& node);
+
+            const Gio::DBus::InterfaceVTable *on_subtree_dispatch(
+                   const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+                   const Glib::ustring& /* sender */,
+                   const Glib::ustring& /* object_path */,
+                   const Glib::ustring& interface_name,
+                   const Glib::ustring& node);
 
-            guint connectionId, registeredId;
-            Glib::RefPtr<Gio::DBus::NodeInfo> introspection_data;
+            private:
+            bool emitSignal(const std::string &objectPath, const std::string& propName, Glib::VariantBase& value);
+            void emitPropertiesChanged(const std::string &objectPath,
+                                       const std::map<Glib::ustring, Glib::VariantBase> &changedProps);
+            bool on_flush_timeout();
+            GVariant *managedObjectInterfaces(const ObjectProperties &object);
+            bool objectIndex(const std::string &object_path, std::vector<std::string>::size_type &index) const;
+
+            guint connectionId, registeredId, subtreeId;
+            std::unique_ptr<Gio::DBus::InterfaceVTable> m_interfaceVTable;
+            std::unique_ptr<Gio::DBus::InterfaceVTable> m_objectManagerVTable;
+            std::unique_ptr<Gio::DBus::SubtreeVTable> m_subtreeVTable;
             Glib::RefPtr<Gio::DBus::Connection> m_connection;
             std::string m_objectPath;
             std::string m_interfaceName;
+            std::string m_subtreeRoot;
+            // Names of the objects below m_subtreeRoot, sorted, and their
+            // properties, m_objectProperties[k] being those of m_objects[k]
+            std::vector<std::string> m_objects;
+            std::vector<ObjectProperties> m_objectProperties;
+            std::mutex m_objectsMutex;
+            gdbus::PropertiesChangedPolicy m_propertiesChangedPolicy;
+            guint m_maxLatency;
+            sigc::connection m_flushSource;
+            // Properties set but not emitted yet, by object path
+            std::map<std::string, std::map<Glib::ustring, Glib::VariantBase> > m_changedProperties;
+            // Guards the policy, the pending properties and the flush source,
+            // as properties can be set from any thread
+            std::mutex m_changedPropertiesMutex;
             };"""))
 
             for ns in reversed(i.cpp_namespace_name.split("::")[:-1]):
@@ -614,8 +940,9 @@ class CodeGenerator:
 
     def define_types_stub_creation(self, i):
         # Constructor
-        self.emit_cpp_s(dedent('''
-        {i.cpp_namespace_name}::{i.cpp_class_name} () : connectionId(0), registeredId(0), m_interfaceName("{i.name}") {{
+        self.emit_cpp_s(template('''
+        {i.cpp_namespace_name}::{i.cpp_class_name} () : connectionId(0), registeredId(0), subtreeId(0), m_interfaceName("{i.name}"),
+            m_propertiesChangedPolicy(gdbus::PropertiesChangedPolicy::Immediate), m_maxLatency(0) {{
         ''').format(**locals()))
         for s in i.signals:
             # Sigc does not allow an infinite number of parameters for signals.
@@ -625,63 +952,10 @@ class CodeGenerator:
             if (len(s.args) > SIGNAL_MAX_PARAM):
                 print "WARNING: signal %s has too many parameters, skipping" % s.name
                 continue
-            self.emit_cpp_s("    {s.name}_signal.connect(sigc::mem_fun(this, &{i.cpp_class_name}::{s.name}_emitter));".format(**locals()))
-        #TODO: This code will only fetch introspection data for interfaces
-        # contained in the first interfaceXml variable. We need to check which
-        # interfaceXml variable contains our XML, and use the correct one
-        # instead. This code will break if there are several introspection XML
-        # files specified.
-        self.emit_cpp_s(dedent('''
-        }}
-
-        {i.cpp_namespace_name}::~{i.cpp_class_name}()
-        {{
-        }}
-
-        guint {i.cpp_namespace_name}::register_object(
-            const Glib::RefPtr<Gio::DBus::Connection> &connection,
-            const Glib::ustring &object_path)
-        {{
-            if (!m_objectPath.empty() && m_objectPath != object_path) {{
-                g_warning("Cannot register the same object twice!");
-
-                return 0;
-            }}
-            try {{
-                    introspection_data = Gio::DBus::NodeInfo::create_for_xml(interfaceXml0);
-            }} catch(const Glib::Error& ex) {{
-                    g_warning("Unable to create introspection data: ");
-                    g_warning("%s\\n", ex.what().c_str());
-            }}
-            Gio::DBus::InterfaceVTable *interface_vtable =
-                new Gio::DBus::InterfaceVTable(
-                    sigc::mem_fun(this, &{i.cpp_class_name}::on_method_call),
-                    sigc::mem_fun(this, &{i.cpp_class_name}::on_interface_get_property),
-                    sigc::mem_fun(this, &{i.cpp_class_name}::on_interface_set_property));
-            guint id = 0;
-            try {{
-                id = connection->register_object(object_path,
-                    introspection_data->lookup_interface("{i.name}"),
-                    *interface_vtable);
-                m_connection = connection;
-                m_objectPath = object_path;
-            }}
-            catch(const Glib::Error &ex) {{
-                g_warning("Registration of object failed");
-            }}
-            return id;
-        }}
-
-        void {i.cpp_namespace_name}::connect (
-            Gio::DBus::BusType busType,
-            std::string name)
-        {{
-            connectionId = Gio::DBus::own_name(busType,
-                                               name,
-                                               sigc::mem_fun(this, &{i.cpp_class_name}::on_bus_acquired),
-                                               sigc::mem_fun(this, &{i.cpp_class_name}::on_name_acquired),
-                                               sigc::mem_fun(this, &{i.cpp_class_name}::on_name_lost));
-        }}''').format(**locals()))
+            argsStr = ", ".join([a.cpptype_out for a in s.args])
+            self.emit_cpp_s("    {s.name}_signal.connect(sigc::mem_fun(this, static_cast<void ({i.cpp_class_name}::*)({argsStr})>(&{i.cpp_class_name}::{s.name}_emitter)));".format(**locals()))
+        self.emit_cpp_s("}")
+        self.define_registration(i, self.emit_cpp_s)
 
 
     def define_types_method_handlers_stub(self, i):
@@ -690,112 +964,21 @@ class CodeGenerator:
         parameter types converted to std:: c++ types.
         @param Interface i is the interface to generate method handlers for
         """
-        self.emit_cpp_s(dedent('''
-        void {i.cpp_namespace_name}::on_method_call(const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
-                           const Glib::ustring& /* sender */,
-                           const Glib::ustring& /* object_path */,
-                           const Glib::ustring& /* interface_name */,
-                           const Glib::ustring& method_name,
-                           const Glib::VariantContainerBase& parameters,
-                           const Glib::RefPtr<Gio::DBus::MethodInvocation>& invocation)
-        {{
-        ''').format(**locals()))
-        for m in i.methods:
-            #TODO: Make more thorough checks here. Method name is not enough.
-            self.emit_cpp_s("    if (method_name.compare(\"%s\") == 0) {" % m.name)
-            for ai in range(len(m.in_args)):
-                a = m.in_args[ai]
-                if a.signature == "v":
-                    # Variants are deconstructed differently than the other types
-                    self.emit_cpp_s("        Glib::VariantContainerBase containerBase = parameters;")
-                    self.emit_cpp_s("        GVariant *output%s;" % (ai))
-                    self.emit_cpp_s('        g_variant_get_child(containerBase.gobj(), %s, "v", &output%s);' % (ai, ai))
-                    self.emit_cpp_s("        Glib::VariantBase p_%s;" % (a.name))
-                    self.emit_cpp_s("        p_%s = Glib::VariantBase(output%s);" % (a.name, ai))
-                    self.emit_cpp_s("")
-                else:
-                    self.emit_cpp_s("        Glib::Variant<%s > base_%s;" % (a.cpptype_get, a.name))
-                    self.emit_cpp_s("        parameters.get_child(base_%s, %d);" % (a.name, ai))
-                    self.emit_cpp_s("        %s p_%s;" % (a.cpptype_get, a.name))
-                    self.emit_cpp_s("        p_%s = base_%s.get();" % (a.name, a.name))
-                    self.emit_cpp_s("")
-            self.emit_cpp_s("        %s(" % m.name)
-            for a in m.in_args:
-                cpptype_cast = a.cpptype_get_cast
-                # Prepend the class name if this is the generic "TypeWrap" class
-                if cpptype_cast.startswith("TypeWrap"):
-                    cpptype_cast = i.cpp_class_name + cpptype_cast
-                self.emit_cpp_s("            %s(p_%s)," % (cpptype_cast, a.name))
-            self.emit_cpp_s("            {i.cpp_class_name}MessageHelper(invocation));".format(**locals()))
-            self.emit_cpp_s("    }")
-        self.emit_cpp_s("    }")
+        self.define_method_handlers(i, self.emit_cpp_s)
+        self.emit_cpp_s("}")
 
     def define_types_property_get_handlers_stub(self, i):
-        object_path = "/" + i.name.replace(".", "/")
-
-        self.emit_cpp_s(dedent('''
-        void {i.cpp_namespace_name}::on_interface_get_property(Glib::VariantBase& property,
-                                               const Glib::RefPtr<Gio::DBus::Connection>& connection,
-                                               const Glib::ustring& sender,
-                                               const Glib::ustring& object_path,
-                                               const Glib::ustring& interface_name,
-                                               const Glib::ustring& property_name) {{
-        ''').format(**locals()))
-
-        for p in i.properties:
-            if p.readable:
-                cpptype_to_dbus = p.cpptype_to_dbus
-                # Prepend the class name if this is the generic "TypeWrap" class
-                if cpptype_to_dbus.startswith("TypeWrap"):
-                    cpptype_to_dbus = i.cpp_class_name + cpptype_to_dbus
-                self.emit_cpp_s(dedent('''
-                    if (property_name.compare("{p.name}") == 0) {{
-                        property = Glib::Variant<{p.cpptype_get} >::create({cpptype_to_dbus}({p.name}_get()));
-                    }}
-                ''').format(**locals()))
-
+        self.define_property_get_handler(i, self.emit_cpp_s)
         self.emit_cpp_s("}")
 
     def define_types_property_set_handlers_stub(self, i):
-        object_path = "/" + i.name.replace(".", "/")
-        self.emit_cpp_s(dedent('''
-        bool {i.cpp_namespace_name}::on_interface_set_property(
-               const Glib::RefPtr<Gio::DBus::Connection>& connection,
-               const Glib::ustring& sender,
-               const Glib::ustring& object_path,
-               const Glib::ustring& interface_name,
-               const Glib::ustring& property_name,
-               const Glib::VariantBase& value) {{
-        ''').format(**locals()))
-
-        for p in i.properties:
-            self.emit_cpp_s(dedent('''
-                if (property_name.compare("{p.name}") == 0) {{
-                    try {{
-                        Glib::Variant<{p.cpptype_get} > castValue = Glib::VariantBase::cast_dynamic<Glib::Variant<{p.cpptype_get} > >(value);
-                        {p.cpptype_out} val;''').format(**locals()))
-            cpptype_cast = p.cpptype_get_cast
-            # Prepend the class name if this is the generic "TypeWrap" class
-            if cpptype_cast.startswith("TypeWrap"):
-                cpptype_cast = i.cpp_class_name + cpptype_cast
-            self.emit_cpp_s(dedent('''
-                        val = {cpptype_cast}(castValue.get());''').format(**locals()))
-            self.emit_cpp_s('''        {p.name}_set(val);'''.format(**locals()))
-            self.emit_cpp_s(dedent('''
-                    }} catch (std::bad_cast e) {{
-                        g_warning ("Bad cast when casting {p.name}");
-                    }}
-                }}
-            ''').format(**locals()))
-
-        self.emit_cpp_s(dedent('''
+        self.define_property_set_handler(i, self.emit_cpp_s)
+        self.emit_cpp_s(template('''
             return true;
         }}
         ''').format(**locals()))
 
     def define_types_signal_emitters_stub(self, i):
-        object_path = "/" + i.name.replace(".", "/")
-
         for s in i.signals:
             # Sigc does not allow an infinite number of parameters for signals.
             # The maximum number of signals is specified in SIGNAL_MAX_PARAM. A
@@ -810,7 +993,13 @@ class CodeGenerator:
                 args.append(a.cpptype_out + " " + a.name)
 
             argsStr = ", ".join(args)
-            self.emit_cpp_s(dedent('''void {i.cpp_namespace_name}::{s.name}_emitter({argsStr}) {{
+            pathArgsStr = ", ".join(["const std::string &object_path"] + args)
+            namesStr = ", ".join(["m_objectPath"] + [a.name for a in s.args])
+            self.emit_cpp_s(template('''void {i.cpp_namespace_name}::{s.name}_emitter({argsStr}) {{
+                {s.name}_emitter({namesStr});
+            }}
+
+            void {i.cpp_namespace_name}::{s.name}_emitter({pathArgsStr}) {{
             std::vector<Glib::VariantBase> paramsList;''').format(**locals()))
 
             for a in s.args:
@@ -818,12 +1007,12 @@ class CodeGenerator:
                 # Prepend the class name if this is the generic "TypeWrap" class
                 if cpptype_to_dbus.startswith("TypeWrap"):
                     cpptype_to_dbus = i.cpp_class_name + cpptype_to_dbus
-                self.emit_cpp_s(dedent('''
+                self.emit_cpp_s(template('''
                 paramsList.push_back(Glib::Variant<{a.cpptype_get} >::create({cpptype_to_dbus}({a.name})));;
                 ''').format(**locals()))
 
-            self.emit_cpp_s(dedent('''      m_connection->emit_signal(
-                    "{object_path}",
+            self.emit_cpp_s(template('''      m_connection->emit_signal(
+                    object_path,
                     "{s.iface_name}",
                     "{s.name}",
                     Glib::ustring(),
@@ -832,7 +1021,7 @@ class CodeGenerator:
 
     def define_types_dbus_callbacks_stub(self, i):
         object_path = "/" + i.name.replace(".", "/")
-        self.emit_cpp_s(dedent('''
+        self.emit_cpp_s(template('''
         void {i.cpp_namespace_name}::on_bus_acquired(const Glib::RefPtr<Gio::DBus::Connection>& connection,
                                  const Glib::ustring& /* name */) {{
             registeredId = register_object(connection,
@@ -854,43 +1043,27 @@ class CodeGenerator:
             # Prepend the class name if this is the generic "TypeWrap" class
             if cpptype_to_dbus.startswith("TypeWrap"):
                 cpptype_to_dbus = i.cpp_class_name + cpptype_to_dbus
-            self.emit_cpp_s(dedent('''
+            self.emit_cpp_s(template('''
             bool {i.cpp_namespace_name}::{p.name}_set({p.cpptype_in} value) {{
                 if ({p.name}_setHandler(value)) {{
                     Glib::Variant<{p.cpptype_get} > value_get = Glib::Variant<{p.cpptype_get} >::create({cpptype_to_dbus}({p.name}_get()));
-                    emitSignal("{p.name}", value_get);
+                    emitSignal(m_objectPath, "{p.name}", value_get);
                     return true;
                 }}
 
                 return false;
-            }}''').format(**locals()))
-
-    def define_types_emit_stub(self, i):
-            self.emit_cpp_s(dedent('''
-            bool {i.cpp_namespace_name}::emitSignal(const std::string& propName, Glib::VariantBase& value) {{
-                std::map<Glib::ustring, Glib::VariantBase> changedProps;
-                std::vector<Glib::ustring> changedPropsNoValue;
-
-                changedProps[propName] = value;
-
-                Glib::Variant<std::map<Glib::ustring,  Glib::VariantBase> > changedPropsVar = Glib::Variant<std::map <Glib::ustring, Glib::VariantBase> >::create (changedProps);
-                Glib::Variant<std::vector<Glib::ustring> > changedPropsNoValueVar = Glib::Variant<std::vector<Glib::ustring> >::create(changedPropsNoValue);
-                std::vector<Glib::VariantBase> ps;
-                ps.push_back(Glib::Variant<Glib::ustring>::create(m_interfaceName));
-                ps.push_back(changedPropsVar);
-                ps.push_back(changedPropsNoValueVar);
-                Glib::VariantContainerBase propertiesChangedVariant = Glib::Variant<std::vector<Glib::VariantBase> >::create_tuple(ps);
-
-                m_connection->emit_signal(
-                    m_objectPath,
-                    "org.freedesktop.DBus.Properties",
-                    "PropertiesChanged",
-                    Glib::ustring(),
-                    propertiesChangedVariant);
+            }}
 
+            bool {i.cpp_namespace_name}::{p.name}_setHandler(const std::string & /* object_path */,
+                                                            {p.cpptype_in} /* value */) {{
                 return true;
             }}''').format(**locals()))
 
+    def define_types_emit_stub(self, i):
+        self.emit_cpp_s(template('''
+        bool {i.cpp_namespace_name}::emitSignal(const std::string &objectPath, const std::string& propName, Glib::VariantBase& value) {{''').format(**locals()))
+        self.define_properties_changed(i, self.emit_cpp_s)
+
     ### Promises   
     def generate_promise_introspection(self):
         """ Generate introspection XML for all introspection XML files """
@@ -901,22 +1074,30 @@ class CodeGenerator:
             # to avoid any formatting issues when embedding the introspection
             # data in the stub file.
             self.emit_metadata ("static const char interfaceXml%d[] = R\"XML_DELIMITER(" % i, False)
-            for char in node_xml:
-                self.emit_metadata (char, False)
+            self.emit_metadata (node_xml, False)
             self.emit_metadata (")XML_DELIMITER\";")
-            pass
 
     def generate_promise_intro(self):
         """ Generate introduction for promise cpp file """
         self.emit_cpp_f ('#include "%s"' % self.promise_h.name)
         self.emit_cpp_f ('#include "%s"' % self.metadata_h.name)
+        self.generate_introspection_lookup(self.emit_cpp_f)
+
+    def method_tuple_promise(self, i, m):
+        """ The type of the pm_<Method> promise of method m: a tuple of its
+        in arguments and the message helper
+        """
+        mtuple = "std::tuple<"
+        for a in m.in_args:
+            mtuple += "%s," % (a.cpptype_in)
+        return mtuple + "{i.cpp_class_name}MessageHelper>".format(**locals())
 
     def declare_types_promise(self):
         """ Generate types and classes for the promise. This will generate the
         complete class needed for implementing the promises. The code is placed in
         the header file for the promise.
         """
-        self.emit_h_f(dedent('''
+        self.emit_h_f(template('''
         #pragma once
         #include <string>
         #include <glibmm.h>
@@ -931,7 +1112,7 @@ class CodeGenerator:
             for ns in i.cpp_namespace_name.split("::")[:-1]:
                 self.emit_h_f ("namespace %s {" % ns)
 
-            self.emit_h_f(dedent('''
+            self.emit_h_f(template('''
             class {i.cpp_class_name} {{
             public:
                 {i.cpp_class_name}();
@@ -940,11 +1121,44 @@ class CodeGenerator:
                 guint register_object(const Glib::RefPtr<Gio::DBus::Connection> &connection,
                                       const Glib::ustring &object_path);
 
+                /* Serve the objects <root_path>/<name>, added with add_object(),
+                 * with this single instance. The root implements
+                 * org.freedesktop.DBus.ObjectManager. The properties of each
+                 * object are kept by the instance, see
+                 * <Property>_set(object_path, value). */
+                guint register_subtree(const Glib::RefPtr<Gio::DBus::Connection> &connection,
+                                       const Glib::ustring &root_path);
+                void add_object(const std::string &name);
+                void remove_object(const std::string &name);
+                std::string object_path(const std::string &name) const;
+
+                /* Coalesce the PropertiesChanged signals, see
+                 * gdbus::PropertiesChangedPolicy */
+                void set_properties_changed_policy(gdbus::PropertiesChangedPolicy policy,
+                                                   guint max_latency_ms = 0);
+                void flush();
+
+                /* Readable whenever pm_wakeUp or pp_wakeUp is triggered, to
+                 * wait for calls and property changes in a main loop (see
+                 * luxpromise_glib.h) or with poll()/epoll */
+                lux::notifier &wakeup_notifier();
+
+                /* Read the calls written to the pm_<Method> promises in the
+                 * calling thread, passing them to <Method>_dispatch(), until
+                 * end_dispatch() is called */
+                void dispatch_loop();
+                void end_dispatch();
+
                 // deprecated:
                 void connect(Gio::DBus::BusType, std::string);
             ''').format(**locals()))
             for p in i.properties:
                 self.emit_h_f("    bool {p.name}_set({p.cpptype_in} value);".format(**locals()))
+            # The properties of the objects of a subtree, or of the registered
+            # object if object_path is its path
+            for p in i.properties:
+                self.emit_h_f("    bool {p.name}_set(const std::string &object_path, {p.cpptype_in} value);".format(**locals()))
+                self.emit_h_f("    {p.cpptype_out} {p.name}_get_object(const std::string &object_path);".format(**locals()))
 
             self.emit_h_f("protected:")
 
@@ -956,18 +1170,52 @@ class CodeGenerator:
                 for a in m.in_args:
                     self.emit_h_f("    %s %s," % (a.cpptype_in, a.name))
 
-                self.emit_h_f(dedent('''{i.cpp_class_name}MessageHelper msg) {{
+                # create the method tuple
+                mtuple = self.method_tuple_promise(i, m)
+
+                if m.queue_capacity is None:
+                    self.emit_h_f(template('''{i.cpp_class_name}MessageHelper msg) {{
 
-                                     }}'''.format(**locals())))
+                                     }}''').format(**locals()))
 
-                # create the method tuple
-                mtuple = "std::tuple<"
+                    # promise
+                    self.emit_h_f("lux::promise<{mtuple}, lux::ptype::method> pm_{m.name};".format(**locals()))
+                else:
+                    # Queued without blocking the main loop, the call is refused
+                    # if the queue is full (lux::overflow::reject) or its
+                    # updates have ended. The oldest call dropped for it
+                    # (lux::overflow::drop_oldest) is refused the same way.
+                    tuple_args = ''.join([a.name + ', ' for a in m.in_args])
+                    def emit_limits_exceeded(helper):
+                        call = "        %s.ret(Gio::DBus::Error(" % helper
+                        self.emit_h_f(call + "Gio::DBus::Error::LIMITS_EXCEEDED,")
+                        self.emit_h_f(" " * len(call) + "\"Too many pending calls of %s\"));" % m.name)
+                    self.emit_h_f("{i.cpp_class_name}MessageHelper msg) {{".format(**locals()))
+                    if m.queue_overflow == "drop_oldest":
+                        msg_index = len(m.in_args)
+                        self.emit_h_f("    {mtuple} evicted;".format(**locals()))
+                        self.emit_h_f("    bool dropped;")
+                        self.emit_h_f("    if (!pm_{m.name}.try_push({mtuple}({tuple_args}msg), evicted, dropped)) {{".format(**locals()))
+                        emit_limits_exceeded("msg")
+                        self.emit_h_f("    } else if (dropped) {")
+                        emit_limits_exceeded("std::get<%d>(evicted)" % msg_index)
+                        self.emit_h_f("    }")
+                    else:
+                        self.emit_h_f("    if (!pm_{m.name}.try_push({mtuple}({tuple_args}msg))) {{".format(**locals()))
+                        emit_limits_exceeded("msg")
+                        self.emit_h_f("    }")
+                    self.emit_h_f("}")
+                    self.emit_h_f("lux::queue_promise<{mtuple}> pm_{m.name}{{{m.queue_capacity}, lux::overflow::{m.queue_overflow}}};".format(**locals()))
+
+                # Called by dispatch_loop(), the calls of the methods which
+                # are not overridden are answered with NotSupported
+                self.emit_h_f("virtual void %s_dispatch (" % m.name)
                 for a in m.in_args:
-                    mtuple += "%s," % (a.cpptype_in)
-                mtuple += "{i.cpp_class_name}MessageHelper>".format(**locals())
-                
-                # promise
-                self.emit_h_f("lux::promise<{mtuple}, lux::ptype::method> pm_{m.name};".format(**locals()))
+                    self.emit_h_f("    %s %s," % (a.cpptype_in, a.name))
+                self.emit_h_f("{i.cpp_class_name}MessageHelper msg) {{".format(**locals()))
+                self.emit_h_f("    msg.ret(Gio::DBus::Error(Gio::DBus::Error::NOT_SUPPORTED,")
+                self.emit_h_f("                             \"{m.name} is not implemented\"));".format(**locals()))
+                self.emit_h_f("}")
 
             # wake-up promise for methods
             self.emit_h_f(dedent('''
@@ -986,15 +1234,25 @@ class CodeGenerator:
             # Generate getters and setters for all properties, and the promises and futures as well
             for p in i.properties:
                 self.emit_h_f("\nvirtual {p.cpptype_out} {p.name}_get();".format(**locals()))
-                self.emit_h_f("lux::promise<{p.cpptype_out}, lux::ptype::property> pp_{p.name};".format(**locals()))
-                self.emit_h_f(dedent('''
+                if p.read_mostly:
+                    self.emit_h_f("lux::snapshot_promise<{p.cpptype_out}> pp_{p.name};".format(**locals()))
+                else:
+                    self.emit_h_f("lux::promise<{p.cpptype_out}, lux::ptype::property> pp_{p.name};".format(**locals()))
+                self.emit_h_f(template('''
                     /** {p.name}_setHandler({p.cpptype_in} value) -- Handle the setting of a property
                      *  This method will be called as a result of a call to <PropName>_set
                      *  and will result in the actual property being set and triggered.
                      *  As a virtual function can also be overriden to provide special behavior,
                      *  if desiered.
-                     */'''.format(**locals())))
+                     */''').format(**locals()))
                 self.emit_h_f("virtual bool {p.name}_setHandler({p.cpptype_in} value);".format(**locals()))
+                self.emit_h_f(template('''
+                    /** {p.name}_setHandler(object_path, value) -- Handle the setting of a
+                     *  property of an object of a subtree, by <PropName>_set(object_path, value)
+                     *  or over D-Bus, before it is stored. Calls property_wakeUp() by
+                     *  default, returning false rejects the value.
+                     */''').format(**locals()))
+                self.emit_h_f("virtual bool {p.name}_setHandler(const std::string &object_path, {p.cpptype_in} value);".format(**locals()))
                 
             # wakeup promise for properties
             self.emit_h_f(dedent('''
@@ -1022,10 +1280,16 @@ class CodeGenerator:
                     args.append(a.cpptype_out)
 
                 argsStr = ", ".join(args)
-                self.emit_h_f(dedent('''
+                pathArgsStr = ", ".join(["const std::string &object_path"] + args)
+                self.emit_h_f(template('''
                 void {s.name}_emitter({argsStr});
+                void {s.name}_emitter({pathArgsStr});
                 sigc::signal<void, {argsStr} > {s.name}_signal;''').format(**locals()))
 
+            # Unmarshalling of the parameters of the methods
+            self.declare_method_handlers(i, self.emit_h_f)
+            self.declare_object_properties(i, self.emit_h_f)
+
             # Generate the rest of the event handlers
             self.emit_h_f(dedent("""
             void on_bus_acquired(const Glib::RefPtr<Gio::DBus::Connection>& connection,
@@ -1060,14 +1324,62 @@ class CodeGenerator:
                    const Glib::ustring& property_name,
                    const Glib::VariantBase& value);
 
-            private:
-            bool emitSignal(const std::string& propName, Glib::VariantBase& value);
+            void on_object_manager_call(const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+                               const Glib::ustring& /* sender */,
+                               const Glib::ustring& /* object_path */,
+                               const Glib::ustring& /* interface_name */,
+                               const Glib::ustring& method_name,
+                               const Glib::VariantContainerBase& /* parameters */,
+                               const Glib::RefPtr<Gio::DBus::MethodInvocation>& invocation);
+
+            std::vector<Glib::ustring> on_subtree_enumerate(
+                   const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+                   const Glib::ustring& /* sender */,
+                   const Glib::ustring& /* object_path */);
+
+            std::vector<Glib::RefPtr<Gio::DBus::InterfaceInfo> > on_subtree_introspect(
+                   const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+                   const Glib::ustring& /* sender */,
+                   const Glib::ustring& /* object_path */,
+                   const Glib::ustring& node);
+
+            const Gio::DBus::InterfaceVTable *on_subtree_dispatch(
+                   const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+                   const Glib::ustring& /* sender */,
+                   const Glib::ustring& /* object_path */,
+                   const Glib::ustring& interface_name,
+                   const Glib::ustring& node);
 
-            guint connectionId, registeredId;
-            Glib::RefPtr<Gio::DBus::NodeInfo> introspection_data;
+            private:
+            bool emitSignal(const std::string &objectPath, const std::string& propName, Glib::VariantBase& value);
+            void emitPropertiesChanged(const std::string &objectPath,
+                                       const std::map<Glib::ustring, Glib::VariantBase> &changedProps);
+            bool on_flush_timeout();
+            GVariant *managedObjectInterfaces(const ObjectProperties &object);
+            bool objectIndex(const std::string &object_path, std::vector<std::string>::size_type &index) const;
+
+            guint connectionId, registeredId, subtreeId;
+            std::unique_ptr<Gio::DBus::InterfaceVTable> m_interfaceVTable;
+            std::unique_ptr<Gio::DBus::InterfaceVTable> m_objectManagerVTable;
+            std::unique_ptr<Gio::DBus::SubtreeVTable> m_subtreeVTable;
             Glib::RefPtr<Gio::DBus::Connection> m_connection;
             std::string m_objectPath;
             std::string m_interfaceName;
+            std::string m_subtreeRoot;
+            // Names of the objects below m_subtreeRoot, sorted, and their
+            // properties, m_objectProperties[k] being those of m_objects[k]
+            std::vector<std::string> m_objects;
+            std::vector<ObjectProperties> m_objectProperties;
+            std::mutex m_objectsMutex;
+            gdbus::PropertiesChangedPolicy m_propertiesChangedPolicy;
+            guint m_maxLatency;
+            sigc::connection m_flushSource;
+            // Properties set but not emitted yet, by object path
+            std::map<std::string, std::map<Glib::ustring, Glib::VariantBase> > m_changedProperties;
+            // Guards the policy, the pending properties and the flush source,
+            // as properties can be set from any thread
+            std::mutex m_changedPropertiesMutex;
+            lux::notifier m_wakeUpNotifier;
             };"""))
 
             for ns in reversed(i.cpp_namespace_name.split("::")[:-1]):
@@ -1077,8 +1389,9 @@ class CodeGenerator:
         
     def define_types_promise_creation(self, i):
         ## Constructor
-        self.emit_cpp_f(dedent('''
-        {i.cpp_namespace_name}::{i.cpp_class_name} () : connectionId(0), registeredId(0), m_interfaceName("{i.name}") {{
+        self.emit_cpp_f(template('''
+        {i.cpp_namespace_name}::{i.cpp_class_name} () : connectionId(0), registeredId(0), subtreeId(0), m_interfaceName("{i.name}"),
+            m_propertiesChangedPolicy(gdbus::PropertiesChangedPolicy::Immediate), m_maxLatency(0) {{
         ''').format(**locals()))
         self.emit_cpp_f("    /// Signals conections")
         for s in i.signals:
@@ -1089,193 +1402,83 @@ class CodeGenerator:
             if (len(s.args) > SIGNAL_MAX_PARAM):
                 print "WARNING: signal %s has too many parameters, skipping" % s.name
                 continue
-            self.emit_cpp_f("    {s.name}_signal.connect(sigc::mem_fun(this, &{i.cpp_class_name}::{s.name}_emitter));".format(**locals()))
-        #TODO: This code will only fetch introspection data for interfaces
-        # contained in the first interfaceXml variable. We need to check which
-        # interfaceXml variable contains our XML, and use the correct one
-        # instead. This code will break if there are several introspection XML
-        # files specified.
-        
-        ## The rest...
-        self.emit_cpp_f(dedent('''
+            argsStr = ", ".join([a.cpptype_out for a in s.args])
+            self.emit_cpp_f("    {s.name}_signal.connect(sigc::mem_fun(this, static_cast<void ({i.cpp_class_name}::*)({argsStr})>(&{i.cpp_class_name}::{s.name}_emitter)));".format(**locals()))
+        self.emit_cpp_f("    pm_wakeUp.attach(&m_wakeUpNotifier);")
+        self.emit_cpp_f("    pp_wakeUp.attach(&m_wakeUpNotifier);")
+        self.emit_cpp_f("}")
+        self.define_registration(i, self.emit_cpp_f)
+
+    def define_types_method_handlers_promise(self, i):
+        """ Generate code for handling and dispatching method calls in the
+        promise. This code will trigger the correct user-defined function with
+        parameter types converted to std:: c++ types.
+        @param Interface i is the interface to generate method handlers for
+        """
+        self.define_method_handlers(i, self.emit_cpp_f)
+        self.emit_cpp_f("    method_wakeUp();")
+        self.emit_cpp_f("}")
+
+    def define_wakups_promise(self, i):
+        self.emit_cpp_f(template('''
+        void {i.cpp_namespace_name}::method_wakeUp() {{
+          pm_wakeUp = true; // dummy assign to trigger the wakeup
         }}
 
-        {i.cpp_namespace_name}::~{i.cpp_class_name}()
-        {{
+        void {i.cpp_namespace_name}::property_wakeUp() {{
+          pp_wakeUp = true; // dummy assign to trigger the wakeup
         }}
 
-        guint {i.cpp_namespace_name}::register_object(
-            const Glib::RefPtr<Gio::DBus::Connection> &connection,
-            const Glib::ustring &object_path)
-        {{
-            if (!m_objectPath.empty() && m_objectPath != object_path) {{
-                g_warning("Cannot register the same object twice!");
+        lux::notifier &{i.cpp_namespace_name}::wakeup_notifier() {{
+          return m_wakeUpNotifier;
+        }}
+        ''').format(**locals()))
 
-                return 0;
-            }}
-            try {{
-                    introspection_data = Gio::DBus::NodeInfo::create_for_xml(interfaceXml0);
-            }} catch(const Glib::Error& ex) {{
-                    g_warning("Unable to create introspection data: ");
-                    g_warning("%s\\n", ex.what().c_str());
-            }}
-            Gio::DBus::InterfaceVTable *interface_vtable =
-                new Gio::DBus::InterfaceVTable(
-                    sigc::mem_fun(this, &{i.cpp_class_name}::on_method_call),
-                    sigc::mem_fun(this, &{i.cpp_class_name}::on_interface_get_property),
-                    sigc::mem_fun(this, &{i.cpp_class_name}::on_interface_set_property));
-            guint id = 0;
-            try {{
-                id = connection->register_object(object_path,
-                    introspection_data->lookup_interface("{i.name}"),
-                    *interface_vtable);
-                m_connection = connection;
-                m_objectPath = object_path;
-            }}
-            catch(const Glib::Error &ex) {{
-                g_warning("Registration of object failed");
-            }}
-            return id;
-        }}
-
-        void {i.cpp_namespace_name}::connect (
-            Gio::DBus::BusType busType,
-            std::string name)
-        {{
-            connectionId = Gio::DBus::own_name(busType,
-                                               name,
-                                               sigc::mem_fun(this, &{i.cpp_class_name}::on_bus_acquired),
-                                               sigc::mem_fun(this, &{i.cpp_class_name}::on_name_acquired),
-                                               sigc::mem_fun(this, &{i.cpp_class_name}::on_name_lost));
-        }}''').format(**locals()))
-        pass        
-
-    def define_types_method_handlers_promise(self, i):
-        """ Generate code for handling and dispatching method calls in the
-        promise. This code will trigger the correct user-defined function with
-        parameter types converted to std:: c++ types.
-        @param Interface i is the interface to generate method handlers for
+    def define_dispatch_loop_promise(self, i):
+        """ Generate dispatch_loop(), waiting on all the pm_<Method> promises
+        with a lux::selector, and end_dispatch()
         """
-        self.emit_cpp_f(dedent('''
-        void {i.cpp_namespace_name}::on_method_call(const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
-                           const Glib::ustring& /* sender */,
-                           const Glib::ustring& /* object_path */,
-                           const Glib::ustring& /* interface_name */,
-                           const Glib::ustring& method_name,
-                           const Glib::VariantContainerBase& parameters,
-                           const Glib::RefPtr<Gio::DBus::MethodInvocation>& invocation)
-        {{
-        ''').format(**locals()))
+        self.emit_cpp_f(template('''
+        void {i.cpp_namespace_name}::dispatch_loop() {{
+            lux::selector selector;''').format(**locals()))
         for m in i.methods:
-            #TODO: Make more thorough checks here. Method name is not enough.
-            #TODO: The string of if statements should really be if else or case statments 
-            self.emit_cpp_f("    if (method_name.compare(\"%s\") == 0) {" % m.name)
-            for ai in range(len(m.in_args)):
-                a = m.in_args[ai]
-                if a.signature == "v":
-                    # Variants are deconstructed differently than the other types
-                    self.emit_cpp_f("        Glib::VariantContainerBase containerBase = parameters;")
-                    self.emit_cpp_f("        GVariant *output%s;" % (ai))
-                    self.emit_cpp_f('        g_variant_get_child(containerBase.gobj(), %s, "v", &output%s);' % (ai, ai))
-                    self.emit_cpp_f("        Glib::VariantBase p_%s;" % (a.name))
-                    self.emit_cpp_f("        p_%s = Glib::VariantBase(output%s);" % (a.name, ai))
-                    self.emit_cpp_f("")
-                else:
-                    self.emit_cpp_f("        Glib::Variant<%s > base_%s;" % (a.cpptype_get, a.name))
-                    self.emit_cpp_f("        parameters.get_child(base_%s, %d);" % (a.name, ai))
-                    self.emit_cpp_f("        %s p_%s;" % (a.cpptype_get, a.name))
-                    self.emit_cpp_f("        p_%s = base_%s.get();" % (a.name, a.name))
-                    self.emit_cpp_f("")
-            self.emit_cpp_f("        %s(" % m.name)
-            for a in m.in_args:
-                cpptype_cast = a.cpptype_get_cast
-                # Prepend the class name if this is the generic "TypeWrap" class
-                if cpptype_cast.startswith("TypeWrap"):
-                    cpptype_cast = i.cpp_class_name + cpptype_cast
-                self.emit_cpp_f("            %s(p_%s)," % (cpptype_cast, a.name))
-            self.emit_cpp_f("            {i.cpp_class_name}MessageHelper(invocation));".format(**locals()))
-            self.emit_cpp_f("    }")
-        self.emit_cpp_f("    method_wakeUp();")
+            self.emit_cpp_f("    selector.add(pm_{m.name});".format(**locals()))
+        self.emit_cpp_f("")
+        self.emit_cpp_f("    int index;")
+        self.emit_cpp_f("    while ((index = selector.wait_any()) >= 0) {")
+        self.emit_cpp_f("        switch (index) {")
+        for (index, m) in enumerate(i.methods):
+            mtuple = self.method_tuple_promise(i, m)
+            call_args = ', '.join(['std::get<%d>(call)' % n for n in range(len(m.in_args) + 1)])
+            self.emit_cpp_f("        case {index}: {{".format(**locals()))
+            self.emit_cpp_f("            {mtuple} call;".format(**locals()))
+            self.emit_cpp_f("            if (pm_{m.name}.try_get(call) == lux::status::ready) {{".format(**locals()))
+            self.emit_cpp_f("                {m.name}_dispatch({call_args});".format(**locals()))
+            self.emit_cpp_f("            }")
+            self.emit_cpp_f("            break;")
+            self.emit_cpp_f("        }")
+        self.emit_cpp_f("        }")
         self.emit_cpp_f("    }")
-
-    def define_wakups_promise(self, i):
-        self.emit_cpp_f(dedent('''
-        void {i.cpp_namespace_name}::method_wakeUp() {{
-          pm_wakeUp = true; // dummy assign to trigger the wakeup
-        }}
-
-        void {i.cpp_namespace_name}::property_wakeUp() {{
-          pp_wakeUp = true; // dummy assign to trigger the wakeup
-        }}
-        ''').format(**locals()))
+        self.emit_cpp_f("}")
+        self.emit_cpp_f(template('''
+        void {i.cpp_namespace_name}::end_dispatch() {{''').format(**locals()))
+        for m in i.methods:
+            self.emit_cpp_f("    pm_{m.name}.end_updates();".format(**locals()))
+        self.emit_cpp_f("}")
         
     def define_types_property_get_handlers_promise(self, i):
-        object_path = "/" + i.name.replace(".", "/")
-
-        self.emit_cpp_f(dedent('''
-        void {i.cpp_namespace_name}::on_interface_get_property(Glib::VariantBase& property,
-                                               const Glib::RefPtr<Gio::DBus::Connection>& connection,
-                                               const Glib::ustring& sender,
-                                               const Glib::ustring& object_path,
-                                               const Glib::ustring& interface_name,
-                                               const Glib::ustring& property_name) {{
-        ''').format(**locals()))
-
-        for p in i.properties:
-            if p.readable:
-                cpptype_to_dbus = p.cpptype_to_dbus
-                # Prepend the class name if this is the generic "TypeWrap" class
-                if cpptype_to_dbus.startswith("TypeWrap"):
-                    cpptype_to_dbus = i.cpp_class_name + cpptype_to_dbus
-                self.emit_cpp_f(dedent('''
-                    if (property_name.compare("{p.name}") == 0) {{
-                        property = Glib::Variant<{p.cpptype_get} >::create({cpptype_to_dbus}({p.name}_get()));
-                    }}
-                ''').format(**locals()))
-
+        self.define_property_get_handler(i, self.emit_cpp_f, promise=True)
         self.emit_cpp_f("}")
 
     def define_types_property_set_handlers_promise(self, i):
-        object_path = "/" + i.name.replace(".", "/")
-        self.emit_cpp_f(dedent('''
-        bool {i.cpp_namespace_name}::on_interface_set_property(
-               const Glib::RefPtr<Gio::DBus::Connection>& connection,
-               const Glib::ustring& sender,
-               const Glib::ustring& object_path,
-               const Glib::ustring& interface_name,
-               const Glib::ustring& property_name,
-               const Glib::VariantBase& value) {{
-        ''').format(**locals()))
-
-        for p in i.properties:
-            self.emit_cpp_f(dedent('''
-                if (property_name.compare("{p.name}") == 0) {{
-                    try {{
-                        Glib::Variant<{p.cpptype_get} > castValue = Glib::VariantBase::cast_dynamic<Glib::Variant<{p.cpptype_get} > >(value);
-                        {p.cpptype_out} val;''').format(**locals()))
-            cpptype_cast = p.cpptype_get_cast
-            # Prepend the class name if this is the generic "TypeWrap" class
-            if cpptype_cast.startswith("TypeWrap"):
-                cpptype_cast = i.cpp_class_name + cpptype_cast
-            self.emit_cpp_f(dedent('''
-                        val = {cpptype_cast}(castValue.get());''').format(**locals()))
-            self.emit_cpp_f('''        {p.name}_set(val);'''.format(**locals()))
-            self.emit_cpp_f(dedent('''
-                    }} catch (std::bad_cast e) {{
-                        g_warning ("Bad cast when casting {p.name}");
-                    }}
-                }}
-            ''').format(**locals()))
-
-        self.emit_cpp_f(dedent('''
+        self.define_property_set_handler(i, self.emit_cpp_f)
+        self.emit_cpp_f(template('''
             property_wakeUp();
             return true;
         }}
         ''').format(**locals()))
 
     def define_types_signal_emitters_promise(self, i):
-        object_path = "/" + i.name.replace(".", "/")
-
         for s in i.signals:
             # Sigc does not allow an infinite number of parameters for signals.
             # The maximum number of signals is specified in SIGNAL_MAX_PARAM. A
@@ -1290,7 +1493,13 @@ class CodeGenerator:
                 args.append(a.cpptype_out + " " + a.name)
 
             argsStr = ", ".join(args)
-            self.emit_cpp_f(dedent('''void {i.cpp_namespace_name}::{s.name}_emitter({argsStr}) {{
+            pathArgsStr = ", ".join(["const std::string &object_path"] + args)
+            namesStr = ", ".join(["m_objectPath"] + [a.name for a in s.args])
+            self.emit_cpp_f(template('''void {i.cpp_namespace_name}::{s.name}_emitter({argsStr}) {{
+                {s.name}_emitter({namesStr});
+            }}
+
+            void {i.cpp_namespace_name}::{s.name}_emitter({pathArgsStr}) {{
             std::vector<Glib::VariantBase> paramsList;''').format(**locals()))
 
             for a in s.args:
@@ -1298,12 +1507,12 @@ class CodeGenerator:
                 # Prepend the class name if this is the generic "TypeWrap" class
                 if cpptype_to_dbus.startswith("TypeWrap"):
                     cpptype_to_dbus = i.cpp_class_name + cpptype_to_dbus
-                self.emit_cpp_f(dedent('''
+                self.emit_cpp_f(template('''
                 paramsList.push_back(Glib::Variant<{a.cpptype_get} >::create({cpptype_to_dbus}({a.name})));;
                 ''').format(**locals()))
 
-            self.emit_cpp_f(dedent('''      m_connection->emit_signal(
-                    "{object_path}",
+            self.emit_cpp_f(template('''      m_connection->emit_signal(
+                    object_path,
                     "{s.iface_name}",
                     "{s.name}",
                     Glib::ustring(),
@@ -1312,7 +1521,7 @@ class CodeGenerator:
 
     def define_types_dbus_callbacks_promise(self, i):
         object_path = "/" + i.name.replace(".", "/")
-        self.emit_cpp_f(dedent('''
+        self.emit_cpp_f(template('''
         void {i.cpp_namespace_name}::on_bus_acquired(const Glib::RefPtr<Gio::DBus::Connection>& connection,
                                  const Glib::ustring& /* name */) {{
             registeredId = register_object(connection,
@@ -1334,11 +1543,11 @@ class CodeGenerator:
             # Prepend the class name if this is the generic "TypeWrap" class
             if cpptype_to_dbus.startswith("TypeWrap"):
                 cpptype_to_dbus = i.cpp_class_name + cpptype_to_dbus
-            self.emit_cpp_f(dedent('''
+            self.emit_cpp_f(template('''
             bool {i.cpp_namespace_name}::{p.name}_set({p.cpptype_in} value) {{
                 if ({p.name}_setHandler(value)) {{
                     Glib::Variant<{p.cpptype_get} > value_get = Glib::Variant<{p.cpptype_get} >::create({cpptype_to_dbus}({p.name}_get()));
-                    emitSignal("{p.name}", value_get);
+                    emitSignal(m_objectPath, "{p.name}", value_get);
                     return true;
                 }}
 
@@ -1347,65 +1556,894 @@ class CodeGenerator:
             
     def define_types_property_handle_promise(self, i):
         for p in i.properties:
-            self.emit_cpp_f(dedent('''
+            self.emit_cpp_f(template('''
             bool {i.cpp_namespace_name}::{p.name}_setHandler({p.cpptype_in} value) {{
                 pp_{p.name} = value;
                 property_wakeUp();
                 return true;
+            }}
+
+            bool {i.cpp_namespace_name}::{p.name}_setHandler(const std::string & /* object_path */,
+                                                            {p.cpptype_in} /* value */) {{
+                property_wakeUp();
+                return true;
             }}''').format(**locals()))
 
     def define_types_property_getter_promise(self, i):
         for p in i.properties:
-            self.emit_cpp_f(dedent('''
+            self.emit_cpp_f(template('''
             {p.cpptype_in} {i.cpp_namespace_name}::{p.name}_get() {{
                 return pp_{p.name}();
             }}''').format(**locals()))
 
     def define_types_emit_promise(self, i):
-             self.emit_cpp_f(dedent('''
-            /// Here we check to see if connection is established or not, to
-            /// updating of promises before the connection is established.
-            bool {i.cpp_namespace_name}::emitSignal(const std::string& propName, Glib::VariantBase& value) {{
-                bool ret;
-                if (m_connection) {{
-                    std::map<Glib::ustring, Glib::VariantBase> changedProps;
-                    std::vector<Glib::ustring> changedPropsNoValue;
-    
-                    changedProps[propName] = value;
-    
-                    Glib::Variant<std::map<Glib::ustring,  Glib::VariantBase> > changedPropsVar = Glib::Variant<std::map <Glib::ustring, Glib::VariantBase> >::create (changedProps);
-                    Glib::Variant<std::vector<Glib::ustring> > changedPropsNoValueVar = Glib::Variant<std::vector<Glib::ustring> >::create(changedPropsNoValue);
-                    std::vector<Glib::VariantBase> ps;
-                    ps.push_back(Glib::Variant<Glib::ustring>::create(m_interfaceName));
-                    ps.push_back(changedPropsVar);
-                    ps.push_back(changedPropsNoValueVar);
-                    Glib::VariantContainerBase propertiesChangedVariant = Glib::Variant<std::vector<Glib::VariantBase> >::create_tuple(ps);
-    
-                    m_connection->emit_signal(
-                        m_objectPath,
-                        "org.freedesktop.DBus.Properties",
-                        "PropertiesChanged",
-                        Glib::ustring(),
-                        propertiesChangedVariant);
-    
-                    ret = true;
-                }} else {{
-                    ret = false;
+        self.emit_cpp_f(template('''
+        /// Here we check to see if connection is established or not, to
+        /// updating of promises before the connection is established.
+        bool {i.cpp_namespace_name}::emitSignal(const std::string &objectPath, const std::string& propName, Glib::VariantBase& value) {{
+            if (!m_connection) {{
+                return false;
+            }}''').format(**locals()))
+        self.define_properties_changed(i, self.emit_cpp_f)
+
+    ### Registration and dispatch, shared by the stub and the promise
+    def xml_index_of(self, i):
+        """ The index of the introspection XML (interfaceXml<N>) declaring the
+        interface i
+        """
+        return self.xml_index.get(i.name, 0)
+
+    def generate_introspection_lookup(self, emit):
+        """ Generate introspectionInterface<N>(), looking up an interface in
+        the introspection XML interfaceXml<N>, for every XML declaring one of
+        the interfaces. The XML is parsed once per process, on first use.
+        Also generate objectManagerInterface(), for the root of subtrees.
+        @param emit the emit_* function to use
+        """
+        indices = sorted(set([self.xml_index_of(i) for i in self.ifaces]))
+        for n in indices:
+            emit(template('''
+            static Glib::RefPtr<Gio::DBus::InterfaceInfo> introspectionInterface{n}(const char *name)
+            {{
+                // The initialization of the static is thread-safe
+                static const Glib::RefPtr<Gio::DBus::NodeInfo> introspection_data = []() {{
+                    try {{
+                        return Gio::DBus::NodeInfo::create_for_xml(interfaceXml{n});
+                    }} catch(const Glib::Error& ex) {{
+                        g_warning("Unable to create introspection data: ");
+                        g_warning("%s\\n", ex.what().c_str());
+                    }}
+                    return Glib::RefPtr<Gio::DBus::NodeInfo>();
+                }}();
+
+                if (!introspection_data) {{
+                    return Glib::RefPtr<Gio::DBus::InterfaceInfo>();
                 }}
-                return ret;
+                return introspection_data->lookup_interface(name);
             }}''').format(**locals()))
 
+        emit(dedent('''
+        static Glib::RefPtr<Gio::DBus::InterfaceInfo> objectManagerInterface()
+        {
+            // The root of a subtree, see register_subtree()
+            static const Glib::RefPtr<Gio::DBus::NodeInfo> introspection_data =
+                Gio::DBus::NodeInfo::create_for_xml(
+                    "<node>"
+                    "  <interface name='org.freedesktop.DBus.ObjectManager'>"
+                    "    <method name='GetManagedObjects'>"
+                    "      <arg type='a{oa{sa{sv}}}' name='object_paths_interfaces_and_properties' direction='out'/>"
+                    "    </method>"
+                    "    <signal name='InterfacesAdded'>"
+                    "      <arg type='o' name='object_path'/>"
+                    "      <arg type='a{sa{sv}}' name='interfaces_and_properties'/>"
+                    "    </signal>"
+                    "    <signal name='InterfacesRemoved'>"
+                    "      <arg type='o' name='object_path'/>"
+                    "      <arg type='as' name='interfaces'/>"
+                    "    </signal>"
+                    "  </interface>"
+                    "</node>");
+
+            return introspection_data->lookup_interface("org.freedesktop.DBus.ObjectManager");
+        }'''))
+
+    def define_registration(self, i, emit):
+        """ Generate the destructor, register_object(), the subtree
+        registration (see define_subtree()) and connect()
+        @param emit the emit_* function to use
+        """
+        n = self.xml_index_of(i)
+        emit(template('''
+        {i.cpp_namespace_name}::~{i.cpp_class_name}()
+        {{
+            m_flushSource.disconnect();
+            if (m_connection && registeredId) {{
+                m_connection->unregister_object(registeredId);
+            }}
+            if (m_connection && subtreeId) {{
+                m_connection->unregister_subtree(subtreeId);
+            }}
+        }}
+
+        guint {i.cpp_namespace_name}::register_object(
+            const Glib::RefPtr<Gio::DBus::Connection> &connection,
+            const Glib::ustring &object_path)
+        {{
+            if (!m_objectPath.empty() && m_objectPath != object_path) {{
+                g_warning("Cannot register the same object twice!");
+
+                return 0;
+            }}
+            // Shared by all objects of the process
+            static const Glib::RefPtr<Gio::DBus::InterfaceInfo> interface_info =
+                introspectionInterface{n}("{i.name}");
+            if (!interface_info) {{
+                g_warning("No introspection data for {i.name}");
+
+                return 0;
+            }}
+            if (!m_interfaceVTable) {{
+                m_interfaceVTable.reset(new Gio::DBus::InterfaceVTable(
+                    sigc::mem_fun(this, &{i.cpp_class_name}::on_method_call),
+                    sigc::mem_fun(this, &{i.cpp_class_name}::on_interface_get_property),
+                    sigc::mem_fun(this, &{i.cpp_class_name}::on_interface_set_property)));
+            }}
+            guint id = 0;
+            try {{
+                id = connection->register_object(object_path,
+                    interface_info,
+                    *m_interfaceVTable);
+                m_connection = connection;
+                m_objectPath = object_path;
+                registeredId = id;
+            }}
+            catch(const Glib::Error &ex) {{
+                g_warning("Registration of object failed");
+            }}
+            return id;
+        }}
+
+        void {i.cpp_namespace_name}::connect (
+            Gio::DBus::BusType busType,
+            std::string name)
+        {{
+            connectionId = Gio::DBus::own_name(busType,
+                                               name,
+                                               sigc::mem_fun(this, &{i.cpp_class_name}::on_bus_acquired),
+                                               sigc::mem_fun(this, &{i.cpp_class_name}::on_name_acquired),
+                                               sigc::mem_fun(this, &{i.cpp_class_name}::on_name_lost));
+        }}''').format(**locals()))
+        self.define_subtree(i, emit)
+
+    def define_subtree(self, i, emit):
+        """ Generate register_subtree(), serving many objects below a root
+        path with a single instance, the object table and the
+        org.freedesktop.DBus.ObjectManager implementation of the root
+        @param emit the emit_* function to use
+        """
+        n = self.xml_index_of(i)
+        emit(template('''
+        guint {i.cpp_namespace_name}::register_subtree(
+            const Glib::RefPtr<Gio::DBus::Connection> &connection,
+            const Glib::ustring &root_path)
+        {{
+            if (registeredId || subtreeId) {{
+                g_warning("Cannot register the same object twice!");
+
+                return 0;
+            }}
+            if (!introspectionInterface{n}("{i.name}") || !objectManagerInterface()) {{
+                g_warning("No introspection data for {i.name}");
+
+                return 0;
+            }}
+            if (!m_interfaceVTable) {{
+                m_interfaceVTable.reset(new Gio::DBus::InterfaceVTable(
+                    sigc::mem_fun(this, &{i.cpp_class_name}::on_method_call),
+                    sigc::mem_fun(this, &{i.cpp_class_name}::on_interface_get_property),
+                    sigc::mem_fun(this, &{i.cpp_class_name}::on_interface_set_property)));
+            }}
+            m_objectManagerVTable.reset(new Gio::DBus::InterfaceVTable(
+                sigc::mem_fun(this, &{i.cpp_class_name}::on_object_manager_call)));
+            m_subtreeVTable.reset(new Gio::DBus::SubtreeVTable(
+                sigc::mem_fun(this, &{i.cpp_class_name}::on_subtree_enumerate),
+                sigc::mem_fun(this, &{i.cpp_class_name}::on_subtree_introspect),
+                sigc::mem_fun(this, &{i.cpp_class_name}::on_subtree_dispatch)));
+            guint id = 0;
+            try {{
+                id = connection->register_subtree(root_path, *m_subtreeVTable);
+                m_connection = connection;
+                m_subtreeRoot = root_path;
+                subtreeId = id;
+            }}
+            catch(const Glib::Error &ex) {{
+                g_warning("Registration of subtree failed");
+            }}
+            return id;
+        }}
+
+        void {i.cpp_namespace_name}::add_object(const std::string &name)
+        {{
+            const std::string path = object_path(name);
+            if (!g_variant_is_object_path(path.c_str())) {{
+                g_warning("Invalid object name %s", name.c_str());
+
+                return;
+            }}
+            {{
+                std::lock_guard<std::mutex> lock(m_objectsMutex);
+                std::vector<std::string>::iterator it =
+                    std::lower_bound(m_objects.begin(), m_objects.end(), name);
+                if (it != m_objects.end() && *it == name) {{
+                    return;
+                }}
+                m_objectProperties.insert(m_objectProperties.begin() + (it - m_objects.begin()),
+                                          ObjectProperties());
+                m_objects.insert(it, name);
+            }}
+            if (m_connection && subtreeId) {{
+                m_connection->emit_signal(
+                    m_subtreeRoot,
+                    "org.freedesktop.DBus.ObjectManager",
+                    "InterfacesAdded",
+                    Glib::ustring(),
+                    Glib::VariantContainerBase(g_variant_new("(o@a{{sa{{sv}}}})",
+                                                             path.c_str(),
+                                                             managedObjectInterfaces(ObjectProperties()))));
+            }}
+        }}
+
+        void {i.cpp_namespace_name}::remove_object(const std::string &name)
+        {{
+            {{
+                std::lock_guard<std::mutex> lock(m_objectsMutex);
+                std::vector<std::string>::iterator it =
+                    std::lower_bound(m_objects.begin(), m_objects.end(), name);
+                if (it == m_objects.end() || *it != name) {{
+                    return;
+                }}
+                m_objectProperties.erase(m_objectProperties.begin() + (it - m_objects.begin()));
+                m_objects.erase(it);
+                // Its pending property changes are not emitted after InterfacesRemoved
+                std::lock_guard<std::mutex> changedLock(m_changedPropertiesMutex);
+                m_changedProperties.erase(object_path(name));
+            }}
+            if (m_connection && subtreeId) {{
+                const gchar *interfaces[] = {{ m_interfaceName.c_str(), NULL }};
+                m_connection->emit_signal(
+                    m_subtreeRoot,
+                    "org.freedesktop.DBus.ObjectManager",
+                    "InterfacesRemoved",
+                    Glib::ustring(),
+                    Glib::VariantContainerBase(g_variant_new("(o^as)",
+                                                             object_path(name).c_str(),
+                                                             interfaces)));
+            }}
+        }}
+
+        std::string {i.cpp_namespace_name}::object_path(const std::string &name) const
+        {{
+            return (m_subtreeRoot == "/" ? std::string() : m_subtreeRoot) + "/" + name;
+        }}
+
+        bool {i.cpp_namespace_name}::objectIndex(const std::string &object_path,
+                                                 std::vector<std::string>::size_type &index) const
+        {{
+            // Called with m_objectsMutex locked
+            const std::string prefix = this->object_path(std::string());
+            if (m_subtreeRoot.empty() || object_path.compare(0, prefix.size(), prefix) != 0) {{
+                return false;
+            }}
+            const std::string name = object_path.substr(prefix.size());
+            std::vector<std::string>::const_iterator it =
+                std::lower_bound(m_objects.begin(), m_objects.end(), name);
+            if (it == m_objects.end() || *it != name) {{
+                return false;
+            }}
+            index = it - m_objects.begin();
+            return true;
+        }}
+
+        std::vector<Glib::ustring> {i.cpp_namespace_name}::on_subtree_enumerate(
+               const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+               const Glib::ustring& /* sender */,
+               const Glib::ustring& /* object_path */)
+        {{
+            std::lock_guard<std::mutex> lock(m_objectsMutex);
+            return std::vector<Glib::ustring>(m_objects.begin(), m_objects.end());
+        }}
+
+        std::vector<Glib::RefPtr<Gio::DBus::InterfaceInfo> > {i.cpp_namespace_name}::on_subtree_introspect(
+               const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+               const Glib::ustring& /* sender */,
+               const Glib::ustring& /* object_path */,
+               const Glib::ustring& node)
+        {{
+            std::vector<Glib::RefPtr<Gio::DBus::InterfaceInfo> > interfaces;
+            if (node.empty()) {{
+                interfaces.push_back(objectManagerInterface());
+            }} else {{
+                std::lock_guard<std::mutex> lock(m_objectsMutex);
+                if (std::binary_search(m_objects.begin(), m_objects.end(), node.raw())) {{
+                    interfaces.push_back(introspectionInterface{n}("{i.name}"));
+                }}
+            }}
+            return interfaces;
+        }}
+
+        const Gio::DBus::InterfaceVTable *{i.cpp_namespace_name}::on_subtree_dispatch(
+               const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+               const Glib::ustring& /* sender */,
+               const Glib::ustring& /* object_path */,
+               const Glib::ustring& interface_name,
+               const Glib::ustring& node)
+        {{
+            // The root is the object manager, the nodes below are the objects
+            if (node.empty()) {{
+                if (interface_name == "org.freedesktop.DBus.ObjectManager") {{
+                    return m_objectManagerVTable.get();
+                }}
+            }} else if (interface_name == m_interfaceName) {{
+                return m_interfaceVTable.get();
+            }}
+            return nullptr;
+        }}
+
+        void {i.cpp_namespace_name}::on_object_manager_call(const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+                           const Glib::ustring& /* sender */,
+                           const Glib::ustring& /* object_path */,
+                           const Glib::ustring& /* interface_name */,
+                           const Glib::ustring& method_name,
+                           const Glib::VariantContainerBase& /* parameters */,
+                           const Glib::RefPtr<Gio::DBus::MethodInvocation>& invocation)
+        {{
+            if (method_name != "GetManagedObjects") {{
+                invocation->return_error(Gio::DBus::Error(Gio::DBus::Error::UNKNOWN_METHOD,
+                                                          "Unknown method " + method_name));
+                return;
+            }}
+            GVariantBuilder objects;
+            g_variant_builder_init(&objects, G_VARIANT_TYPE("a{{oa{{sa{{sv}}}}}}"));
+            {{
+                std::lock_guard<std::mutex> lock(m_objectsMutex);
+                for (std::vector<std::string>::size_type k = 0; k < m_objects.size(); ++k) {{
+                    g_variant_builder_add(&objects, "{{o@a{{sa{{sv}}}}}}",
+                                          object_path(m_objects[k]).c_str(),
+                                          managedObjectInterfaces(m_objectProperties[k]));
+                }}
+            }}
+            invocation->return_value(Glib::VariantContainerBase(
+                g_variant_new("(@a{{oa{{sa{{sv}}}}}})", g_variant_builder_end(&objects))));
+        }}
+
+        GVariant *{i.cpp_namespace_name}::managedObjectInterfaces(const ObjectProperties &object)
+        {{
+            // The interface and the readable properties of the object
+            GVariantBuilder properties;
+            g_variant_builder_init(&properties, G_VARIANT_TYPE("a{{sv}}"));''').format(**locals()))
+        for p in i.properties:
+            if not p.readable:
+                continue
+            cpptype_to_dbus = p.cpptype_to_dbus
+            # Prepend the class name if this is the generic "TypeWrap" class
+            if cpptype_to_dbus.startswith("TypeWrap"):
+                cpptype_to_dbus = i.cpp_class_name + cpptype_to_dbus
+            emit("    {")
+            emit("        Glib::Variant<%s > value = Glib::Variant<%s >::create(%s(object.%s));"
+                 % (p.cpptype_get, p.cpptype_get, cpptype_to_dbus, p.name))
+            emit('        g_variant_builder_add(&properties, "{sv}", "%s", value.gobj());' % p.name)
+            emit("    }")
+        emit(template('''
+            GVariantBuilder interfaces;
+            g_variant_builder_init(&interfaces, G_VARIANT_TYPE("a{{sa{{sv}}}}"));
+            g_variant_builder_add(&interfaces, "{{s@a{{sv}}}}",
+                                  m_interfaceName.c_str(),
+                                  g_variant_builder_end(&properties));
+            return g_variant_builder_end(&interfaces);
+        }}''').format(**locals()))
+        self.define_object_properties(i, emit)
+
+    def declare_object_properties(self, i, emit):
+        """ Declare the ObjectProperties struct, the properties of an object
+        of a subtree, see define_object_properties()
+        @param emit the emit_* function to use
+        """
+        emit("")
+        emit("// The properties of an object of a subtree, see register_subtree()")
+        emit("struct ObjectProperties {")
+        for p in i.properties:
+            emit("    {p.cpptype_out} {p.name}{{}};".format(**locals()))
+        emit("};")
+
+    def define_object_properties(self, i, emit):
+        """ Generate <Property>_set() and <Property>_get_object() taking the
+        path of an object, accessing the ObjectProperties of the objects of
+        a subtree, or the properties of the registered object
+        @param emit the emit_* function to use
+        """
+        for p in i.properties:
+            cpptype_to_dbus = p.cpptype_to_dbus
+            # Prepend the class name if this is the generic "TypeWrap" class
+            if cpptype_to_dbus.startswith("TypeWrap"):
+                cpptype_to_dbus = i.cpp_class_name + cpptype_to_dbus
+            emit(template('''
+            bool {i.cpp_namespace_name}::{p.name}_set(const std::string &object_path, {p.cpptype_in} value) {{
+                if (object_path == m_objectPath) {{
+                    return {p.name}_set(value);
+                }}
+                if (!{p.name}_setHandler(object_path, value)) {{
+                    return false;
+                }}
+                std::lock_guard<std::mutex> lock(m_objectsMutex);
+                std::vector<std::string>::size_type index;
+                if (!objectIndex(object_path, index)) {{
+                    g_warning("Unknown object %s", object_path.c_str());
+
+                    return false;
+                }}
+                m_objectProperties[index].{p.name} = value;
+                Glib::Variant<{p.cpptype_get} > value_get = Glib::Variant<{p.cpptype_get} >::create({cpptype_to_dbus}(m_objectProperties[index].{p.name}));
+                // Queued with the object locked, so that remove_object() drops
+                // the change if it is still pending
+                emitSignal(object_path, "{p.name}", value_get);
+                return true;
+            }}
+
+            {p.cpptype_out} {i.cpp_namespace_name}::{p.name}_get_object(const std::string &object_path) {{
+                if (object_path == m_objectPath) {{
+                    return {p.name}_get();
+                }}
+                std::lock_guard<std::mutex> lock(m_objectsMutex);
+                std::vector<std::string>::size_type index;
+                if (!objectIndex(object_path, index)) {{
+                    g_warning("Unknown object %s", object_path.c_str());
+
+                    return {p.cpptype_out}();
+                }}
+                return m_objectProperties[index].{p.name};
+            }}''').format(**locals()))
+
+    ### Dispatch, shared by the stub and the promise
+    def emit_name_switch(self, emit, name_var, names, emit_case, indent = '    '):
+        """ Emit a switch on the hash of the D-Bus member name name_var,
+        computed at run time by gdbus::name_hash() and for every name in
+        names by the generator. A single string compare confirms the match.
+        Nothing is emitted if names is empty.
+        @param emit the emit_* function to use
+        @param emit_case function emitting the code for a name, called with
+        the name and the indentation to use
+        """
+        if not names:
+            return
+
+        cases = []
+        names_by_hash = {}
+        for name in names:
+            h = utils.name_hash(name)
+            if h not in names_by_hash:
+                cases.append(h)
+                names_by_hash[h] = []
+            names_by_hash[h].append(name)
+
+        emit("%sswitch (gdbus::name_hash(%s.c_str())) {" % (indent, name_var))
+        for h in cases:
+            emit("%scase 0x%08xu:" % (indent, h))
+            # Names with the same hash share the case
+            for name in names_by_hash[h]:
+                emit('%s    if (%s == "%s") {' % (indent, name_var, name))
+                emit_case(name, indent + '        ')
+                emit('%s    }' % indent)
+            emit("%s    break;" % indent)
+        emit("%s}" % indent)
+
+    def define_properties_changed(self, i, emit):
+        """ Generate the rest of emitSignal(), emitting or queueing the
+        PropertiesChanged signal according to the policy, and flush()
+        @param emit the emit_* function to use
+        """
+        emit(template('''
+            {{
+                std::lock_guard<std::mutex> lock(m_changedPropertiesMutex);
+                if (m_propertiesChangedPolicy != gdbus::PropertiesChangedPolicy::Immediate) {{
+                    // Only the last value of a property set more than once is emitted
+                    m_changedProperties[objectPath][propName] = value;
+                    if (!m_flushSource.connected()) {{
+                        // Flushed from the thread of the default main context,
+                        // whichever thread the property is set from
+                        Glib::RefPtr<Glib::MainContext> context = Glib::MainContext::get_default();
+                        if (m_propertiesChangedPolicy == gdbus::PropertiesChangedPolicy::Idle) {{
+                            m_flushSource = context->signal_idle().connect(
+                                sigc::mem_fun(this, &{i.cpp_class_name}::on_flush_timeout));
+                        }} else {{
+                            m_flushSource = context->signal_timeout().connect(
+                                sigc::mem_fun(this, &{i.cpp_class_name}::on_flush_timeout), m_maxLatency);
+                        }}
+                    }}
+                    return true;
+                }}
+            }}
+
+            std::map<Glib::ustring, Glib::VariantBase> changedProps;
+            changedProps[propName] = value;
+            emitPropertiesChanged(objectPath, changedProps);
+
+            return true;
+        }}
+
+        void {i.cpp_namespace_name}::emitPropertiesChanged(const std::string &objectPath,
+                                   const std::map<Glib::ustring, Glib::VariantBase> &changedProps) {{
+            std::vector<Glib::ustring> changedPropsNoValue;
+
+            Glib::Variant<std::map<Glib::ustring,  Glib::VariantBase> > changedPropsVar = Glib::Variant<std::map <Glib::ustring, Glib::VariantBase> >::create (changedProps);
+            Glib::Variant<std::vector<Glib::ustring> > changedPropsNoValueVar = Glib::Variant<std::vector<Glib::ustring> >::create(changedPropsNoValue);
+            std::vector<Glib::VariantBase> ps;
+            ps.push_back(Glib::Variant<Glib::ustring>::create(m_interfaceName));
+            ps.push_back(changedPropsVar);
+            ps.push_back(changedPropsNoValueVar);
+            Glib::VariantContainerBase propertiesChangedVariant = Glib::Variant<std::vector<Glib::VariantBase> >::create_tuple(ps);
+
+            m_connection->emit_signal(
+                objectPath,
+                "org.freedesktop.DBus.Properties",
+                "PropertiesChanged",
+                Glib::ustring(),
+                propertiesChangedVariant);
+        }}
+
+        void {i.cpp_namespace_name}::set_properties_changed_policy(gdbus::PropertiesChangedPolicy policy,
+                                                                 guint max_latency_ms) {{
+            {{
+                std::lock_guard<std::mutex> lock(m_changedPropertiesMutex);
+                m_propertiesChangedPolicy = policy;
+                m_maxLatency = max_latency_ms;
+            }}
+            if (policy == gdbus::PropertiesChangedPolicy::Immediate) {{
+                flush();
+            }}
+        }}
+
+        void {i.cpp_namespace_name}::flush() {{
+            std::map<std::string, std::map<Glib::ustring, Glib::VariantBase> > changedProperties;
+            {{
+                std::lock_guard<std::mutex> lock(m_changedPropertiesMutex);
+                m_flushSource.disconnect();
+                if (!m_connection) {{
+                    return;
+                }}
+                changedProperties.swap(m_changedProperties);
+            }}
+            // A signal per object, with all its changed properties
+            for (const auto &object : changedProperties) {{
+                emitPropertiesChanged(object.first, object.second);
+            }}
+        }}
+
+        bool {i.cpp_namespace_name}::on_flush_timeout() {{
+            {{
+                // The source is removed by returning false
+                std::lock_guard<std::mutex> lock(m_changedPropertiesMutex);
+                m_flushSource = sigc::connection();
+            }}
+            flush();
+            return false;
+        }}''').format(**locals()))
+
+    def define_method_handlers(self, i, emit):
+        """ Generate a <Method>_callHandler() per method, converting the
+        parameters to the C++ types and calling the user-defined function, and
+        the start of on_method_call(), dispatching to the handlers. The caller
+        closes on_method_call().
+        @param emit the emit_* function to use
+        """
+        for m in i.methods:
+            parameters = "parameters"
+            if len(m.in_args) == 0:
+                parameters = "/* parameters */"
+            emit(template('''
+            void {i.cpp_namespace_name}::{m.name}_callHandler(const Glib::VariantContainerBase& {parameters},
+                               const Glib::RefPtr<Gio::DBus::MethodInvocation>& invocation)
+            {{''').format(**locals()))
+            for ai in range(len(m.in_args)):
+                a = m.in_args[ai]
+                if a.signature == "v":
+                    # Variants are deconstructed differently than the other types
+                    emit("    Glib::VariantContainerBase containerBase = parameters;")
+                    emit("    GVariant *output%s;" % (ai))
+                    emit('    g_variant_get_child(containerBase.gobj(), %s, "v", &output%s);' % (ai, ai))
+                    emit("    Glib::VariantBase p_%s;" % (a.name))
+                    emit("    p_%s = Glib::VariantBase(output%s);" % (a.name, ai))
+                    emit("")
+                else:
+                    emit("    Glib::Variant<%s > base_%s;" % (a.cpptype_get, a.name))
+                    emit("    parameters.get_child(base_%s, %d);" % (a.name, ai))
+                    emit("    %s p_%s;" % (a.cpptype_get, a.name))
+                    emit("    p_%s = base_%s.get();" % (a.name, a.name))
+                    emit("")
+            emit("    %s(" % m.name)
+            for a in m.in_args:
+                cpptype_cast = a.cpptype_get_cast
+                # Prepend the class name if this is the generic "TypeWrap" class
+                if cpptype_cast.startswith("TypeWrap"):
+                    cpptype_cast = i.cpp_class_name + cpptype_cast
+                emit("        %s(p_%s)," % (cpptype_cast, a.name))
+            emit("        {i.cpp_class_name}MessageHelper(invocation));".format(**locals()))
+            emit("}")
+
+        emit(template('''
+        void {i.cpp_namespace_name}::on_method_call(const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+                           const Glib::ustring& /* sender */,
+                           const Glib::ustring& /* object_path */,
+                           const Glib::ustring& /* interface_name */,
+                           const Glib::ustring& method_name,
+                           const Glib::VariantContainerBase& parameters,
+                           const Glib::RefPtr<Gio::DBus::MethodInvocation>& invocation)
+        {{''').format(**locals()))
+        def emit_case(name, indent):
+            emit("%s%s_callHandler(parameters, invocation);" % (indent, name))
+        self.emit_name_switch(emit, "method_name", [m.name for m in i.methods], emit_case)
+
+    def define_property_get_handler(self, i, emit, promise=False):
+        """ Generate the start of on_interface_get_property(), dispatching on
+        the property name to the <Property>_get() functions. The caller closes
+        the function.
+        @param emit the emit_* function to use
+        @param promise whether read-mostly properties are held in a
+               lux::snapshot_promise, replied to from its snapshot
+        """
+        emit(template('''
+        void {i.cpp_namespace_name}::on_interface_get_property(Glib::VariantBase& property,
+                                               const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                                               const Glib::ustring& sender,
+                                               const Glib::ustring& object_path,
+                                               const Glib::ustring& interface_name,
+                                               const Glib::ustring& property_name) {{''').format(**locals()))
+
+        properties = dict([(p.name, p) for p in i.properties])
+        def emit_case(name, indent):
+            p = properties[name]
+            cpptype_to_dbus = p.cpptype_to_dbus
+            # Prepend the class name if this is the generic "TypeWrap" class
+            if cpptype_to_dbus.startswith("TypeWrap"):
+                cpptype_to_dbus = i.cpp_class_name + cpptype_to_dbus
+            if promise and p.read_mostly:
+                # The value of the registered object is not copied
+                emit("%sstd::shared_ptr<const %s > snapshot;" % (indent, p.cpptype_out))
+                emit("%sif (object_path.raw() == m_objectPath && (snapshot = pp_%s.snapshot())) {"
+                     % (indent, p.name))
+                emit("%s    property = Glib::Variant<%s >::create(%s(*snapshot));"
+                     % (indent, p.cpptype_get, cpptype_to_dbus))
+                emit("%s} else {" % indent)
+                emit("%s    property = Glib::Variant<%s >::create(%s(%s_get_object(object_path.raw())));"
+                     % (indent, p.cpptype_get, cpptype_to_dbus, p.name))
+                emit("%s}" % indent)
+                return
+            emit("%sproperty = Glib::Variant<%s >::create(%s(%s_get_object(object_path.raw())));"
+                 % (indent, p.cpptype_get, cpptype_to_dbus, p.name))
+        self.emit_name_switch(emit, "property_name",
+                              [p.name for p in i.properties if p.readable], emit_case)
+
+    def define_property_set_handler(self, i, emit):
+        """ Generate the start of on_interface_set_property(), dispatching on
+        the property name to the <Property>_set() functions. The caller closes
+        the function.
+        @param emit the emit_* function to use
+        """
+        emit(template('''
+        bool {i.cpp_namespace_name}::on_interface_set_property(
+               const Glib::RefPtr<Gio::DBus::Connection>& connection,
+               const Glib::ustring& sender,
+               const Glib::ustring& object_path,
+               const Glib::ustring& interface_name,
+               const Glib::ustring& property_name,
+               const Glib::VariantBase& value) {{''').format(**locals()))
+
+        properties = dict([(p.name, p) for p in i.properties])
+        def emit_case(name, indent):
+            p = properties[name]
+            cpptype_cast = p.cpptype_get_cast
+            # Prepend the class name if this is the generic "TypeWrap" class
+            if cpptype_cast.startswith("TypeWrap"):
+                cpptype_cast = i.cpp_class_name + cpptype_cast
+            emit("%stry {" % indent)
+            emit("%s    Glib::Variant<%s > castValue = Glib::VariantBase::cast_dynamic<Glib::Variant<%s > >(value);"
+                 % (indent, p.cpptype_get, p.cpptype_get))
+            emit("%s    %s val;" % (indent, p.cpptype_out))
+            emit("%s    val = %s(castValue.get());" % (indent, cpptype_cast))
+            emit("%s    %s_set(object_path.raw(), val);" % (indent, p.name))
+            emit("%s} catch (std::bad_cast e) {" % indent)
+            emit('%s    g_warning ("Bad cast when casting %s");' % (indent, p.name))
+            emit("%s}" % indent)
+        self.emit_name_switch(emit, "property_name",
+                              [p.name for p in i.properties], emit_case)
+
+    def declare_method_handlers(self, i, emit):
+        """ Declare the <Method>_callHandler() functions, see
+        define_method_handlers()
+        @param emit the emit_* function to use
+        """
+        for m in i.methods:
+            emit("void %s_callHandler(const Glib::VariantContainerBase& parameters," % m.name)
+            emit("                    const Glib::RefPtr<Gio::DBus::MethodInvocation>& invocation);")
+
     ### Common
     def generate_common_intro(self):
         self.emit_h_common(dedent("""
         #pragma once
+        #include <algorithm>
         #include <iostream>
+        #include <map>
+        #include <memory>
+        #include <mutex>
+        #include <tuple>
+        #include <vector>
         #include "glibmm.h"
         #include "giomm.h"
+        #ifdef G_OS_UNIX
+        #include <giomm/unixfdlist.h>
+        #endif
+
+        #ifndef GDBUS_CODEGEN_GLIBMM_TYPES
+        #define GDBUS_CODEGEN_GLIBMM_TYPES
+        namespace gdbus {
+
+        /* 32 bit FNV-1a hash of a D-Bus member name. The generated code
+         * dispatches method calls, property accesses and signals on it, with
+         * the hashes of the names of the interface computed by the
+         * generator. */
+        inline guint32 name_hash(const char *name) {
+            guint32 hash = 2166136261u;
+            for (const char *c = name; *c; c++) {
+                hash = (hash ^ (guchar)*c) * 16777619u;
+            }
+            return hash;
+        }
+
+        /* Index of a file descriptor in the Gio::UnixFDList sent along with a
+         * message (D-Bus signature h). */
+        class Handle {
+        public:
+            Handle(gint32 index = 0) : m_index(index) {}
+            operator gint32() const { return m_index; }
+
+        private:
+            gint32 m_index;
+        };
+
+        /* When the PropertiesChanged signal is emitted for the properties set
+         * with <Property>_set(), see set_properties_changed_policy():
+         *   Immediate  -- a signal per property, when it is set (the default)
+         *   Idle       -- a signal for all the properties set, once the main
+         *                 loop is idle
+         *   MaxLatency -- a signal for all the properties set, at most the
+         *                 given time after the first of them was set
+         * Pending changes are emitted right away with flush(). The properties
+         * can be set from any thread, Idle and MaxLatency emitting the pending
+         * changes from the thread running the default main context. */
+        enum class PropertiesChangedPolicy {
+            Immediate,
+            Idle,
+            MaxLatency
+        };
+
+        /* Arrays of fixed size elements (D-Bus signatures an, aq, ai, au, ax,
+         * at, ad and annotated ay). The elements are not copied out of the
+         * GVariant of the message, the array is a view of its buffer and keeps
+         * a reference to it. Use to_vector(), or assign to a std::vector, for
+         * a copy. Creating a FixedArray from a std::vector or a buffer copies
+         * the elements into a new GVariant with a single memcpy. */
+        template<typename T>
+        class FixedArray {
+        public:
+            typedef T value_type;
+            typedef const T *const_iterator;
+
+            FixedArray() : FixedArray(nullptr, 0) {}
+
+            FixedArray(const T *data, gsize size) :
+                m_variant(g_variant_new_fixed_array(Glib::Variant<T>::variant_type().gobj(),
+                                                    data, size, sizeof(T))) {
+                init();
+            }
+
+            FixedArray(const std::vector<T> &list) : FixedArray(list.data(), list.size()) {}
+
+            explicit FixedArray(const Glib::VariantBase &variant) : m_variant(variant) {
+                init();
+            }
+
+            const T *data() const { return m_data; }
+            gsize size() const { return m_size; }
+            bool empty() const { return m_size == 0; }
+            const T &operator[](gsize index) const { return m_data[index]; }
+            const_iterator begin() const { return m_data; }
+            const_iterator end() const { return m_data + m_size; }
+
+            std::vector<T> to_vector() const { return std::vector<T>(begin(), end()); }
+            operator std::vector<T>() const { return to_vector(); }
+
+            const Glib::VariantBase &variant() const { return m_variant; }
+
+            bool operator==(const FixedArray &other) const {
+                return m_size == other.m_size && std::equal(begin(), end(), other.begin());
+            }
+
+            bool operator!=(const FixedArray &other) const {
+                return !(*this == other);
+            }
+
+        private:
+            void init() {
+                m_size = 0;
+                m_data = static_cast<const T *>(
+                    g_variant_get_fixed_array(const_cast<GVariant *>(m_variant.gobj()),
+                                              &m_size, sizeof(T)));
+            }
+
+            Glib::VariantBase m_variant;
+            const T *m_data;
+            gsize m_size;
+        };
+
+        }
+
+        namespace Glib {
+
+        template<>
+        class Variant<gdbus::Handle> : public VariantBase {
+        public:
+            typedef gint32 CType;
+            typedef gdbus::Handle CppType;
+
+            Variant() : VariantBase() {}
+
+            explicit Variant(GVariant *castitem, bool take_a_reference = false) :
+                VariantBase(castitem, take_a_reference) {}
+
+            static const VariantType &variant_type() {
+                return VARIANT_TYPE_HANDLE;
+            }
+
+            static Variant<CppType> create(const CppType &data) {
+                return Variant<CppType>(g_variant_new_handle(data));
+            }
+
+            CppType get() const {
+                return g_variant_get_handle(const_cast<GVariant *>(gobj()));
+            }
+        };
+
+        template<typename T>
+        class Variant<gdbus::FixedArray<T> > : public VariantContainerBase {
+        public:
+            typedef GVariant *CType;
+            typedef gdbus::FixedArray<T> CppType;
+            typedef Variant<CppType> CppContainerType;
+
+            Variant() : VariantContainerBase() {}
+
+            explicit Variant(GVariant *castitem, bool take_a_reference = false) :
+                VariantContainerBase(castitem, take_a_reference) {}
+
+            static const VariantType &variant_type() {
+                static VariantType type = VariantType::create_array(Variant<T>::variant_type());
+                return type;
+            }
+
+            static Variant<CppType> create(const CppType &data) {
+                return Variant<CppType>(const_cast<GVariant *>(data.variant().gobj()), true);
+            }
+
+            CppType get() const {
+                return CppType(*this);
+            }
+        };
+
+        }
+        #endif
         """))
 
     def generate_common_classes(self, i):
-        self.emit_h_common(dedent("""
+        self.emit_h_common(template("""
         class {i.cpp_class_name}TypeWrap {{
             public:
                 template<typename T>
@@ -1454,6 +2492,18 @@ class CodeGenerator:
             void returnError(const Glib::ustring &domain, int code, const Glib::ustring &message) {{
                 m_message->return_error(domain, code, message);
             }}
+
+            /* The object the call is for, see register_subtree() */
+            const Glib::ustring getObjectPath() {{
+                return m_message->get_object_path();
+            }}
+
+        #ifdef G_OS_UNIX
+            /* The file descriptors sent along with the call, see gdbus::Handle */
+            Glib::RefPtr<Gio::UnixFDList> getUnixFDList() {{
+                return m_message->get_message()->get_unix_fd_list();
+            }}
+        #endif
         """).format(**locals()))
 
         args = {}
@@ -1471,24 +2521,11 @@ class CodeGenerator:
             params = []
             for index in range(len(a)):
                 params.append(a[index].cpptype_out + " p%s" % index)
-            self.emit_h_common("void ret(" + ', '.join(params) +")")
-            self.emit_h_common("{")
-            self.emit_h_common("    std::vector<Glib::VariantBase> vlist;")
-
-            for index in range(len(a)):
-                cpptype_to_dbus = a[index].cpptype_to_dbus
-                # Prepend the class name if this is the generic "TypeWrap" class
-                if cpptype_to_dbus.startswith("TypeWrap"):
-                    cpptype_to_dbus = i.cpp_class_name + cpptype_to_dbus
-                if a[index].signature == "v":
-                    self.emit_h_common("    vlist.push_back(p{index});".format(**locals()))
-                else:
-                    self.emit_h_common("    vlist.push_back(Glib::Variant<"+a[index].cpptype_get+" >::create(" + cpptype_to_dbus + "(p{index})));".format(**locals()))
-
-            self.emit_h_common(dedent("""
-                m_message->return_value(Glib::Variant<Glib::VariantBase>::create_tuple(vlist));
-            }
-            """))
+            self.generate_common_ret(i, a, params, False)
+            # File descriptors are returned in a Gio::UnixFDList
+            if any(['h' in arg.signature for arg in a]):
+                params.append("const Glib::RefPtr<Gio::UnixFDList> &fd_list")
+                self.generate_common_ret(i, a, params, True)
 
         self.emit_h_common(dedent("""
         private:
@@ -1496,50 +2533,88 @@ class CodeGenerator:
         };
         """))
 
+    def generate_common_ret(self, i, a, params, with_fd_list):
+        """ Generate the MessageHelper::ret() overload for the out arguments a
+            @param params the parameter list of ret()
+            @param with_fd_list whether the last parameter is a Gio::UnixFDList
+                   to return along with the arguments
+        """
+        self.emit_h_common("void ret(" + ', '.join(params) +")")
+        self.emit_h_common("{")
+        self.emit_h_common("    std::vector<Glib::VariantBase> vlist;")
+
+        for index in range(len(a)):
+            cpptype_to_dbus = a[index].cpptype_to_dbus
+            # Prepend the class name if this is the generic "TypeWrap" class
+            if cpptype_to_dbus.startswith("TypeWrap"):
+                cpptype_to_dbus = i.cpp_class_name + cpptype_to_dbus
+            if a[index].signature == "v":
+                self.emit_h_common("    vlist.push_back(p{index});".format(**locals()))
+            else:
+                self.emit_h_common("    vlist.push_back(Glib::Variant<"+a[index].cpptype_get+" >::create(" + cpptype_to_dbus + "(p{index})));".format(**locals()))
+
+        if with_fd_list:
+            self.emit_h_common(dedent("""
+                m_message->return_value(Glib::Variant<Glib::VariantBase>::create_tuple(vlist), fd_list);
+            }
+            """))
+        else:
+            self.emit_h_common(dedent("""
+                m_message->return_value(Glib::Variant<Glib::VariantBase>::create_tuple(vlist));
+            }
+            """))
+
+    def run_phase(self, phase, *args):
+        """ Run one section of the code generation, timed with --timings
+            @param phase the generate_*, declare_* or define_* method to run
+        """
+        with timings.phase('codegen: ' + phase.__name__):
+            phase(*args)
 
     def generate(self):
         # Proxy
-        self.generate_intro_proxy()
-        self.declare_types_proxy()
+        self.run_phase(self.generate_intro_proxy)
+        self.run_phase(self.declare_types_proxy)
         for i in self.ifaces:
-            self.generate_method_calls_proxy(i)
-            self.generate_property_handlers_proxy(i)
-            self.generate_signal_handler_proxy(i)
-            self.generate_proxy_creation(i)
+            self.run_phase(self.generate_method_calls_proxy, i)
+            self.run_phase(self.generate_property_handlers_proxy, i)
+            self.run_phase(self.generate_signal_handler_proxy, i)
+            self.run_phase(self.generate_proxy_creation, i)
 
         if self.if_promises:
-            self.generate_promise_introspection()
-            self.generate_promise_intro()
-            self.declare_types_promise()
+            self.run_phase(self.generate_promise_introspection)
+            self.run_phase(self.generate_promise_intro)
+            self.run_phase(self.declare_types_promise)
             for i in self.ifaces:
-                self.define_types_promise_creation(i)
-                self.define_types_method_handlers_promise(i)
-                self.define_types_property_get_handlers_promise(i)
-                self.define_types_property_set_handlers_promise(i)
-                self.define_types_signal_emitters_promise(i)
-                self.define_types_dbus_callbacks_promise(i)
-                self.define_types_property_setters_promise(i)
-                self.define_types_property_handle_promise(i)
-                self.define_types_property_getter_promise(i)
-                self.define_types_emit_promise(i)
-                self.define_wakups_promise(i)
+                self.run_phase(self.define_types_promise_creation, i)
+                self.run_phase(self.define_types_method_handlers_promise, i)
+                self.run_phase(self.define_types_property_get_handlers_promise, i)
+                self.run_phase(self.define_types_property_set_handlers_promise, i)
+                self.run_phase(self.define_types_signal_emitters_promise, i)
+                self.run_phase(self.define_types_dbus_callbacks_promise, i)
+                self.run_phase(self.define_types_property_setters_promise, i)
+                self.run_phase(self.define_types_property_handle_promise, i)
+                self.run_phase(self.define_types_property_getter_promise, i)
+                self.run_phase(self.define_types_emit_promise, i)
+                self.run_phase(self.define_wakups_promise, i)
+                self.run_phase(self.define_dispatch_loop_promise, i)
         else: # Stubs
-            self.generate_stub_introspection()
-            self.generate_stub_intro()
-            self.declare_types_stub()
+            self.run_phase(self.generate_stub_introspection)
+            self.run_phase(self.generate_stub_intro)
+            self.run_phase(self.declare_types_stub)
             for i in self.ifaces:
-                self.define_types_stub_creation(i)
-                self.define_types_method_handlers_stub(i)
-                self.define_types_property_get_handlers_stub(i)
-                self.define_types_property_set_handlers_stub(i)
-                self.define_types_signal_emitters_stub(i)
-                self.define_types_dbus_callbacks_stub(i)
-                self.define_types_property_setters_stub(i)
-                self.define_types_emit_stub(i)
+                self.run_phase(self.define_types_stub_creation, i)
+                self.run_phase(self.define_types_method_handlers_stub, i)
+                self.run_phase(self.define_types_property_get_handlers_stub, i)
+                self.run_phase(self.define_types_property_set_handlers_stub, i)
+                self.run_phase(self.define_types_signal_emitters_stub, i)
+                self.run_phase(self.define_types_dbus_callbacks_stub, i)
+                self.run_phase(self.define_types_property_setters_stub, i)
+                self.run_phase(self.define_types_emit_stub, i)
         
         # Common
-        self.generate_common_intro()
+        self.run_phase(self.generate_common_intro)
         for i in self.ifaces:
-            self.generate_common_classes(i)
+            self.run_phase(self.generate_common_classes, i)
 
             
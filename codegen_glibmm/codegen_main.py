@@ -20,14 +20,22 @@
 # Author: David Zeuthen <davidz@redhat.com>
 #  (2014) Jonatan Palsson <jonatan.palsson@pelagicore.com>
 
+import cProfile
 import sys
+import time
 import optparse
 
 from . import config
 from . import utils
 from . import dbustypes
 from . import parser
+from . import batch
+from . import cache
+from . import client
 from . import codegen
+from . import server
+from . import target
+from . import timings
 
 def find_arg(arg_list, arg_name):
     for a in arg_list:
@@ -53,7 +61,7 @@ def find_prop(iface, prop):
             return m
     return None
 
-def codegen_main():
+def create_arg_parser():
     arg_parser = optparse.OptionParser('%prog [options]')
     arg_parser.add_option('', '--interface-prefix', metavar='PREFIX', default='',
                             help='String to strip from D-Bus interface names for code and docs')
@@ -63,66 +71,131 @@ def codegen_main():
                           help='Generate C++ code in OUTFILES.[cpp|h]')
     arg_parser.add_option('', '--promise', metavar='PROMISE',
                           help='Generate C++ code in OUTFILES.[cpp|h]')
-    (opts, args) = arg_parser.parse_args()
-
-    all_ifaces = []
-    node_xmls = []
-
-    if not args:
+    arg_parser.add_option('', '--manifest', metavar='FILE',
+                          help='Generate all targets listed in the JSON (or TOML) manifest FILE')
+    arg_parser.add_option('', '--jobs', metavar='N', type='int', default=1,
+                          help='Generate independent targets in N parallel processes')
+    arg_parser.add_option('', '--write-if-changed', action='store_true', default=False,
+                          help='Only replace output files whose content changed')
+    arg_parser.add_option('', '--cache-dir', metavar='DIR',
+                          help='Cache the generated code in DIR, keyed by the XML input and options')
+    arg_parser.add_option('', '--cache-max-size', metavar='MB', type='int', default=100,
+                          help='Evict least recently used cache entries above MB megabytes (default: 100)')
+    arg_parser.add_option('', '--cache-max-age', metavar='DAYS', type='int', default=30,
+                          help='Evict cache entries unused for DAYS days (default: 30)')
+    arg_parser.add_option('', '--serve', metavar='SOCKET',
+                          help='Run as a generator daemon, accepting requests on the Unix socket SOCKET')
+    arg_parser.add_option('', '--server', metavar='SOCKET',
+                          help='Let the daemon listening on SOCKET do the work, or generate in-process if it is not running')
+    arg_parser.add_option('', '--timings', action='store_true', default=False,
+                          help='Print the time spent in each phase of the generator')
+    arg_parser.add_option('', '--profile-out', metavar='FILE',
+                          help='Profile the generator (in this process) and write the pstats data to FILE')
+    return arg_parser
+
+def run(argv, iface_cache = None):
+    """ Run the code generator for the command line arguments argv
+        @param iface_cache InterfaceCache to use, so that a long running
+                           process can reuse parsed interfaces
+        @return tuple of the exit status and the list of written files
+    """
+    arg_parser = create_arg_parser()
+    (opts, args) = arg_parser.parse_args(argv)
+
+    if opts.timings:
+        run_timings = timings.enable()
+    profiler = None
+    if opts.profile_out:
+        profiler = cProfile.Profile()
+    start = time.time()
+    try:
+        if profiler:
+            result = profiler.runcall(generate, arg_parser, opts, args, iface_cache)
+        else:
+            result = generate(arg_parser, opts, args, iface_cache)
+    finally:
+        timings.disable()
+        if profiler:
+            profiler.dump_stats(opts.profile_out)
+
+    if opts.timings:
+        run_timings.report(time.time() - start, sys.stdout)
+    return result
+
+def generate(arg_parser, opts, args, iface_cache):
+    """ Run the code generator for the parsed command line, see run() """
+    if opts.manifest:
+        if args:
+            arg_parser.error('XML files can not be combined with --manifest')
+        targets = batch.load_manifest(opts.manifest)
+    elif not args:
         arg_parser.print_help()
-        sys.exit(1)
-
-    for fname in args:
-        f = open(fname, 'rb')
-        xml_data = f.read()
-        node_xmls.append(xml_data)
-        f.close()
-        parsed_ifaces = parser.parse_dbus_xml(xml_data)
-        all_ifaces.extend(parsed_ifaces)
-
-    interface_prefix_list = opts.interface_prefix.split(",")
-
-    for i in all_ifaces:
-        i.post_process(interface_prefix_list, opts.cpp_namespace)
-
-    cpp_code = opts.generate_cpp_code
-    if_promises = opts.promise
-
-    if cpp_code:
-        proxy_h    = open(cpp_code + "_proxy" + '.h', 'w')
-        proxy_cpp  = open(cpp_code + "_proxy" + '.cpp', 'w')
-        metadata_h = open(cpp_code + "_metadata" + '.h', 'w')
-        if if_promises:
-            stub_h   = None
-            stub_cpp = None
-            promise_h   = open(cpp_code + "_promise" + '.h', 'w')
-            promise_cpp = open(cpp_code + "_promise" + '.cpp', 'w')
-        else: # stubs
-            stub_h   = open(cpp_code + "_stub" + '.h', 'w')
-            stub_cpp = open(cpp_code + "_stub" + '.cpp', 'w')
-            promise_h   = None
-            promise_cpp = None
-            
-        common_h   = open(cpp_code + "_common" + '.h', 'w')
-        common_cpp = open(cpp_code + "_common" + '.cpp', 'w')
-        gen = codegen.CodeGenerator(all_ifaces,
-                                    opts.cpp_namespace,
-                                    interface_prefix_list,
-                                    node_xmls,
-                                    proxy_h, proxy_cpp,
-                                    stub_cpp, stub_h,
-                                    if_promises, promise_cpp, promise_h,
-                                    common_cpp, common_h,
-                                    metadata_h)
-        ret = gen.generate()
-        proxy_h.close()
-        proxy_cpp.close()
-        if stub_h:   stub_h.close()
-        if stub_cpp: stub_cpp.close()
-        if promise_h:   promise_h.close()
-        if promise_cpp: promise_cpp.close()
-
-    sys.exit(0)
+        return (1, [])
+    elif not opts.generate_cpp_code:
+        # Nothing to generate, only check the input
+        for fname in args:
+            with timings.phase('read xml'):
+                xml_data = target.read_xml(fname)
+            with timings.phase('parse'):
+                ifaces = parser.parse_dbus_xml(xml_data)
+            with timings.phase('post_process'):
+                for i in ifaces:
+                    i.post_process(opts.interface_prefix.split(","), opts.cpp_namespace)
+        return (0, [])
+    else:
+        targets = [target.Target(args,
+                                 opts.generate_cpp_code,
+                                 opts.cpp_namespace,
+                                 opts.interface_prefix,
+                                 opts.promise)]
+
+    output_cache = None
+    if opts.cache_dir:
+        output_cache = cache.OutputCache(opts.cache_dir,
+                                         opts.cache_max_size * 1024 * 1024,
+                                         opts.cache_max_age * 24 * 3600)
+
+    if iface_cache is None:
+        iface_cache = target.InterfaceCache()
+    (misses, hits) = (iface_cache.misses, iface_cache.hits)
+    start = time.time()
+    results = target.generate_targets(targets, iface_cache, output_cache, opts.jobs)
+
+    # Everything is generated in memory, write each file in one go
+    written = []
+    with timings.phase('write'):
+        for (outputs, elapsed) in results:
+            for outfile in outputs:
+                if outfile.save(opts.write_if_changed):
+                    written.append(outfile.name)
+
+    if opts.manifest:
+        for (t, (outputs, elapsed)) in zip(targets, results):
+            print "%8.3fs  %s" % (elapsed, t.cpp_code)
+        print "%8.3fs  total for %d targets (%d interface sets parsed, %d reused)" % (
+            time.time() - start, len(targets),
+            iface_cache.misses - misses, iface_cache.hits - hits)
+
+    return (0, written)
+
+def codegen_main():
+    argv = sys.argv[1:]
+    (opts, args) = create_arg_parser().parse_args(argv)
+
+    if opts.serve:
+        server.serve(opts.serve, run)
+        sys.exit(0)
+
+    if opts.server:
+        response = client.request(opts.server, argv)
+        if response is not None:
+            sys.stdout.write(response['stdout'])
+            sys.stderr.write(response['stderr'])
+            sys.exit(response['status'])
+        # The daemon is not running, fall back to in-process generation
+
+    (status, written) = run(argv)
+    sys.exit(status)
 
 if __name__ == "__main__":
     codegen_main()
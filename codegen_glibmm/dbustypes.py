@@ -21,8 +21,233 @@
 #  (2014) Jonatan Palsson <jonatan.palsson@pelagicore.com>
 
 from . import utils
+from .templates import template
+
+# Code to marshal an "in" argument of a proxy method call into a
+# Glib::VariantBase called {name}, from the variable arg_{param}
+SEND_DEFAULT  = "Glib::Variant<{t.cpptype_get}> {name} = Glib::Variant<{t.cpptype_get}>::create(arg_{param});"
+SEND_STRV     = "Glib::Variant<std::vector<Glib::ustring> > {name} = Glib::Variant<std::vector<Glib::ustring> >::create({cpp_class_name}TypeWrap::stdStringVecToGlibStringVec(arg_{param}));"
+SEND_OBJV     = "Glib::Variant<std::vector<std::string> > {name} = Glib::Variant<std::vector< std::string > >::create_from_object_paths(arg_{param});"
+SEND_BYTESTRV = "Glib::Variant<std::vector<std::string> > {name} = Glib::Variant<std::vector<std::string> >::create(arg_{param});"
+SEND_SIG      = "Glib::VariantStringBase {name};\n Glib::VariantStringBase::create_signature({name}, arg_{param}.c_str());"
+SEND_OBJPATH  = "Glib::VariantStringBase {name};\n Glib::VariantStringBase::create_object_path({name}, arg_{param}.c_str());"
+SEND_VARIANT  = "Glib::VariantBase params = arg_{param};"
+SEND_UNKNOWN  = "Glib::VariantBase {name} = arg_{param};"
+
+# Code to unmarshal the out argument number {idx} of a proxy method call
+# from the reply 'wrapped', via a variable {varname}, into {outvar}
+GET_DEFAULT   = "Glib::Variant<{t.cpptype_in}> {varname};\n    wrapped.get_child({varname},{idx});\n    {outvar} = {varname}.get();"
+GET_LIST      = "Glib::VariantContainerBase {varname};\n    wrapped.get_child({varname}, {idx});\n    {cpp_class_name}TypeWrap::unwrapList({outvar}, {varname});"
+GET_VARIANT   = 'GVariant *output;\n    g_variant_get_child(wrapped.gobj(), 0, "v", &output);\n\n    {outvar} = Glib::VariantBase(output);'
+GET_UNKNOWN   = "Glib::VariantBase {varname};\n  wrapped.get_child({varname},{idx});\n  {outvar} = {varname};"
+
+# The D-Bus types with a dedicated mapping, this is the only place to add
+# new ones. All other (container) types are mapped by parse_signature().
+# Columns:
+#   - D-Bus signature
+#   - Type for "in"-parameter to generated function
+#   - Type for "out" parameter to generated function
+#   - Type for use with D-Bus function
+#   - function for casting D-Bus type to out-type
+#   - function for casting out-type to D-Bus type
+#   - proxy code marshalling an in argument (SEND_*)
+#   - proxy code unmarshalling an out argument (GET_*)
+TYPE_TABLE = [
+    ('b',   'bool',        'bool',        'bool',          "", "", SEND_DEFAULT, GET_DEFAULT),
+    ('y',   'guchar',      'guchar',      'guchar',        "", "", SEND_DEFAULT, GET_DEFAULT),
+    ('n',   'gint16',      'gint16',      'gint16',        "", "", SEND_DEFAULT, GET_DEFAULT),
+    ('q',   'guint16',     'guint16',     'guint16',       "", "", SEND_DEFAULT, GET_DEFAULT),
+    ('i',   'gint32',      'gint32',      'gint32',        "", "", SEND_DEFAULT, GET_DEFAULT),
+    ('u',   'guint32',     'guint32',     'guint32',       "", "", SEND_DEFAULT, GET_DEFAULT),
+    ('x',   'gint64',      'gint64',      'gint64',        "", "", SEND_DEFAULT, GET_DEFAULT),
+    ('t',   'guint64',     'guint64',     'guint64',       "", "", SEND_DEFAULT, GET_DEFAULT),
+    ('d',   'double',      'double',      'double',        "", "", SEND_DEFAULT, GET_DEFAULT),
+    ('s',   'std::string', 'std::string', 'Glib::ustring', "Glib::ustring", "", SEND_DEFAULT, GET_DEFAULT),
+    ('o',   'std::string', 'std::string', 'Glib::ustring', "", "", SEND_OBJPATH, GET_DEFAULT),
+    ('g',   'std::string', 'std::string', 'Glib::ustring', "", "", SEND_SIG, GET_DEFAULT),
+    ('ay',  'std::string', 'std::string', 'std::string',   "", "", SEND_DEFAULT, GET_DEFAULT),
+    ('as',  'std::vector<std::string> ', 'std::vector<std::string>', 'std::vector<Glib::ustring>',
+            "TypeWrap::glibStringVecToStdStringVec", "TypeWrap::stdStringVecToGlibStringVec", SEND_STRV, GET_LIST),
+    ('ao',  'std::vector<std::string> ', 'std::vector<std::string>', 'std::vector<std::string>',
+            "", "", SEND_OBJV, GET_LIST),
+    ('aay', 'std::vector<std::string> ', 'std::vector<std::string>', 'std::vector<std::string>',
+            "", "", SEND_BYTESTRV, GET_LIST),
+    ('v',   'Glib::VariantBase', 'Glib::VariantBase', '', '', '', SEND_VARIANT, GET_VARIANT),
+    ('h',   'gdbus::Handle', 'gdbus::Handle', 'gdbus::Handle', "", "", SEND_DEFAULT, GET_DEFAULT),
+]
+
+# C++ types for the D-Bus types inside of arrays, dicts and structs. These
+# are the types glibmm maps to the D-Bus types, so that containers can be
+# marshalled by Glib::Variant directly.
+ELEMENT_TYPES = {
+    'b': 'bool',
+    'y': 'guchar',
+    'n': 'gint16',
+    'q': 'guint16',
+    'i': 'gint32',
+    'u': 'guint32',
+    'x': 'gint64',
+    't': 'guint64',
+    'd': 'double',
+    's': 'Glib::ustring',
+    'o': 'Glib::DBusObjectPathString',
+    'g': 'Glib::DBusSignatureString',
+    'v': 'Glib::VariantBase',
+    'h': 'gdbus::Handle',
+}
+
+# Types allowed as keys of dicts
+BASIC_TYPES = 'bynqiuxtdsogh'
+
+# Element types of the arrays mapped to gdbus::FixedArray, a view of the
+# elements in the GVariant (see g_variant_get_fixed_array()). bool is not
+# the size of gboolean, so 'ab' stays a std::vector<bool>. 'ay' is a
+# std::string unless annotated with FIXED_ARRAY_ANNOTATION.
+FIXED_ARRAY_TYPES = 'ynqiuxtd'
+FIXED_ARRAY_ANNOTATION = 'org.gdbus.codegen.glibmm.FixedArray'
+
+# In the promise, the calls of a method annotated with QUEUE_ANNOTATION (the
+# capacity) are queued in a lux::queue_promise, what a call does when the
+# queue is full is QUEUE_OVERFLOW_ANNOTATION (one of QUEUE_OVERFLOW_POLICIES).
+# The calls are queued from the main loop, which never waits for room.
+QUEUE_ANNOTATION = 'org.gdbus.codegen.glibmm.Queue'
+QUEUE_OVERFLOW_ANNOTATION = 'org.gdbus.codegen.glibmm.QueueOverflow'
+QUEUE_OVERFLOW_POLICIES = ('drop_oldest', 'reject')
+
+# In the promise, a property annotated with READ_MOSTLY_ANNOTATION is held in
+# a lux::snapshot_promise, which readers access without copying or locking
+READ_MOSTLY_ANNOTATION = 'org.gdbus.codegen.glibmm.ReadMostly'
+
+def _parse_type(sig, pos):
+    """ Parse the single complete type starting at sig[pos]
+        @return tuple of the C++ type and the position following the type
+        @raise ValueError for invalid or unsupported signatures
+    """
+    c = sig[pos:pos + 1]
+    if c in ELEMENT_TYPES:
+        return (ELEMENT_TYPES[c], pos + 1)
+    elif c == 'a':
+        if sig[pos + 1:pos + 2] == 'y':
+            # Glib::Variant<std::string> is a byte string
+            return ('std::string', pos + 2)
+        elif sig[pos + 1:pos + 2] == '{':
+            if not sig[pos + 2:pos + 3] or sig[pos + 2] not in BASIC_TYPES:
+                raise ValueError('Invalid dict key in %s' % sig)
+            (key, pos) = _parse_type(sig, pos + 2)
+            (value, pos) = _parse_type(sig, pos)
+            if sig[pos:pos + 1] != '}':
+                raise ValueError('Unterminated dict in %s' % sig)
+            return ('std::map<%s, %s>' % (key, value), pos + 1)
+        (element, pos) = _parse_type(sig, pos + 1)
+        return ('std::vector<%s>' % element, pos)
+    elif c == '(':
+        members = []
+        pos += 1
+        while sig[pos:pos + 1] != ')':
+            if pos >= len(sig):
+                raise ValueError('Unterminated struct in %s' % sig)
+            (member, pos) = _parse_type(sig, pos)
+            members.append(member)
+        if not members:
+            raise ValueError('Empty struct in %s' % sig)
+        return ('std::tuple<%s>' % ', '.join(members), pos + 1)
+    raise ValueError('Unsupported type %r in %s' % (c, sig))
+
+def parse_signature(sig):
+    """ Map the single complete type sig (e.g. a{sv}, a(sdu) or (iis)) to
+        C++: arrays map to std::vector, dicts to std::map and structs to
+        std::tuple, see ELEMENT_TYPES for the basic types inside them
+        @raise ValueError for invalid or unsupported signatures
+    """
+    (cpp, pos) = _parse_type(sig, 0)
+    if pos != len(sig):
+        raise ValueError('Trailing characters in %s' % sig)
+    return cpp
+
+def fixed_array_type(sig):
+    """ The gdbus::FixedArray type for the array signature sig, or None if
+        the elements of sig are not of fixed size
+    """
+    if len(sig) == 2 and sig[0] == 'a' and sig[1] in FIXED_ARRAY_TYPES:
+        return 'gdbus::FixedArray<%s>' % ELEMENT_TYPES[sig[1]]
+    return None
+
+class CppType:
+    """ The C++ mapping of one D-Bus signature. There is a single instance
+        per signature (see TypeWrap.resolve()), shared by all arguments and
+        properties of that type, so it must not be modified.
+    """
+    def __init__(self, signature, cpptype_in, cpptype_out, cpptype_get,
+                 cpptype_get_cast, cpptype_to_dbus, send, value_get,
+                 known = True):
+        self.signature = signature
+        self.cpptype_in = cpptype_in
+        self.cpptype_out = cpptype_out
+        self.cpptype_get = cpptype_get
+        self.cpptype_get_cast = cpptype_get_cast
+        self.cpptype_to_dbus = cpptype_to_dbus
+        self.known = known
+        self._send = template(send)
+        self._value_get = template(value_get)
+
+    def cpp_types(self):
+        """ The tuple (in, out, get, get_cast, to_dbus), see TYPE_TABLE """
+        return (self.cpptype_in, self.cpptype_out, self.cpptype_get,
+                self.cpptype_get_cast, self.cpptype_to_dbus)
+
+    def send(self, name, param, cpp_class_name):
+        """ Proxy code marshalling the argument arg_<param> into the
+            Glib::VariantBase 'name'
+        """
+        return self._send.format(t = self, name = name, param = param,
+                                 cpp_class_name = cpp_class_name)
+
+    def value_get(self, varname, outvar, idx, cpp_class_name):
+        """ Proxy code unmarshalling the out argument number idx into outvar """
+        return self._value_get.format(t = self, varname = varname, outvar = outvar,
+                                      idx = idx, cpp_class_name = cpp_class_name)
 
 class TypeWrap:
+    # Signature to CppType, filled from TYPE_TABLE and by resolve()
+    _types = dict([(row[0], CppType(*row)) for row in TYPE_TABLE])
+
+    # Signature to CppType for arguments with FIXED_ARRAY_ANNOTATION
+    _fixed_array_types = {}
+
+    @staticmethod
+    def resolve(sig, annotations = None):
+        """ Return the shared CppType for the D-Bus signature sig. Signatures
+            not in TYPE_TABLE are mapped by parse_signature(), the ones the
+            generator does not support map to Glib::VariantBase, with known
+            set to False.
+            @param annotations of the argument or property, to map 'ay' to
+                   gdbus::FixedArray<guchar> with FIXED_ARRAY_ANNOTATION
+        """
+        if annotations and utils.lookup_annotation(annotations, FIXED_ARRAY_ANNOTATION) == 'true':
+            cpptype = TypeWrap._fixed_array_types.get(sig)
+            if cpptype is None:
+                cpp = fixed_array_type(sig)
+                if cpp is None:
+                    cpptype = TypeWrap.resolve(sig)
+                else:
+                    cpptype = CppType(sig, cpp, cpp, cpp, "", "",
+                                      SEND_DEFAULT, GET_DEFAULT)
+                TypeWrap._fixed_array_types[sig] = cpptype
+            return cpptype
+
+        cpptype = TypeWrap._types.get(sig)
+        if cpptype is None:
+            try:
+                cpp = fixed_array_type(sig) or parse_signature(sig)
+                cpptype = CppType(sig, cpp, cpp, cpp, "", "",
+                                  SEND_DEFAULT, GET_DEFAULT)
+            except ValueError:
+                cpptype = CppType(sig, 'Glib::VariantBase', 'Glib::VariantBase',
+                                  None, None, None, SEND_UNKNOWN, GET_UNKNOWN,
+                                  known = False)
+            TypeWrap._types[sig] = cpptype
+        return cpptype
+
     @staticmethod
     def cppSignatureForDbusSignature(sig):
         """
@@ -32,43 +257,12 @@ class TypeWrap:
             - Type for use with D-Bus function
             - function for casting D-Bus type to out-type
             - function for casting out-type to D-Bus type
+        All values are None for signatures which are not supported.
         """
-        if sig == 'b':
-            return ('bool', 'bool', 'bool', "", "")
-        elif sig == 'y':
-            return ('guchar', 'guchar', 'guchar', "", "")
-        elif sig == 'n':
-            return ('gint16', 'gint16', 'gint16', "", "")
-        elif sig == 'q':
-            return ('guint16', 'guint16', 'guint16', "", "")
-        elif sig == 'i':
-            return ('gint32', 'gint32', 'gint32', "", "")
-        elif sig == 'u':
-            return ('guint32', 'guint32', 'guint32', "", "")
-        elif sig == 'x':
-            return ('gint64', 'gint64', 'gint64', "", "")
-        elif sig == 't':
-            return ('guint64', 'guint64', 'guint64', "", "")
-        elif sig == 'd':
-            return ('double', 'double', 'double', "", "")
-        elif sig == 's':
-            return ('std::string', 'std::string', 'Glib::ustring', "Glib::ustring", "")
-        elif sig == 'o':
-            return ('std::string', 'std::string', 'Glib::ustring', "", "")
-        elif sig == 'g':
-            return ('std::string', 'std::string', 'Glib::ustring', "", "")
-        elif sig == 'ay':
-            return ('std::string', 'std::string', 'std::string', "", "")
-        elif sig == 'as':
-            return ('std::vector<std::string> ', 'std::vector<std::string>', 'std::vector<Glib::ustring>', "TypeWrap::glibStringVecToStdStringVec", "TypeWrap::stdStringVecToGlibStringVec")
-        elif sig == 'ao':
-            return ('std::vector<std::string> ', 'std::vector<std::string>', 'std::vector<std::string>', "", "")
-        elif sig == 'aay':
-            return ('std::vector<std::string> ', 'std::vector<std::string>', 'std::vector<std::string>', "", "")
-        elif sig == 'v':
-            return ('Glib::VariantBase', 'Glib::VariantBase', '', '', '')
-        else:
+        cpptype = TypeWrap.resolve(sig)
+        if not cpptype.known:
             return (None, None, None, None, None)
+        return cpptype.cpp_types()
 
 class Annotation:
     def __init__(self, key, value):
@@ -86,44 +280,17 @@ class Arg:
         if self.name == None:
             self.name = 'unnamed_arg%d'%arg_number
 
+        self.type = TypeWrap.resolve(self.signature, self.annotations)
+        (self.cpptype_in, self.cpptype_out, self.cpptype_get, self.cpptype_get_cast, self.cpptype_to_dbus) = self.type.cpp_types()
 
-        (self.cpptype_in, self.cpptype_out, self.cpptype_get, self.cpptype_get_cast, self.cpptype_to_dbus) = TypeWrap.cppSignatureForDbusSignature(self.signature)
-
-        self.cpptype_send = lambda name, param, cpp_class_name: "Glib::Variant<"+self.cpptype_get+"> "+name+" = Glib::Variant<"+self.cpptype_get+">::create(arg_"+param+");"
-        self.cppvalue_get = lambda varname, outvar, idx, cpp_class_name: "Glib::Variant<"+self.cpptype_in+"> "+varname+";\n    wrapped.get_child("+varname+","+idx+");\n    "+outvar+" = "+varname+".get();"
-
-        if self.signature == 'as':
-            self.cpptype_send = lambda name, param, cpp_class_name: "Glib::Variant<std::vector<Glib::ustring> > "+name+" = Glib::Variant<std::vector<Glib::ustring> >::create(" + cpp_class_name + "TypeWrap::stdStringVecToGlibStringVec(arg_" + param + "));"
-            self.cppvalue_get = lambda varname, outvar, idx, cpp_class_name: "Glib::VariantContainerBase "+varname+";\n" +\
-                                 "    wrapped.get_child("+varname+", "+idx+");\n" +\
-                                 "    " + cpp_class_name + "TypeWrap::unwrapList(".format(**locals())+outvar+", "+varname+");"
-        elif self.signature == 'ao':
-            self.cpptype_send = lambda name, param, cpp_class_name: "Glib::Variant<std::vector<std::string> > "+name+" = Glib::Variant<std::vector< std::string > >::create_from_object_paths(arg_"+param+");"
-            self.cppvalue_get = lambda varname, outvar, idx, cpp_class_name: "Glib::VariantContainerBase "+varname+";\n" +\
-                                 "    wrapped.get_child("+varname+", "+idx+");\n" +\
-                                 "    " + cpp_class_name + "TypeWrap::unwrapList(".format(**locals())+outvar+", "+varname+");"
-        elif self.signature == 'aay':
-            self.cpptype_send = lambda name, param, cpp_class_name: "Glib::Variant<std::vector<std::string> > "+name+" = Glib::Variant<std::vector<std::string> >::create(arg_"+param+");"
-            self.cppvalue_get = lambda varname, outvar, idx, cpp_class_name: "Glib::VariantContainerBase "+varname+";\n" +\
-                                 "    wrapped.get_child("+varname+", "+idx+");\n" +\
-                                 "    " + cpp_class_name + "TypeWrap::unwrapList("+outvar+", "+varname+");"
-        elif self.signature == 'g':
-            self.cpptype_send = lambda name, param, cpp_class_name: "Glib::VariantStringBase "+name+";\n Glib::VariantStringBase::create_signature("+name+", arg_"+param+".c_str());"
-        elif self.signature == 'o':
-            self.cpptype_send = lambda name, param, cpp_class_name: "Glib::VariantStringBase "+name+";\n Glib::VariantStringBase::create_object_path("+name+", arg_"+param+".c_str());"
-        elif self.signature == 'v':
-            self.cpptype_send = lambda name, param, cpp_class_name: "Glib::VariantBase params = arg_" + param + ";"
-            self.cppvalue_get = lambda varname, outvar, idx, cpp_class_name: 'GVariant *output;\n' +\
-                                '    g_variant_get_child(wrapped.gobj(), 0, "v", &output);\n\n' + "    " + outvar + ' = Glib::VariantBase(output);'
-
-        if (self.cpptype_in, self.cpptype_out) == (None, None):
+        if not self.type.known:
             print "Unknown signature: " + self.signature
 
-            # default to GVariant
-            self.cpptype_in  = 'Glib::VariantBase'
-            self.cpptype_out  = 'Glib::VariantBase'
-            self.cpptype_send = lambda name, param: "Glib::VariantBase "+name+" = arg_"+param+";"
-            self.cppvalue_get = lambda varname, outvar, idx: "Glib::VariantBase "+varname+";\n  wrapped.get_child("+varname+","+idx+");\n  "+outvar+" = "+varname+";"
+    def cpptype_send(self, name, param, cpp_class_name):
+        return self.type.send(name, param, cpp_class_name)
+
+    def cppvalue_get(self, varname, outvar, idx, cpp_class_name):
+        return self.type.value_get(varname, outvar, idx, cpp_class_name)
 
 class Method:
     def __init__(self, name):
@@ -148,6 +315,28 @@ class Method:
             a.post_process(arg_count)
             arg_count += 1
 
+        # File descriptors (h) are passed in a Gio::UnixFDList next to the
+        # arguments
+        self.in_unix_fds = any(['h' in a.signature for a in self.in_args])
+        self.out_unix_fds = any(['h' in a.signature for a in self.out_args])
+
+        self.queue_capacity = None
+        self.queue_overflow = 'reject'
+        capacity = utils.lookup_annotation(self.annotations, QUEUE_ANNOTATION)
+        if capacity is not None:
+            if capacity.isdigit() and int(capacity) > 0:
+                self.queue_capacity = int(capacity)
+            else:
+                print "WARNING: method %s has an invalid queue capacity %s, not queued" % (name, capacity)
+        overflow = utils.lookup_annotation(self.annotations, QUEUE_OVERFLOW_ANNOTATION)
+        if overflow is not None:
+            if overflow in QUEUE_OVERFLOW_POLICIES:
+                self.queue_overflow = overflow
+            elif overflow == 'block':
+                print "WARNING: method %s would block the main loop on a full queue, using reject" % name
+            else:
+                print "WARNING: method %s has an unknown queue overflow policy %s, using reject" % (name, overflow)
+
 class Signal:
     def __init__(self, name):
         self.name = name
@@ -184,14 +373,17 @@ class Property:
         else:
             raise RuntimeError('Invalid access type %s'%self.access)
 
-        (self.cpptype_in, self.cpptype_out, self.cpptype_get, self.cpptype_get_cast, self.cpptype_to_dbus) = TypeWrap.cppSignatureForDbusSignature(signature)
+        self.set_type(TypeWrap.resolve(signature))
 
-        if (self.cpptype_in, self.cpptype_out) == (None, None):
+    def set_type(self, cpptype):
+        self.type = cpptype
+        (self.cpptype_in, self.cpptype_out, self.cpptype_get, self.cpptype_get_cast, self.cpptype_to_dbus) = self.type.cpp_types()
+
+        if not self.type.known:
             print "Unknown signature: " + self.signature
 
             # default to GVariant
             self.cpptype_in  = 'const Glib::VariantBase &'
-            self.cpptype_out  = 'Glib::VariantBase'
 
     def post_process(self, interface_prefix, cns, cns_upper, cns_lower):
         name = self.name
@@ -204,6 +396,10 @@ class Property:
         # recalculate arg
         self.arg.annotations = self.annotations
         self.arg.post_process(0)
+        if self.arg.type is not self.type:
+            self.set_type(self.arg.type)
+
+        self.read_mostly = utils.lookup_annotation(self.annotations, READ_MOSTLY_ANNOTATION) == 'true'
 
 class Interface:
     def __init__(self, name):
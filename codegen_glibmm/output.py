@@ -0,0 +1,100 @@
+# -*- Mode: Python -*-
+
+# GDBus - GLib D-Bus Library
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+import tempfile
+
+def _file_digest(name):
+    f = open(name, 'rb')
+    digest = hashlib.sha1()
+    while True:
+        block = f.read(65536)
+        if not block:
+            break
+        digest.update(block)
+    f.close()
+    return digest.hexdigest()
+
+class OutputFile:
+    """ A single output unit of the code generator (e.g. the proxy header).
+
+        The generated code is collected in memory as a list of chunks and
+        only written to disk, with a single write, when save() is called.
+        The object mimics the small part of the file interface used by
+        CodeGenerator (name and write()).
+    """
+    def __init__(self, name):
+        self.name = name
+        self._chunks = []
+
+    def write(self, text):
+        self._chunks.append(text)
+
+    def getvalue(self):
+        """ Return the complete generated content as one string """
+        return ''.join(self._chunks)
+
+    def is_unchanged(self, content):
+        """ Check whether the file on disk already holds 'content'. The size
+            is compared first, the (more expensive) hash only if it matches.
+        """
+        try:
+            if os.stat(self.name).st_size != len(content):
+                return False
+        except OSError:
+            return False
+        return _file_digest(self.name) == hashlib.sha1(content).hexdigest()
+
+    def save(self, only_if_changed = False):
+        """ Flush the collected content to the file named self.name
+
+            @param only_if_changed when True, an existing file with the same
+                                   content is left untouched (keeping its
+                                   mtime), otherwise the file is replaced
+                                   atomically via a temporary file
+            @return True if the file was written
+        """
+        content = self.getvalue()
+        if not only_if_changed:
+            f = open(self.name, 'w')
+            f.write(content)
+            f.close()
+            return True
+
+        if self.is_unchanged(content):
+            return False
+
+        directory, basename = os.path.split(os.path.abspath(self.name))
+        fd, tmp_name = tempfile.mkstemp(prefix='.' + basename + '.', dir=directory)
+        try:
+            f = os.fdopen(fd, 'w')
+            f.write(content)
+            f.close()
+            # mkstemp creates the file with mode 0600, use the same mode as
+            # open() would have
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_name, 0o666 & ~umask)
+            if os.name == 'nt' and os.path.exists(self.name):
+                os.remove(self.name)
+            os.rename(tmp_name, self.name)
+        except:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+        return True
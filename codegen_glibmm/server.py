@@ -0,0 +1,142 @@
+# -*- Mode: Python -*-
+
+# GDBus - GLib D-Bus Library
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, see <http://www.gnu.org/licenses/>.
+
+# Generator daemon (--serve)
+#
+# The daemon listens on a Unix socket. Every connection carries a single
+# request, one line of JSON:
+#
+#   {"cwd": "/path/of/the/client", "args": ["--generate-cpp-code=...", ...]}
+#
+# which is answered with one line of JSON:
+#
+#   {"status": 0, "stdout": "...", "stderr": "...", "files": [...]}
+#
+# "args" are the command line arguments of the generator, "files" the list
+# of files written. Requests are handled one at a time, in the working
+# directory of the client. Parsed interfaces stay in memory between
+# requests (keyed by the XML content, so edited XML is picked up).
+
+import errno
+import json
+import os
+import signal
+import socket
+import StringIO
+import sys
+import traceback
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+from . import target
+
+# Number of parsed XML files kept in memory by the daemon
+MAX_CACHED_INTERFACES = 1000
+
+def _str(value):
+    """ json returns unicode strings on Python 2, the generator works on str """
+    if not isinstance(value, str):
+        value = value.encode('utf-8')
+    return value
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            response = self.server.generate(_str(request['cwd']),
+                                            [_str(arg) for arg in request['args']])
+        except (ValueError, KeyError, TypeError):
+            response = { 'status': 2, 'stdout': '', 'files': [],
+                         'stderr': 'Malformed request\n' }
+        self.wfile.write(json.dumps(response) + '\n')
+
+class GeneratorServer(socketserver.UnixStreamServer):
+    """ Serve generate requests on the Unix socket 'path'
+        @param run function running the generator for a list of command line
+                   arguments, see codegen_main.run()
+    """
+    def __init__(self, path, run):
+        self.run = run
+        self.iface_cache = target.InterfaceCache(MAX_CACHED_INTERFACES)
+        socketserver.UnixStreamServer.__init__(self, path, _RequestHandler)
+
+    def generate(self, cwd, args):
+        status = 0
+        written = []
+        old_cwd = os.getcwd()
+        (stdout, stderr) = (sys.stdout, sys.stderr)
+        sys.stdout = StringIO.StringIO()
+        sys.stderr = StringIO.StringIO()
+        try:
+            try:
+                os.chdir(cwd)
+                (status, written) = self.run(args, self.iface_cache)
+            except SystemExit, e:
+                # optparse exits on bad arguments
+                status = e.code
+            except Exception:
+                traceback.print_exc()
+                status = 1
+            response = { 'status': status,
+                         'stdout': sys.stdout.getvalue(),
+                         'stderr': sys.stderr.getvalue(),
+                         'files':  written }
+        finally:
+            (sys.stdout, sys.stderr) = (stdout, stderr)
+            os.chdir(old_cwd)
+        return response
+
+def _remove_stale_socket(path):
+    """ Remove a socket file left behind by a daemon which is not running
+        anymore. Refuse to start if another daemon is listening.
+    """
+    if not os.path.exists(path):
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error, e:
+        if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+            os.remove(path)
+            return
+        raise
+    finally:
+        sock.close()
+    raise RuntimeError('A generator daemon is already listening on %s' % path)
+
+def serve(path, run):
+    """ Run the generator daemon on the Unix socket 'path' until interrupted """
+    _remove_stale_socket(path)
+    server = GeneratorServer(path, run)
+
+    # Shut down cleanly (removing the socket) when terminated, after
+    # finishing the request being handled
+    terminated = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: terminated.append(signum))
+    server.timeout = 0.5
+    try:
+        while not terminated:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
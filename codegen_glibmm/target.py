@@ -0,0 +1,249 @@
+# -*- Mode: Python -*-
+
+# GDBus - GLib D-Bus Library
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import hashlib
+import multiprocessing
+import StringIO
+import sys
+import time
+
+from . import cache
+from . import codegen
+from . import output
+from . import parser
+from . import timings
+
+class Target:
+    """ One generated output set: the introspection XML files it is
+        generated from, the output prefix and the generator options.
+    """
+    def __init__(self, xml_files, cpp_code, cpp_namespace = '',
+                 interface_prefix = '', promise = False):
+        self.xml_files = list(xml_files)
+        self.cpp_code = cpp_code
+        self.cpp_namespace = cpp_namespace
+        self.interface_prefix = interface_prefix
+        self.promise = bool(promise)
+
+    def interface_prefix_list(self):
+        return self.interface_prefix.split(",")
+
+    def options(self):
+        """ All options influencing the generated code, e.g. for cache keys """
+        return { 'interface_prefix':  self.interface_prefix,
+                 'cpp_namespace':     self.cpp_namespace,
+                 'generate_cpp_code': self.cpp_code,
+                 'promise':           self.promise }
+
+class InterfaceCache:
+    """ Parsed and post-processed interfaces, keyed by the XML content and
+        the options used by post_process(). The code generator does not
+        modify the interfaces, so they can be shared by all targets
+        generated in the same process.
+
+        @param max_entries if set, the least recently used entries are
+                           dropped beyond this number of entries (used by
+                           long running processes, which see the XML
+                           change over time)
+    """
+    def __init__(self, max_entries = None):
+        self._ifaces = collections.OrderedDict()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def interfaces(self, xml_data, interface_prefix_list, cpp_namespace):
+        key = (hashlib.sha1(xml_data).hexdigest(),
+               tuple(interface_prefix_list), cpp_namespace)
+        ifaces = self._ifaces.get(key)
+        if ifaces is None:
+            self.misses += 1
+            with timings.phase('parse'):
+                ifaces = parser.parse_dbus_xml(xml_data)
+            with timings.phase('post_process'):
+                for i in ifaces:
+                    i.post_process(interface_prefix_list, cpp_namespace)
+            if self.max_entries is not None and len(self._ifaces) >= self.max_entries:
+                self._ifaces.popitem(last = False)
+        else:
+            self.hits += 1
+            del self._ifaces[key]
+        self._ifaces[key] = ifaces
+        return ifaces
+
+def read_xml(fname):
+    f = open(fname, 'rb')
+    xml_data = f.read()
+    f.close()
+    return xml_data
+
+def generate_code(all_ifaces, node_xmls, cpp_code, cpp_namespace,
+                  interface_prefix_list, if_promises, xml_index = None):
+    """ Generate the complete C++ code for the post-processed interfaces
+        @param xml_index dict of interface name to the index in node_xmls of
+               the XML declaring it, see codegen.CodeGenerator
+        @return list of output.OutputFile, not yet written to disk
+    """
+    proxy_h    = output.OutputFile(cpp_code + "_proxy" + '.h')
+    proxy_cpp  = output.OutputFile(cpp_code + "_proxy" + '.cpp')
+    metadata_h = output.OutputFile(cpp_code + "_metadata" + '.h')
+    if if_promises:
+        stub_h   = None
+        stub_cpp = None
+        promise_h   = output.OutputFile(cpp_code + "_promise" + '.h')
+        promise_cpp = output.OutputFile(cpp_code + "_promise" + '.cpp')
+    else: # stubs
+        stub_h   = output.OutputFile(cpp_code + "_stub" + '.h')
+        stub_cpp = output.OutputFile(cpp_code + "_stub" + '.cpp')
+        promise_h   = None
+        promise_cpp = None
+
+    common_h   = output.OutputFile(cpp_code + "_common" + '.h')
+    common_cpp = output.OutputFile(cpp_code + "_common" + '.cpp')
+    gen = codegen.CodeGenerator(all_ifaces,
+                                cpp_namespace,
+                                interface_prefix_list,
+                                node_xmls,
+                                proxy_h, proxy_cpp,
+                                stub_cpp, stub_h,
+                                if_promises, promise_cpp, promise_h,
+                                common_cpp, common_h,
+                                metadata_h,
+                                xml_index)
+    gen.generate()
+
+    return [outfile for outfile in (proxy_h, proxy_cpp, stub_h, stub_cpp,
+                                    promise_h, promise_cpp, common_h, common_cpp,
+                                    metadata_h) if outfile]
+
+def generate_target(target, iface_cache, output_cache = None):
+    """ Generate the code for one target, in memory
+        @param iface_cache InterfaceCache shared between targets
+        @param output_cache optional cache.OutputCache
+        @return list of output.OutputFile, not yet written to disk
+    """
+    with timings.phase('read xml'):
+        node_xmls = [read_xml(fname) for fname in target.xml_files]
+
+    if output_cache:
+        with timings.phase('output cache'):
+            cache_key = output_cache.key(node_xmls, target.options())
+            cached = output_cache.load(cache_key)
+        if cached is not None:
+            outputs = []
+            for (name, content) in cached:
+                outfile = output.OutputFile(name)
+                outfile.write(content)
+                outputs.append(outfile)
+            return outputs
+
+    interface_prefix_list = target.interface_prefix_list()
+    all_ifaces = []
+    xml_index = {}
+    for n in range(len(node_xmls)):
+        ifaces = iface_cache.interfaces(node_xmls[n],
+                                        interface_prefix_list,
+                                        target.cpp_namespace)
+        all_ifaces.extend(ifaces)
+        for i in ifaces:
+            xml_index[i.name] = n
+
+    outputs = generate_code(all_ifaces, node_xmls, target.cpp_code,
+                            target.cpp_namespace, interface_prefix_list,
+                            target.promise, xml_index)
+    if output_cache:
+        with timings.phase('output cache'):
+            output_cache.store(cache_key, [(outfile.name, outfile.getvalue())
+                                           for outfile in outputs])
+    return outputs
+
+# Interfaces parsed by a worker process of generate_targets(), reused for
+# all targets generated by that worker
+_worker_iface_cache = None
+
+def _generate_in_worker(job):
+    global _worker_iface_cache
+    if _worker_iface_cache is None:
+        _worker_iface_cache = InterfaceCache()
+    (t, output_cache, with_timings) = job
+    if with_timings:
+        worker_timings = timings.enable()
+    start = time.time()
+    (misses, hits) = (_worker_iface_cache.misses, _worker_iface_cache.hits)
+    # Collect the warnings of the generator, so that the parent can print
+    # them in the order of the targets
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        outputs = generate_target(t, _worker_iface_cache, output_cache)
+        messages = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+        timings.disable()
+    return ([(outfile.name, outfile.getvalue()) for outfile in outputs],
+            messages,
+            time.time() - start,
+            _worker_iface_cache.misses - misses,
+            _worker_iface_cache.hits - hits,
+            with_timings and (worker_timings.seconds, worker_timings.calls))
+
+def generate_targets(targets, iface_cache, output_cache = None, jobs = 1):
+    """ Generate the code for several targets, in memory. With jobs > 1 the
+        targets are distributed over a pool of worker processes. The result
+        is the same as for a serial run, in the order of targets.
+
+        @param iface_cache InterfaceCache, statistics of the workers are
+                           added to it (as are their timings to the active
+                           timings.Timings)
+        @return list of (list of output.OutputFile, seconds) per target
+    """
+    if jobs <= 1 or len(targets) <= 1:
+        results = []
+        for t in targets:
+            start = time.time()
+            outputs = generate_target(t, iface_cache, output_cache)
+            results.append((outputs, time.time() - start))
+        return results
+
+    pool = multiprocessing.Pool(min(jobs, len(targets)))
+    try:
+        worker_results = pool.map(_generate_in_worker,
+                                  [(t, output_cache, timings.active() is not None)
+                                   for t in targets],
+                                  1)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    results = []
+    for (files, messages, elapsed, misses, hits, worker_timings) in worker_results:
+        sys.stdout.write(messages)
+        if worker_timings:
+            timings.active().merge(*worker_timings)
+        outputs = []
+        for (name, content) in files:
+            outfile = output.OutputFile(name)
+            outfile.write(content)
+            outputs.append(outfile)
+        iface_cache.misses += misses
+        iface_cache.hits += hits
+        results.append((outputs, elapsed))
+    return results
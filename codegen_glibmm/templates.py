@@ -0,0 +1,106 @@
+# -*- Mode: Python -*-
+
+# GDBus - GLib D-Bus Library
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, see <http://www.gnu.org/licenses/>.
+
+# Code templates
+#
+# The emitters in codegen.py are written as
+#
+#   self.emit_cpp_s(template('''
+#       void {i.cpp_namespace_name}::foo() {{
+#       }}''').format(**locals()))
+#
+# The literal is dedented and compiled into a Python function the first time
+# it is used. Later calls only look the template up (by the literal, which
+# is a constant of the calling code) and fill in the fields.
+
+import string
+import textwrap
+
+try:
+    _field_name_split = str._formatter_field_name_split
+except AttributeError:
+    from _string import formatter_field_name_split as _field_name_split
+
+_formatter = string.Formatter()
+
+def _compile(text):
+    """ Compile the str.format() style template text into a function taking
+        the dict of field values and returning the formatted text. Only
+        named fields are supported, as used with format(**locals()).
+    """
+    literals = []
+    parts = []
+    for (literal, field, spec, conversion) in _formatter.parse(text):
+        if literal:
+            parts.append('_literals[%d]' % len(literals))
+            literals.append(literal)
+        if field is None:
+            continue
+        if '{' in spec:
+            raise ValueError('Nested fields are not supported in templates: %r' % field)
+        (first, rest) = _field_name_split(field)
+        if not isinstance(first, str) or not first:
+            raise ValueError('Positional fields are not supported in templates: %r' % field)
+        expr = '_fields[%r]' % first
+        for (is_attr, key) in rest:
+            if is_attr:
+                expr += '.%s' % key
+            else:
+                expr += '[%r]' % key
+        if conversion == 'r':
+            expr = 'repr(%s)' % expr
+        elif conversion == 's':
+            expr = 'str(%s)' % expr
+        parts.append('format(%s, %r)' % (expr, spec))
+
+    source = 'def render(_fields):\n    return "".join((%s,))\n' % ', '.join(parts)
+    namespace = { '_literals': tuple(literals) }
+    exec compile(source, '<template>', 'exec') in namespace
+    return namespace['render']
+
+class Template:
+    """ A dedented and compiled code template
+        @param text template text, in the syntax of str.format()
+    """
+    def __init__(self, text):
+        self.text = textwrap.dedent(text)
+        self._render = _compile(self.text)
+
+    def format(*args, **fields):
+        """ Fill in the template, like str.format(). The template is taken
+            from args, format(**locals()) passes a field named self.
+        """
+        return args[0]._render(fields)
+
+_templates = {}
+_dedented = {}
+
+def template(text):
+    """ Return the compiled Template for the literal text """
+    t = _templates.get(text)
+    if t is None:
+        t = _templates[text] = Template(text)
+    return t
+
+def dedent(text):
+    """ textwrap.dedent() for literals which are not formatted, computed once
+        per literal
+    """
+    dedented = _dedented.get(text)
+    if dedented is None:
+        dedented = _dedented[text] = textwrap.dedent(text)
+    return dedented
@@ -0,0 +1,97 @@
+# -*- Mode: Python -*-
+
+# GDBus - GLib D-Bus Library
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General
+# Public License along with this library; if not, see <http://www.gnu.org/licenses/>.
+
+# Phase timings (--timings)
+#
+# The phases of the generator are wrapped in
+#
+#   with timings.phase('parse'):
+#       ...
+#
+# which only measures anything while timings are enabled, see enable().
+
+import time
+
+class Timings:
+    """ Accumulated seconds and number of calls per phase """
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+
+    def add(self, name, seconds, calls = 1):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + calls
+
+    def merge(self, seconds, calls):
+        """ Add the timings of another process (Timings.seconds and .calls) """
+        for name in seconds:
+            self.add(name, seconds[name], calls[name])
+
+    def report(self, total, out):
+        """ Print the phases, slowest first
+            @param total wall time of the whole run, in seconds
+        """
+        out.write('%10s %6s %8s  %s\n' % ('seconds', '%', 'calls', 'phase'))
+        for name in sorted(self.seconds, key = lambda name: -self.seconds[name]):
+            out.write('%10.4f %6.1f %8d  %s\n' % (self.seconds[name],
+                                                  total and 100.0 * self.seconds[name] / total,
+                                                  self.calls[name], name))
+        out.write('%10.4f %6.1f %8s  %s\n' % (total, 100.0, '', 'total'))
+
+_active = None
+
+class _Phase:
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.timings.add(self.name, time.time() - self.start)
+
+class _NoPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+_no_phase = _NoPhase()
+
+def phase(name):
+    """ Context manager timing the phase 'name', if timings are enabled """
+    if _active is None:
+        return _no_phase
+    return _Phase(_active, name)
+
+def enable():
+    """ Start collecting timings
+        @return the Timings collected until disable() is called
+    """
+    global _active
+    _active = Timings()
+    return _active
+
+def disable():
+    global _active
+    _active = None
+
+def active():
+    """ The Timings being collected, or None """
+    return _active
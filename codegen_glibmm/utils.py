@@ -38,6 +38,15 @@ def strip_dots(s):
 def dots_to_hyphens(s):
     return s.replace('.', '-')
 
+def name_hash(name):
+    """ 32 bit FNV-1a hash of a D-Bus member name, the same as computed by
+        gdbus::name_hash() in the generated code
+    """
+    h = 2166136261
+    for c in name:
+        h = ((h ^ ord(c)) * 16777619) & 0xffffffff
+    return h
+
 def camel_case_to_uscore(s):
     ret = ''
     insert_uscore = False
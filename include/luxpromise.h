@@ -1,7 +1,20 @@
+#pragma once
+
+#include <algorithm>
+#include <cerrno>
+#include <chrono>
 #include <condition_variable>
+#include <cstdint>
+#include <functional>
 #include <iostream> // TODO: for debugging. remove this line.
+#include <memory>
 #include <mutex>
+#include <poll.h>
+#include <sys/eventfd.h>
+#include <system_error>
 #include <thread>
+#include <unistd.h>
+#include <vector>
 
 /** Please see the README.org for the details of the
  * locking / waiting semantics.
@@ -22,6 +35,55 @@ namespace lux {
   using unique_l = std::unique_lock<mutex_l>;
   using condvar = std::condition_variable;
   using notify_ob = bool;
+
+  /**
+   * Result of the timed and non-blocking reads and writes:
+   * ready   -- the data was read or written
+   * timeout -- the promise was not ready before the deadline
+   * ended   -- the promise was not ready and its updates have ended
+   */
+  enum class status { ready, timeout, ended };
+
+  /**
+   * A file descriptor (an eventfd) which becomes readable when one of the
+   * promises attached to it is written or ended, so that a single thread can
+   * wait on many promises with poll(), epoll or a Glib::MainContext (see
+   * luxpromise_glib.h). After waking up, call clear() and then read the
+   * promises with try_get(): a write after clear() makes the fd readable
+   * again, so no write is missed.
+   */
+  class notifier {
+    int fd_;
+
+  public:
+    notifier() : fd_(eventfd(0, EFD_NONBLOCK | EFD_CLOEXEC)) {
+      if (fd_ < 0) {
+        throw std::system_error(errno, std::system_category(), "eventfd");
+      }
+    }
+    notifier(const notifier &) = delete;
+    notifier &operator=(const notifier &) = delete;
+    ~notifier() { close(fd_); }
+
+    inline int fd() const { return fd_; }
+
+    /// Makes the fd readable
+    inline void notify() {
+      uint64_t one = 1;
+      ssize_t written = write(fd_, &one, sizeof(one));
+      (void)written; // only fails if the counter is saturated, still readable
+    }
+
+    /// Makes the fd not readable, returns the number of notify() calls since
+    /// the last clear()
+    inline uint64_t clear() {
+      uint64_t count = 0;
+      if (read(fd_, &count, sizeof(count)) != sizeof(count)) {
+        return 0;
+      }
+      return count;
+    }
+  };
   using namespace std; // TODO: for debugging. Remove
 
   /**
@@ -32,6 +94,7 @@ namespace lux {
     condvar cv_;
     bool fresh_ = false;
     bool active_ = true;
+    notifier *notifier_ = nullptr;
 
     /// Called by reads
     void stale_wake_up(unique_l &lk) {
@@ -45,8 +108,12 @@ namespace lux {
     /// Called by writes
     void fresh_wake_up(unique_l &lk) {
       fresh_ = true;
+      notifier *n = notifier_;
       lk.unlock();
       cv_.notify_all();
+      if (n) {
+        n->notify();
+      }
     }
 
     /// This is called on reads
@@ -66,6 +133,27 @@ namespace lux {
       });
     }
 
+    /// Called by the timed reads, with the lock held
+    status take_fresh(unique_l &lk, Data &data) {
+      if (!fresh_) {
+        return active_ ? status::timeout : status::ended;
+      }
+      data = data_;
+      stale_wake_up(lk);
+      return status::ready;
+    }
+
+    /// Called by the timed writes, with the lock held
+    status put_stale(unique_l &lk, Data &&data) {
+      if (LType != ptype::property && LType != ptype::notification &&
+          fresh_) {
+        return active_ ? status::timeout : status::ended;
+      }
+      data_ = std::move(data);
+      fresh_wake_up(lk);
+      return status::ready;
+    }
+
   public:
     explicit promise() = default;
     promise(const promise &) = delete;
@@ -98,9 +186,78 @@ namespace lux {
       return snapshot_data;
     }
 
-    inline void end_updates() { active_ = false; }
+    /// Reads the data into data if fresh, without blocking
+    status try_get(Data &data) {
+      unique_l lk(mutex_);
+      return take_fresh(lk, data);
+    }
+
+    /// Reads the data into data, waiting until it is fresh or the deadline
+    template <typename Clock, typename Duration>
+    status get_until(Data &data,
+                     const std::chrono::time_point<Clock, Duration> &deadline) {
+      unique_l lk(mutex_);
+      cv_.wait_until(lk, deadline, [&] { return !active_ || fresh_; });
+      return take_fresh(lk, data);
+    }
+
+    template <typename Rep, typename Period>
+    status get_for(Data &data,
+                   const std::chrono::duration<Rep, Period> &timeout) {
+      return get_until(data, std::chrono::steady_clock::now() + timeout);
+    }
+
+    /// Writes the data if the previous data was read, without blocking
+    status try_set(Data data) {
+      unique_l lk(mutex_);
+      return put_stale(lk, std::move(data));
+    }
+
+    /// Writes the data, waiting until the previous data was read or the
+    /// deadline
+    template <typename Clock, typename Duration>
+    status set_until(Data data,
+                     const std::chrono::time_point<Clock, Duration> &deadline) {
+      unique_l lk(mutex_);
+      cv_.wait_until(lk, deadline, [&] {
+        return !active_ || (LType == ptype::property) ||
+               (LType == ptype::notification) || !fresh_;
+      });
+      return put_stale(lk, std::move(data));
+    }
+
+    template <typename Rep, typename Period>
+    status set_for(Data data,
+                   const std::chrono::duration<Rep, Period> &timeout) {
+      return set_until(std::move(data), std::chrono::steady_clock::now() + timeout);
+    }
+
+    /// Wakes up the blocked readers and writers
+    inline void end_updates() {
+      unique_l lk(mutex_);
+      active_ = false;
+      notifier *n = notifier_;
+      lk.unlock();
+      cv_.notify_all();
+      if (n) {
+        n->notify();
+      }
+    }
     inline bool is_active() { return active_; }
 
+    /// True if a read would not block on a fresh value
+    inline bool is_fresh() {
+      unique_l lk(mutex_);
+      return fresh_;
+    }
+
+    /// Signals n on every write and on end_updates(), in addition to the
+    /// blocked threads. nullptr detaches the notifier.
+    inline void attach(notifier *n) {
+      unique_l lk(mutex_);
+      notifier_ = n;
+    }
+
     /// Will wait while staying fresh.
     inline promise<Data, LType> &fresh_wait() {
       unique_l lk(mutex_);
@@ -115,4 +272,371 @@ namespace lux {
       return *this;
     }
   };
+
+  /**
+   * What a write to a full queue_promise does:
+   * block       -- wait for the reader to take a value
+   * drop_oldest -- discard the oldest value in the queue
+   * reject      -- discard the written value, try_push() returns false
+   */
+  enum class overflow { block, drop_oldest, reject };
+
+  /**
+   * Method-type promise queueing the written values in a ring buffer of a
+   * fixed capacity, so that writers do not wait for the reader until the
+   * queue is full. Reads take the values in the order they were written,
+   * and block while the queue is empty.
+   */
+  template <typename Data> class queue_promise {
+    std::vector<Data> ring_;
+    size_t head_ = 0; // index of the oldest value
+    size_t size_ = 0;
+    overflow policy_;
+    mutex_l mutex_;
+    condvar cv_;
+    bool active_ = true;
+    notifier *notifier_ = nullptr;
+
+    /// Called by writes, with the lock held. With overflow::block, a full
+    /// queue waits for room if wait is set, and refuses data otherwise. The
+    /// value dropped to make room for data (overflow::drop_oldest) is moved
+    /// to evicted.
+    bool push_locked(unique_l &lk, Data &&data, bool wait, Data &evicted,
+                     bool &dropped) {
+      dropped = false;
+      if (size_ == ring_.size()) {
+        if (policy_ == overflow::reject ||
+            (policy_ == overflow::block && !wait)) {
+          return false;
+        } else if (policy_ == overflow::drop_oldest) {
+          if (!active_) {
+            return false;
+          }
+          evicted = std::move(ring_[head_]);
+          dropped = true;
+          head_ = (head_ + 1) % ring_.size();
+          --size_;
+        } else {
+          cv_.wait(lk, [&] { return !active_ || size_ < ring_.size(); });
+        }
+      }
+      if (!active_) {
+        return false;
+      }
+      ring_[(head_ + size_) % ring_.size()] = std::move(data);
+      ++size_;
+      return true;
+    }
+
+    /// Called by the timed reads, with the lock held
+    status pop_locked(unique_l &lk, Data &data) {
+      if (size_ == 0) {
+        return active_ ? status::timeout : status::ended;
+      }
+      data = std::move(ring_[head_]);
+      head_ = (head_ + 1) % ring_.size();
+      --size_;
+      lk.unlock();
+      cv_.notify_all();
+      return status::ready;
+    }
+
+    /// Queues data and wakes up the readers
+    bool write(Data &&data, bool wait, Data &evicted, bool &dropped) {
+      unique_l lk(mutex_);
+      bool queued = push_locked(lk, std::move(data), wait, evicted, dropped);
+      notifier *n = notifier_;
+      lk.unlock();
+      cv_.notify_all();
+      if (queued && n) {
+        n->notify();
+      }
+      return queued;
+    }
+
+  public:
+    explicit queue_promise(size_t capacity = 16,
+                           overflow policy = overflow::block)
+        : ring_(capacity > 0 ? capacity : 1), policy_(policy) {}
+    queue_promise(const queue_promise &) = delete;
+
+    /// Will block while the queue is full (overflow::block). Returns false if
+    /// the value was not queued, because the queue is full (overflow::reject)
+    /// or the updates have ended
+    bool push(Data data) {
+      Data evicted = Data();
+      bool dropped;
+      return write(std::move(data), true, evicted, dropped);
+    }
+
+    /// As push(data), without ever blocking: a full queue refuses data with
+    /// overflow::block too
+    bool try_push(Data data) {
+      Data evicted = Data();
+      bool dropped;
+      return try_push(std::move(data), evicted, dropped);
+    }
+
+    /// As try_push(data). If the oldest value was dropped to make room for
+    /// data (overflow::drop_oldest), it is moved to evicted and dropped is
+    /// set, so that the writer can dispose of it.
+    bool try_push(Data data, Data &evicted, bool &dropped) {
+      return write(std::move(data), false, evicted, dropped);
+    }
+
+    queue_promise &operator=(Data &&update_data) {
+      push(std::move(update_data));
+      return *this;
+    }
+
+    queue_promise &operator=(const Data &update_data) {
+      push(update_data);
+      return *this;
+    }
+
+    /// Will block while the queue is empty and active. Once the updates
+    /// have ended and the queue is drained, returns a default Data.
+    const Data operator()() {
+      unique_l lk(mutex_);
+      cv_.wait(lk, [&] { return !active_ || size_ > 0; });
+      Data data = Data();
+      pop_locked(lk, data);
+      return data;
+    }
+
+    /// Takes the oldest value into data if there is one, without blocking
+    status try_get(Data &data) {
+      unique_l lk(mutex_);
+      return pop_locked(lk, data);
+    }
+
+    /// Takes the oldest value into data, waiting until there is one or the
+    /// deadline
+    template <typename Clock, typename Duration>
+    status get_until(Data &data,
+                     const std::chrono::time_point<Clock, Duration> &deadline) {
+      unique_l lk(mutex_);
+      cv_.wait_until(lk, deadline, [&] { return !active_ || size_ > 0; });
+      return pop_locked(lk, data);
+    }
+
+    template <typename Rep, typename Period>
+    status get_for(Data &data,
+                   const std::chrono::duration<Rep, Period> &timeout) {
+      return get_until(data, std::chrono::steady_clock::now() + timeout);
+    }
+
+    inline void end_updates() {
+      unique_l lk(mutex_);
+      active_ = false;
+      notifier *n = notifier_;
+      lk.unlock();
+      cv_.notify_all();
+      if (n) {
+        n->notify();
+      }
+    }
+    inline bool is_active() { return active_; }
+
+    /// True if a read would not block on an empty queue
+    inline bool is_fresh() {
+      unique_l lk(mutex_);
+      return size_ > 0;
+    }
+
+    /// Signals n on every queued value and on end_updates()
+    inline void attach(notifier *n) {
+      unique_l lk(mutex_);
+      notifier_ = n;
+    }
+
+    /// Will wait while the queue is empty.
+    inline queue_promise<Data> &fresh_wait() {
+      unique_l lk(mutex_);
+      cv_.wait(lk, [&] { return !active_ || size_ > 0; });
+      return *this;
+    }
+
+    inline size_t size() {
+      unique_l lk(mutex_);
+      return size_;
+    }
+    inline size_t capacity() const { return ring_.size(); }
+  };
+  /**
+   * Property-type promise for data which is read much more often than it is
+   * written, e.g. large arrays read by several threads. Every write
+   * publishes a new immutable copy of the data, and snapshot() returns the
+   * current one without copying it and without taking the lock, so readers
+   * never wait for each other or for writers. A snapshot stays valid (and
+   * unchanged) while it is held, even if newer data is written.
+   */
+  template <typename Data> class snapshot_promise {
+    std::shared_ptr<const Data> data_;
+    mutex_l mutex_; // only for the waits of the readers
+    condvar cv_;
+    bool active_ = true;
+    notifier *notifier_ = nullptr;
+
+    void publish(std::shared_ptr<const Data> data) {
+      std::atomic_store(&data_, std::move(data));
+      unique_l lk(mutex_);
+      notifier *n = notifier_;
+      lk.unlock();
+      cv_.notify_all();
+      if (n) {
+        n->notify();
+      }
+    }
+
+  public:
+    explicit snapshot_promise() = default;
+    snapshot_promise(const snapshot_promise &) = delete;
+    explicit snapshot_promise(Data data)
+        : data_(std::make_shared<const Data>(std::move(data))) {}
+
+    snapshot_promise &operator=(Data &&update_data) {
+      publish(std::make_shared<const Data>(std::move(update_data)));
+      return *this;
+    }
+
+    snapshot_promise &operator=(const Data &update_data) {
+      publish(std::make_shared<const Data>(update_data));
+      return *this;
+    }
+
+    /// The current data, or nullptr if none was written yet. Never blocks.
+    inline std::shared_ptr<const Data> snapshot() const {
+      return std::atomic_load(&data_);
+    }
+
+    /// Will block until the first write, as promise<Data, ptype::property>.
+    /// Returns a copy of the current data, use snapshot() to avoid it.
+    const Data operator()() {
+      fresh_wait();
+      std::shared_ptr<const Data> data = snapshot();
+      return data ? *data : Data();
+    }
+
+    inline void end_updates() {
+      unique_l lk(mutex_);
+      active_ = false;
+      notifier *n = notifier_;
+      lk.unlock();
+      cv_.notify_all();
+      if (n) {
+        n->notify();
+      }
+    }
+    inline bool is_active() { return active_; }
+
+    /// True once the data was written
+    inline bool is_fresh() { return snapshot() != nullptr; }
+
+    /// Signals n on every write and on end_updates()
+    inline void attach(notifier *n) {
+      unique_l lk(mutex_);
+      notifier_ = n;
+    }
+
+    /// Will wait until the data was written.
+    inline snapshot_promise<Data> &fresh_wait() {
+      unique_l lk(mutex_);
+      cv_.wait(lk, [&] { return !active_ || snapshot() != nullptr; });
+      return *this;
+    }
+  };
+
+  /**
+   * Waits on a set of promises (and queue promises) at once, for the first
+   * one becoming fresh. The promises are attached to the notifier of the
+   * selector, which replaces any notifier they were attached to, until the
+   * selector is destroyed. Property-type promises stay fresh once written,
+   * so select method, event and notification-type promises.
+   */
+  class selector {
+    notifier notifier_;
+    std::vector<std::function<bool()>> fresh_;
+    std::vector<std::function<bool()>> active_;
+    std::vector<std::function<void()>> detach_;
+    size_t next_ = 0; // where to start looking, so all promises get a turn
+
+    /// Sets index to a fresh promise, timeout if there is none
+    status find_fresh(size_t &index) {
+      bool active = false;
+      for (size_t k = 0; k < fresh_.size(); ++k) {
+        size_t i = (next_ + k) % fresh_.size();
+        if (fresh_[i]()) {
+          next_ = i + 1;
+          index = i;
+          return status::ready;
+        }
+        active = active || active_[i]();
+      }
+      return active ? status::timeout : status::ended;
+    }
+
+  public:
+    selector() = default;
+    selector(const selector &) = delete;
+    ~selector() {
+      for (auto &detach : detach_) {
+        detach();
+      }
+    }
+
+    /// Adds p to the set, returns its index
+    template <typename Promise> size_t add(Promise &p) {
+      p.attach(&notifier_);
+      fresh_.push_back([&p] { return p.is_fresh(); });
+      active_.push_back([&p] { return p.is_active(); });
+      detach_.push_back([&p] { p.attach(nullptr); });
+      return fresh_.size() - 1;
+    }
+
+    /// The notifier of the selector, to wait in a main loop instead
+    inline notifier &get_notifier() { return notifier_; }
+
+    /// Waits until one of the promises is fresh and returns its index, or
+    /// -1 once all of them have ended
+    int wait_any() {
+      size_t index = 0;
+      if (wait_any_until(index, std::chrono::steady_clock::time_point::max()) !=
+          status::ready) {
+        return -1;
+      }
+      return (int)index;
+    }
+
+    /// Sets index to the first promise which is fresh before the deadline
+    template <typename Clock, typename Duration>
+    status wait_any_until(size_t &index,
+                          const std::chrono::time_point<Clock, Duration> &deadline) {
+      for (;;) {
+        notifier_.clear();
+        status found = find_fresh(index);
+        if (found != status::timeout) {
+          return found;
+        }
+
+        int timeout_ms = -1;
+        if (deadline != std::chrono::time_point<Clock, Duration>::max()) {
+          auto remaining = std::chrono::duration_cast<std::chrono::milliseconds>(
+              deadline - Clock::now());
+          if (remaining.count() < 0) {
+            return status::timeout;
+          }
+          timeout_ms = (int)std::min<long long>(remaining.count() + 1, 1 << 30);
+        }
+        struct pollfd pfd = {notifier_.fd(), POLLIN, 0};
+        poll(&pfd, 1, timeout_ms);
+      }
+    }
+
+    template <typename Rep, typename Period>
+    status wait_any_for(size_t &index,
+                        const std::chrono::duration<Rep, Period> &timeout) {
+      return wait_any_until(index, std::chrono::steady_clock::now() + timeout);
+    }
+  };
 }
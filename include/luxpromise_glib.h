@@ -0,0 +1,33 @@
+#pragma once
+
+#include <glibmm.h>
+#include <luxpromise.h>
+
+/** Integration of lux::notifier with the glibmm main loop.
+ */
+
+namespace lux {
+  /**
+   * Calls slot from the main loop of context (the default one if null)
+   * whenever one of the promises attached to n is written or ended. n is
+   * cleared before slot is called, which reads the promises with try_get().
+   * Returning false from slot disconnects it, as for Glib::signal_io().
+   * n must outlive the connection.
+   */
+  inline sigc::connection
+  connect_notifier(notifier &n, const sigc::slot<bool> &slot,
+                   const Glib::RefPtr<Glib::MainContext> &context =
+                       Glib::RefPtr<Glib::MainContext>(),
+                   int priority = Glib::PRIORITY_DEFAULT) {
+    Glib::RefPtr<Glib::IOSource> source =
+        Glib::IOSource::create(n.fd(), Glib::IO_IN);
+    source->set_priority(priority);
+    sigc::connection connection =
+        source->connect([&n, slot](Glib::IOCondition) {
+          n.clear();
+          return slot();
+        });
+    source->attach(context ? context : Glib::MainContext::get_default());
+    return connection;
+  }
+}
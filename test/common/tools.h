@@ -1,8 +1,20 @@
 #include <glibmm.h>
 #include <giomm.h>
+#include <iomanip>
+#include <iostream>
 #include <vector>
 #include <string>
 
+inline void printStatus(std::string message, bool isOK) {
+    if (isOK) {
+        std::cout << std::setw(60) << std::left << message << std::right
+                  << "\033[32m[  OK  ]\033[0m" << std::endl;
+    } else {
+        std::cout << std::setw(60) << std::left << message << std::right
+                  << "\033[31m[ FAIL ]\033[0m" << std::endl;
+    }
+}
+
 class CodegenTools {
 public:
     template<typename T>
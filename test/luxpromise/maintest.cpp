@@ -3,6 +3,7 @@
 #include <gtest/gtest.h>
 #include <iostream>
 #include <luxpromise.h>
+#include <poll.h>
 
 constexpr int countdown = 16384;
 constexpr int meltdown = 100000;
@@ -86,3 +87,211 @@ TEST_F(PromiseTests, test_event_mode) {
 TEST_F(PromiseTests, test_notification_mode) {
   test_property_like(notif, meltdown);
 }
+
+TEST_F(PromiseTests, test_queue_mode) {
+  queue_promise<int> queue{64};
+  test_method_like(queue, meltdown);
+}
+
+TEST(QueuePromiseTests, test_queue_drop_oldest) {
+  queue_promise<int> queue{2, overflow::drop_oldest};
+  for (auto i = 1; i <= 5; ++i) {
+    ASSERT_TRUE(queue.try_push(i));
+  }
+  ASSERT_EQ(queue.size(), 2u);
+  ASSERT_EQ(queue(), 4);
+  ASSERT_EQ(queue(), 5);
+}
+
+TEST(QueuePromiseTests, test_queue_drop_oldest_evicted) {
+  queue_promise<int> queue{2, overflow::drop_oldest};
+  int evicted = 0;
+  bool dropped = true;
+  ASSERT_TRUE(queue.try_push(1, evicted, dropped));
+  ASSERT_FALSE(dropped);
+  ASSERT_TRUE(queue.try_push(2, evicted, dropped));
+  ASSERT_FALSE(dropped);
+  ASSERT_TRUE(queue.try_push(3, evicted, dropped));
+  ASSERT_TRUE(dropped);
+  ASSERT_EQ(evicted, 1);
+  ASSERT_TRUE(queue.try_push(4, evicted, dropped));
+  ASSERT_TRUE(dropped);
+  ASSERT_EQ(evicted, 2);
+  ASSERT_EQ(queue(), 3);
+  ASSERT_EQ(queue(), 4);
+
+  // Nothing is dropped once the updates have ended
+  ASSERT_TRUE(queue.try_push(5, evicted, dropped));
+  ASSERT_TRUE(queue.try_push(6, evicted, dropped));
+  queue.end_updates();
+  ASSERT_FALSE(queue.try_push(7, evicted, dropped));
+  ASSERT_FALSE(dropped);
+  ASSERT_EQ(queue(), 5);
+  ASSERT_EQ(queue(), 6);
+}
+
+TEST(QueuePromiseTests, test_queue_block) {
+  queue_promise<int> queue{1, overflow::block};
+  ASSERT_TRUE(queue.push(1));
+  // try_push() does not wait for room
+  ASSERT_FALSE(queue.try_push(2));
+
+  // push() does
+  std::thread writer([&] { ASSERT_TRUE(queue.push(3)); });
+  std::this_thread::sleep_for(std::chrono::milliseconds(10));
+  ASSERT_EQ(queue.size(), 1u);
+  ASSERT_EQ(queue(), 1);
+  ASSERT_EQ(queue(), 3);
+  writer.join();
+}
+
+TEST(QueuePromiseTests, test_queue_reject) {
+  queue_promise<int> queue{2, overflow::reject};
+  ASSERT_TRUE(queue.try_push(1));
+  ASSERT_TRUE(queue.try_push(2));
+  ASSERT_FALSE(queue.try_push(3));
+  ASSERT_EQ(queue(), 1);
+  ASSERT_TRUE(queue.try_push(4));
+  ASSERT_EQ(queue(), 2);
+  ASSERT_EQ(queue(), 4);
+
+  queue.end_updates();
+  ASSERT_FALSE(queue.try_push(5));
+  ASSERT_EQ(queue(), 0);
+}
+
+TEST_F(PromiseTests, test_timed_reads) {
+  int value = 0;
+  ASSERT_EQ(method.try_get(value), status::timeout);
+  ASSERT_EQ(method.get_for(value, std::chrono::milliseconds(10)),
+            status::timeout);
+
+  method = 41;
+  ASSERT_EQ(method.try_get(value), status::ready);
+  ASSERT_EQ(value, 41);
+
+  std::thread t1([&]() {
+    std::this_thread::sleep_for(std::chrono::milliseconds(10));
+    method = 42;
+  });
+  ASSERT_EQ(method.get_until(value, std::chrono::steady_clock::now() +
+                                        std::chrono::seconds(10)),
+            status::ready);
+  ASSERT_EQ(value, 42);
+  t1.join();
+
+  method.end_updates();
+  ASSERT_EQ(method.get_for(value, std::chrono::seconds(10)), status::ended);
+}
+
+TEST_F(PromiseTests, test_timed_writes) {
+  ASSERT_EQ(method.try_set(1), status::ready);
+  ASSERT_EQ(method.try_set(2), status::timeout);
+  ASSERT_EQ(method.set_for(2, std::chrono::milliseconds(10)), status::timeout);
+  ASSERT_EQ(method(), 1);
+  ASSERT_EQ(method.try_set(2), status::ready);
+  ASSERT_EQ(data.try_set(1), status::ready);
+  ASSERT_EQ(data.try_set(2), status::ready);
+
+  std::thread t1([&]() {
+    std::this_thread::sleep_for(std::chrono::milliseconds(10));
+    method.end_updates();
+  });
+  ASSERT_EQ(method.set_for(3, std::chrono::seconds(10)), status::ended);
+  t1.join();
+}
+
+TEST_F(PromiseTests, test_notifier) {
+  notifier n;
+  queue_promise<int> queue{4};
+  method.attach(&n);
+  queue.attach(&n);
+
+  struct pollfd pfd = {n.fd(), POLLIN, 0};
+  ASSERT_EQ(poll(&pfd, 1, 0), 0);
+
+  std::thread t1([&]() {
+    method = 1;
+    queue = 2;
+  });
+  t1.join();
+  ASSERT_EQ(poll(&pfd, 1, 1000), 1);
+  ASSERT_EQ(n.clear(), 2u);
+  ASSERT_EQ(poll(&pfd, 1, 0), 0);
+
+  int value = 0;
+  ASSERT_EQ(method.try_get(value), status::ready);
+  ASSERT_EQ(value, 1);
+  ASSERT_EQ(queue.try_get(value), status::ready);
+  ASSERT_EQ(value, 2);
+
+  method.end_updates();
+  ASSERT_EQ(poll(&pfd, 1, 0), 1);
+  method.attach(nullptr);
+}
+
+TEST_F(PromiseTests, test_selector) {
+  queue_promise<int> queue{4};
+  selector sel;
+  ASSERT_EQ(sel.add(method), 0u);
+  ASSERT_EQ(sel.add(event), 1u);
+  ASSERT_EQ(sel.add(queue), 2u);
+
+  size_t index = 0;
+  ASSERT_EQ(sel.wait_any_for(index, std::chrono::milliseconds(10)),
+            status::timeout);
+
+  std::thread t1([&]() {
+    std::this_thread::sleep_for(std::chrono::milliseconds(10));
+    event = 7;
+  });
+  ASSERT_EQ(sel.wait_any(), 1);
+  ASSERT_EQ(event(), 7);
+  t1.join();
+
+  // every fresh promise gets its turn, starting after the last one
+  method = 1;
+  queue = 2;
+  queue = 3;
+  std::vector<int> values;
+  for (auto k = 0; k < 3; ++k) {
+    int value = 0;
+    switch (sel.wait_any()) {
+    case 0:
+      ASSERT_EQ(method.try_get(value), status::ready);
+      break;
+    case 2:
+      ASSERT_EQ(queue.try_get(value), status::ready);
+      break;
+    default:
+      FAIL();
+    }
+    values.push_back(value);
+  }
+  ASSERT_EQ(values, (std::vector<int>{2, 1, 3}));
+
+  method.end_updates();
+  event.end_updates();
+  queue.end_updates();
+  ASSERT_EQ(sel.wait_any(), -1);
+}
+
+TEST(SnapshotPromiseTests, test_snapshot_mode) {
+  snapshot_promise<int> snap;
+  test_property_like(snap, countdown);
+}
+
+TEST(SnapshotPromiseTests, test_snapshot_is_immutable) {
+  snapshot_promise<std::vector<std::string>> snap;
+  ASSERT_EQ(snap.snapshot(), nullptr);
+
+  snap = std::vector<std::string>{"Value1", "Value2"};
+  auto first = snap.snapshot();
+  snap = std::vector<std::string>{"Value3"};
+  auto second = snap.snapshot();
+
+  ASSERT_EQ(*first, (std::vector<std::string>{"Value1", "Value2"}));
+  ASSERT_EQ(*second, (std::vector<std::string>{"Value3"}));
+  ASSERT_EQ(snap.snapshot(), second);
+  ASSERT_EQ(snap(), (std::vector<std::string>{"Value3"}));
+}
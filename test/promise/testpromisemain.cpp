@@ -2,6 +2,7 @@
 #include "tools.h"
 #include <iostream>
 #include <string>
+#include <thread>
 #include <vector>
 
 using namespace org::gdbus::codegen::glibmm;
@@ -9,11 +10,76 @@ using namespace std;
 
 void FutureTest::TestTriggerInternalPropertyChange(
     gint32 newValue, TestMessageHelper invocation) {
-  TestPropInternalReadPropertyChange_set(newValue);
-  TestPropInternalReadWritePropertyChange_set(newValue);
+  // The object called, the registered one or one of a subtree
+  const std::string objectPath = invocation.getObjectPath();
+  TestPropInternalReadPropertyChange_set(objectPath, newValue);
+  TestPropInternalReadWritePropertyChange_set(objectPath, newValue);
   invocation.ret();
 }
 
+/* TestString is queued (see futures.xml), its calls are answered here, by
+ * dispatch_loop(), in the order they were made. */
+void FutureTest::TestString_dispatch(std::string Param1,
+                                     TestMessageHelper invocation) {
+  invocation.ret(Param1);
+}
+
+/* TestQueueDropOldest queues a single call, dropping the oldest one (see
+ * futures.xml). */
+void FutureTest::TestQueueDropOldest_dispatch(std::string Param1,
+                                              TestMessageHelper invocation) {
+  invocation.ret(Param1);
+}
+
+/* Three calls of TestQueueDropOldest made in a row, before dispatch_loop()
+ * runs: the first two are each dropped for the next one, and answered with
+ * LimitsExceeded, the last one is served once dispatch_loop() runs. */
+Glib::RefPtr<Gio::DBus::Connection> queueConnection;
+int queueReplies = 0;
+std::vector<std::string> queueDropped;
+std::vector<std::string> queueServed;
+
+void on_queue_drop_oldest_finished(const Glib::RefPtr<Gio::AsyncResult> result,
+                                   std::string param, FutureTest *ft) {
+  try {
+    queueConnection->call_finish(result);
+    queueServed.push_back(param);
+  } catch (const Gio::DBus::Error &ex) {
+    if (ex.code() == Gio::DBus::Error::LIMITS_EXCEEDED) {
+      queueDropped.push_back(param);
+    }
+  }
+  ++queueReplies;
+  if (queueReplies == 2) {
+    // All the calls were queued or dropped, serve them
+    std::thread dispatch(&FutureTest::dispatch_loop, ft);
+    dispatch.detach();
+  } else if (queueReplies == 3) {
+    printStatus("Queue: oldest calls dropped",
+                queueDropped == std::vector<std::string>{"1", "2"} &&
+                    queueServed == std::vector<std::string>{"3"});
+  }
+}
+
+void test_queue_drop_oldest(FutureTest *ft) {
+  queueConnection =
+      Gio::DBus::Connection::get_sync(Gio::DBus::BUS_TYPE_SESSION);
+  for (std::string param : {"1", "2", "3"}) {
+    std::vector<Glib::VariantBase> params;
+    params.push_back(Glib::Variant<Glib::ustring>::create(param));
+    queueConnection->call(
+        "/org/gdbus/codegen/glibmm/Test", "org.gdbus.codegen.glibmm.Test",
+        "TestQueueDropOldest", Glib::VariantContainerBase::create_tuple(params),
+        sigc::bind(sigc::ptr_fun(&on_queue_drop_oldest_finished), param, ft),
+        "org.gdbus.codegen.glibmm.Test");
+  }
+}
+
+bool FutureTest::TestPropReadWriteString_setHandler(
+    const std::string & /* object_path */, std::string value) {
+  return value != "Rejected";
+}
+
 //*
 void setupProperties(FutureTest &ft) {
   // on this member, due to the semantics of futures
@@ -91,5 +157,23 @@ int main() {
   Glib::RefPtr<Glib::MainLoop> ml = Glib::MainLoop::create();
   setupProperties(ft);
 
+  /* A single instance serving the objects below /org/gdbus/codegen/glibmm/Subtree */
+  FutureTest subtree;
+  subtree.register_subtree(
+      Gio::DBus::Connection::get_sync(Gio::DBus::BUS_TYPE_SESSION),
+      "/org/gdbus/codegen/glibmm/Subtree");
+  subtree.set_properties_changed_policy(gdbus::PropertiesChangedPolicy::Idle);
+  subtree.add_object("first");
+  subtree.add_object("second");
+  subtree.add_object("third");
+  subtree.remove_object("third");
+  subtree.TestPropReadString_set(subtree.object_path("first"), "First");
+  subtree.TestPropReadString_set(subtree.object_path("second"), "Second");
+
+  // The calls are made to this process, once its name is owned. The calls
+  // are served by dispatch_loop() once they are queued.
+  Glib::signal_timeout().connect_once(
+      sigc::bind(sigc::ptr_fun(&test_queue_drop_oldest), &ft), 500);
+
   ml->run();
 }
@@ -3,4 +3,12 @@
 class FutureTest : public org::gdbus::codegen::glibmm::Test {
   virtual void TestTriggerInternalPropertyChange(gint32 newValue,
                                                  TestMessageHelper invocation);
+  virtual void TestString_dispatch(std::string Param1,
+                                   TestMessageHelper invocation);
+  virtual void TestQueueDropOldest_dispatch(std::string Param1,
+                                            TestMessageHelper invocation);
+  // The objects of the subtree
+  virtual bool
+  TestPropReadWriteString_setHandler(const std::string &object_path,
+                                     std::string value);
 };
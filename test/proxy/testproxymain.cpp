@@ -3,19 +3,11 @@
 #include "tools.h"
 #include <iomanip>
 #include <iostream>
+#include <sys/mman.h>
+#include <unistd.h>
 
 Glib::RefPtr<org::gdbus::codegen::glibmm::Test> proxy;
 
-void printStatus(std::string message, bool isOK) {
-  if (isOK) {
-    std::cout << std::setw(60) << std::left << message << std::right
-              << "\033[32m[  OK  ]\033[0m" << std::endl;
-  } else {
-    std::cout << std::setw(60) << std::left << message << std::right
-              << "\033[31m[ FAIL ]\033[0m" << std::endl;
-  }
-}
-
 void on_test_variant_finished(const Glib::RefPtr<Gio::AsyncResult> result,
                               Glib::ustring expectedBase) {
   Glib::VariantBase base;
@@ -88,6 +80,17 @@ void on_test_string_finished(const Glib::RefPtr<Gio::AsyncResult> result,
   printStatus("String", res == expected);
 }
 
+void on_test_cancelled_finished(const Glib::RefPtr<Gio::AsyncResult> result) {
+  bool cancelled = false;
+  try {
+    std::string res;
+    proxy->TestString_finish(res, result);
+  } catch (const Gio::Error &ex) {
+    cancelled = ex.code() == Gio::Error::CANCELLED;
+  }
+  printStatus("Cancelled call", cancelled);
+}
+
 void on_test_double_finished(const Glib::RefPtr<Gio::AsyncResult> result,
                              double expected) {
   double res;
@@ -151,6 +154,183 @@ void on_test_boolean_finished(const Glib::RefPtr<Gio::AsyncResult> result,
   printStatus("Boolean", res == expected);
 }
 
+void on_test_struct_finished(const Glib::RefPtr<Gio::AsyncResult> result,
+                             std::tuple<gint32, Glib::ustring, double> expected) {
+  std::tuple<gint32, Glib::ustring, double> res;
+  proxy->TestStruct_finish(res, result);
+  printStatus("Struct", res == expected);
+}
+
+void on_test_dict_finished(const Glib::RefPtr<Gio::AsyncResult> result,
+                           Glib::ustring expectedValue) {
+  std::map<Glib::ustring, Glib::VariantBase> res;
+  proxy->TestDict_finish(res, result);
+
+  bool isOK = res.size() == 2 && res.count("count") == 1 &&
+              res.count("name") == 1;
+  if (isOK) {
+    Glib::Variant<Glib::ustring> name =
+        Glib::VariantBase::cast_dynamic<Glib::Variant<Glib::ustring>>(
+            res["name"]);
+    Glib::Variant<gint32> count =
+        Glib::VariantBase::cast_dynamic<Glib::Variant<gint32>>(res["count"]);
+    isOK = name.get() == expectedValue && count.get() == 42;
+  }
+  printStatus("Dict", isOK);
+}
+
+void on_test_int_array_finished(const Glib::RefPtr<Gio::AsyncResult> result,
+                                std::vector<gint32> expected) {
+  gdbus::FixedArray<gint32> res;
+  proxy->TestIntArray_finish(res, result);
+  printStatus("Int array", res.to_vector() == expected);
+}
+
+void on_test_double_array_finished(const Glib::RefPtr<Gio::AsyncResult> result,
+                                   std::vector<double> expected) {
+  gdbus::FixedArray<double> res;
+  proxy->TestDoubleArray_finish(res, result);
+  printStatus("Double array",
+              res.size() == expected.size() &&
+                  std::equal(res.begin(), res.end(), expected.begin()));
+}
+
+void on_test_byte_array_view_finished(
+    const Glib::RefPtr<Gio::AsyncResult> result, std::vector<guchar> expected) {
+  gdbus::FixedArray<guchar> res;
+  proxy->TestByteArrayView_finish(res, result);
+  std::vector<guchar> copy = res;
+  printStatus("Byte array view", copy == expected);
+}
+
+void on_test_struct_array_finished(
+    const Glib::RefPtr<Gio::AsyncResult> result,
+    std::vector<std::tuple<Glib::ustring, double, guint32>> expected) {
+  std::vector<std::tuple<Glib::ustring, double, guint32>> res;
+  proxy->TestStructArray_finish(res, result);
+  printStatus("Struct array", res == expected);
+}
+
+void on_test_unix_fd_finished(const Glib::RefPtr<Gio::AsyncResult> result,
+                              std::string expected) {
+  gdbus::Handle res;
+  Glib::RefPtr<Gio::UnixFDList> fdList;
+  proxy->TestUnixFD_finish(res, fdList, result);
+
+  // The file descriptor refers to the same memfd, read it from the start
+  int fd = fdList->get(res);
+  std::vector<char> buffer(expected.size() + 1);
+  ssize_t size = pread(fd, buffer.data(), buffer.size(), 0);
+  close(fd);
+  printStatus("Unix file descriptor",
+              size == (ssize_t)expected.size() &&
+                  std::string(buffer.data(), size) == expected);
+}
+
+Glib::RefPtr<Gio::DBus::Proxy> subtreeObject;
+bool subtreeChangedReported = false;
+
+// Reports the first PropertiesChanged, or its absence
+void report_subtree_properties_changed(bool isOK) {
+  if (!subtreeChangedReported) {
+    subtreeChangedReported = true;
+    printStatus("Subtree: coalesced PropertiesChanged", isOK);
+  }
+}
+
+void on_subtree_properties_changed(
+    const Gio::DBus::Proxy::MapChangedProperties &changed,
+    const std::vector<Glib::ustring> & /* invalidated */) {
+  // The stub sets both properties in a single call, with the Idle policy, so
+  // a first signal without both of them fails
+  report_subtree_properties_changed(
+      changed.size() == 2 &&
+      changed.count("TestPropInternalReadPropertyChange") &&
+      changed.count("TestPropInternalReadWritePropertyChange"));
+}
+
+void test_subtree() {
+  /* The objects served by a single instance, listed by the object manager */
+  Glib::RefPtr<Gio::DBus::Proxy> objectManager =
+      Gio::DBus::Proxy::create_for_bus_sync(
+          Gio::DBus::BUS_TYPE_SESSION, "org.gdbus.codegen.glibmm.Test",
+          "/org/gdbus/codegen/glibmm/Subtree",
+          "org.freedesktop.DBus.ObjectManager");
+  Glib::VariantContainerBase managed =
+      objectManager->call_sync("GetManagedObjects");
+
+  std::vector<std::string> paths;
+  GVariant *objects = g_variant_get_child_value(managed.gobj(), 0);
+  GVariantIter iter;
+  const gchar *path;
+  g_variant_iter_init(&iter, objects);
+  while (g_variant_iter_next(&iter, "{&o@a{sa{sv}}}", &path, NULL)) {
+    paths.push_back(path);
+  }
+  g_variant_unref(objects);
+
+  std::vector<std::string> expectedPaths;
+  expectedPaths.push_back("/org/gdbus/codegen/glibmm/Subtree/first");
+  expectedPaths.push_back("/org/gdbus/codegen/glibmm/Subtree/second");
+  printStatus("Subtree: GetManagedObjects", paths == expectedPaths);
+
+  /* A property of one of the objects */
+  subtreeObject = Gio::DBus::Proxy::create_for_bus_sync(
+      Gio::DBus::BUS_TYPE_SESSION, "org.gdbus.codegen.glibmm.Test",
+      "/org/gdbus/codegen/glibmm/Subtree/second",
+      "org.gdbus.codegen.glibmm.Test");
+  Glib::Variant<Glib::ustring> value;
+  subtreeObject->get_cached_property(value, "TestPropReadString");
+  printStatus("Subtree: property of an object",
+              value.gobj() && value.get() == "Second");
+
+  /* Each object has its own properties */
+  Glib::RefPtr<Gio::DBus::Proxy> firstObject =
+      Gio::DBus::Proxy::create_for_bus_sync(
+          Gio::DBus::BUS_TYPE_SESSION, "org.gdbus.codegen.glibmm.Test",
+          "/org/gdbus/codegen/glibmm/Subtree/first",
+          "org.gdbus.codegen.glibmm.Test");
+  firstObject->get_cached_property(value, "TestPropReadString");
+  printStatus("Subtree: properties of each object",
+              value.gobj() && value.get() == "First");
+
+  /* Writes to an object go through the handler of the implementation, which
+   * rejects "Rejected" */
+  Glib::RefPtr<Gio::DBus::Proxy> properties =
+      Gio::DBus::Proxy::create_for_bus_sync(
+          Gio::DBus::BUS_TYPE_SESSION, "org.gdbus.codegen.glibmm.Test",
+          "/org/gdbus/codegen/glibmm/Subtree/first",
+          "org.freedesktop.DBus.Properties");
+  for (const char *written : {"Accepted", "Rejected"}) {
+    properties->call_sync(
+        "Set", Glib::VariantContainerBase(g_variant_new(
+                   "(ssv)", "org.gdbus.codegen.glibmm.Test",
+                   "TestPropReadWriteString", g_variant_new_string(written))));
+  }
+  Glib::VariantContainerBase got = properties->call_sync(
+      "Get", Glib::VariantContainerBase(
+                 g_variant_new("(ss)", "org.gdbus.codegen.glibmm.Test",
+                               "TestPropReadWriteString")));
+  GVariant *gotValue = NULL;
+  g_variant_get(got.gobj(), "(v)", &gotValue);
+  printStatus("Subtree: property set handler",
+              g_strcmp0(g_variant_get_string(gotValue, NULL), "Accepted") ==
+                  0);
+  g_variant_unref(gotValue);
+
+  /* Properties set together are emitted in one PropertiesChanged */
+  subtreeObject->signal_properties_changed().connect(
+      sigc::ptr_fun(&on_subtree_properties_changed));
+  std::vector<Glib::VariantBase> params;
+  params.push_back(Glib::Variant<gint32>::create(43));
+  subtreeObject->call_sync(
+      "TestTriggerInternalPropertyChange",
+      Glib::VariantContainerBase::create_tuple(params));
+  Glib::signal_timeout().connect_once(
+      sigc::bind(sigc::ptr_fun(&report_subtree_properties_changed), false),
+      500);
+}
+
 void on_test_all_finished(const Glib::RefPtr<Gio::AsyncResult> result) {
   std::vector<std::string> resByteStringArray;
   std::vector<std::string> resObjectPathArray;
@@ -186,6 +366,13 @@ void on_test_trigger_internal_property_change_finished(
               proxy->TestPropInternalReadWritePropertyChange_get() == expected);
 }
 
+void on_refresh_properties_finished(const Glib::RefPtr<Gio::AsyncResult> result) {
+  proxy->refresh_properties_finish(result);
+  printStatus("Property cache: refresh_properties",
+              proxy->TestPropReadString_get() == "Value10" &&
+                  proxy->TestPropReadInt_get() == 1341);
+}
+
 void on_test_prop_read_write_string(const Glib::RefPtr<Gio::AsyncResult> result,
                                     const std::string &expected) {
   proxy->TestPropReadWriteString_set_finish(result);
@@ -486,6 +673,76 @@ void proxy_created(const Glib::RefPtr<Gio::AsyncResult> result) {
       booleanValue,
       sigc::bind(sigc::ptr_fun(&on_test_boolean_finished), booleanValue));
 
+  /* Struct */
+  std::tuple<gint32, Glib::ustring, double> structValue(-1344, "Struct", 13.45);
+  proxy->TestStruct(
+      structValue,
+      sigc::bind(sigc::ptr_fun(&on_test_struct_finished), structValue));
+
+  /* Dict */
+  std::map<Glib::ustring, Glib::VariantBase> dictValue;
+  dictValue["name"] = Glib::Variant<Glib::ustring>::create("Dict");
+  dictValue["count"] = Glib::Variant<gint32>::create(42);
+  proxy->TestDict(dictValue, sigc::bind(sigc::ptr_fun(&on_test_dict_finished),
+                                        Glib::ustring("Dict")));
+
+  /* Int array */
+  std::vector<gint32> intArrayValue;
+  intArrayValue.push_back(-1);
+  intArrayValue.push_back(1345);
+  intArrayValue.push_back(G_MAXINT32);
+  proxy->TestIntArray(
+      intArrayValue,
+      sigc::bind(sigc::ptr_fun(&on_test_int_array_finished), intArrayValue));
+
+  /* Double array, a 1 MB frame */
+  std::vector<double> doubleArrayValue(131072);
+  for (gsize i = 0; i < doubleArrayValue.size(); i++) {
+    doubleArrayValue[i] = i * 0.5;
+  }
+  proxy->TestDoubleArray(
+      doubleArrayValue, sigc::bind(sigc::ptr_fun(&on_test_double_array_finished),
+                                   doubleArrayValue));
+
+  /* Byte array view, including a NUL byte */
+  std::vector<guchar> byteArrayValue;
+  byteArrayValue.push_back('a');
+  byteArrayValue.push_back(0);
+  byteArrayValue.push_back(255);
+  proxy->TestByteArrayView(
+      byteArrayValue,
+      sigc::bind(sigc::ptr_fun(&on_test_byte_array_view_finished),
+                 byteArrayValue));
+
+  /* Struct array */
+  std::vector<std::tuple<Glib::ustring, double, guint32>> structArrayValue;
+  structArrayValue.push_back(std::make_tuple("first", 1.5, 1346));
+  structArrayValue.push_back(std::make_tuple("second", -2.5, 1347));
+  proxy->TestStructArray(
+      structArrayValue,
+      sigc::bind(sigc::ptr_fun(&on_test_struct_array_finished),
+                 structArrayValue));
+
+  /* Unix file descriptor, a memfd passed to the stub and back */
+  std::string memfdValue = "Data in a memfd";
+  int memfd = memfd_create("gdbus-codegen-glibmm-test", 0);
+  if (write(memfd, memfdValue.data(), memfdValue.size()) !=
+      (ssize_t)memfdValue.size()) {
+    printStatus("Unix file descriptor (write memfd)", false);
+  }
+  Glib::RefPtr<Gio::UnixFDList> fdList = Gio::UnixFDList::create();
+  gdbus::Handle memfdHandle = fdList->append(memfd);
+  close(memfd);
+  proxy->TestUnixFD(
+      memfdHandle, fdList,
+      sigc::bind(sigc::ptr_fun(&on_test_unix_fd_finished), memfdValue));
+
+  /* Properties fetched again with a single GetAll */
+  proxy->refresh_properties(sigc::ptr_fun(&on_refresh_properties_finished));
+
+  /* Objects of a subtree */
+  test_subtree();
+
   //    /* All */
   //    proxy->TestAll(inputStrVec,
   //                   inputStrVec,
@@ -506,6 +763,22 @@ void proxy_created(const Glib::RefPtr<Gio::AsyncResult> result) {
   //                   sigc::ptr_fun(&on_test_all_finished));
   //
 
+  /* Synchronous call, before the asynchronous one below, which sets the
+   * value checked by the test */
+  bool syncOK = true;
+  try {
+    proxy->TestTriggerInternalPropertyChange_sync(44, 1000);
+  } catch (const Glib::Error &ex) {
+    syncOK = false;
+  }
+  printStatus("Synchronous call", syncOK);
+
+  /* Call with a timeout, abandoned with its cancellable */
+  Glib::RefPtr<Gio::Cancellable> cancellable = Gio::Cancellable::create();
+  proxy->TestString(stringValue, sigc::ptr_fun(&on_test_cancelled_finished),
+                    cancellable, 1000);
+  cancellable->cancel();
+
   /* Test setting internal properties using a function */
   proxy->TestTriggerInternalPropertyChange(
       42, sigc::bind(
@@ -8,6 +8,14 @@
 
 DIR=$(cd $(dirname "$0"); pwd)
 
+# Run the stub, promise and proxy on a private session bus, so that the
+# tests (e.g. passing a memfd in TestUnixFD) do not depend on the session
+# of the user.
+if [ -z "$DBUS_PRIVATE_SESSION" ] && command -v dbus-run-session > /dev/null; then
+    export DBUS_PRIVATE_SESSION=1
+    exec dbus-run-session -- "$0" "$@"
+fi
+
 function build_it() {
     rm -rf build
     mkdir -p build
@@ -51,6 +59,22 @@ function test_luxpromise() {
     popd
 }
 
+function test_codegen_parallel() {
+    echo "===*** TESTING PARALLEL CODE GENERATION ***==="
+    pushd codegen
+    rm -rf build
+    mkdir -p build/serial/generated build/parallel/generated
+    # Both runs use the same relative paths, as they end up in the #includes
+    (cd build/serial && "$DIR/../gdbus-codegen-glibmm.py" --manifest ../../manifest.json > /dev/null) || exit 1
+    (cd build/parallel && "$DIR/../gdbus-codegen-glibmm.py" --manifest ../../manifest.json --jobs 4 > /dev/null) || exit 1
+    if ! diff -r build/serial build/parallel; then
+        echo "!!! Parallel code generation differs from the serial one"
+        exit 1
+    fi
+    echo "Serial and parallel code generation are identical"
+    popd
+}
+
 function test_promise() {
     echo "===*** TESTING PROMISE INTERFACE ***==="
     gdbus_promise
@@ -69,6 +93,8 @@ function test_stub() {
     kill $PROXY_PID    
 }
 
+test_codegen_parallel
+
 test_luxpromise
 
 test_promise
@@ -1,6 +1,7 @@
 #include "teststubmain.h"
 #include "tools.h"
 #include <iostream>
+#include <unistd.h>
 
 TestImpl::TestImpl() {
   m_PropReadByteStringArrayValue.push_back("Value1");
@@ -156,6 +157,46 @@ void TestImpl::TestBoolean(bool Param1, TestMessageHelper invocation) {
   invocation.ret(Param1);
 }
 
+void TestImpl::TestStruct(std::tuple<gint32, Glib::ustring, double> Param1,
+                          TestMessageHelper invocation) {
+  invocation.ret(Param1);
+}
+
+void TestImpl::TestDict(std::map<Glib::ustring, Glib::VariantBase> Param1,
+                        TestMessageHelper invocation) {
+  invocation.ret(Param1);
+}
+
+void TestImpl::TestIntArray(gdbus::FixedArray<gint32> Param1,
+                            TestMessageHelper invocation) {
+  invocation.ret(Param1);
+}
+
+void TestImpl::TestDoubleArray(gdbus::FixedArray<double> Param1,
+                               TestMessageHelper invocation) {
+  invocation.ret(Param1);
+}
+
+void TestImpl::TestByteArrayView(gdbus::FixedArray<guchar> Param1,
+                                 TestMessageHelper invocation) {
+  invocation.ret(Param1);
+}
+
+void TestImpl::TestStructArray(
+    std::vector<std::tuple<Glib::ustring, double, guint32>> Param1,
+    TestMessageHelper invocation) {
+  invocation.ret(Param1);
+}
+
+void TestImpl::TestUnixFD(gdbus::Handle Param1, TestMessageHelper invocation) {
+  // Send the received file descriptor back
+  int fd = invocation.getUnixFDList()->get(Param1);
+  Glib::RefPtr<Gio::UnixFDList> fdList = Gio::UnixFDList::create();
+  gdbus::Handle handle = fdList->append(fd);
+  close(fd);
+  invocation.ret(handle, fdList);
+}
+
 void TestImpl::TestAll(std::vector<std::string> in_Param1,
                        std::vector<std::string> in_Param2,
                        std::vector<std::string> in_Param3,
@@ -168,8 +209,10 @@ void TestImpl::TestAll(std::vector<std::string> in_Param1,
 
 void TestImpl::TestTriggerInternalPropertyChange(gint32 newValue,
                                                  TestMessageHelper invocation) {
-  TestPropInternalReadPropertyChange_set(newValue);
-  TestPropInternalReadWritePropertyChange_set(newValue);
+  // The object called, the registered one or one of a subtree
+  const std::string objectPath = invocation.getObjectPath();
+  TestPropInternalReadPropertyChange_set(objectPath, newValue);
+  TestPropInternalReadWritePropertyChange_set(objectPath, newValue);
   invocation.ret();
 }
 
@@ -415,6 +458,11 @@ bool TestImpl::TestPropInternalReadWritePropertyChange_setHandler(
   return true;
 }
 
+bool TestImpl::TestPropReadWriteString_setHandler(
+    const std::string & /* object_path */, std::string value) {
+  return value != "Rejected";
+}
+
 int main() {
   Glib::init();
   Gio::init();
@@ -422,6 +470,19 @@ int main() {
   TestImpl impl;
   impl.connect(Gio::DBus::BUS_TYPE_SESSION, "org.gdbus.codegen.glibmm.Test");
 
+  /* A single instance serving the objects below /org/gdbus/codegen/glibmm/Subtree */
+  TestImpl subtree;
+  subtree.register_subtree(
+      Gio::DBus::Connection::get_sync(Gio::DBus::BUS_TYPE_SESSION),
+      "/org/gdbus/codegen/glibmm/Subtree");
+  subtree.set_properties_changed_policy(gdbus::PropertiesChangedPolicy::Idle);
+  subtree.add_object("first");
+  subtree.add_object("second");
+  subtree.add_object("third");
+  subtree.remove_object("third");
+  subtree.TestPropReadString_set(subtree.object_path("first"), "First");
+  subtree.TestPropReadString_set(subtree.object_path("second"), "Second");
+
   Glib::RefPtr<Glib::MainLoop> ml = Glib::MainLoop::create();
   ml->run();
 }
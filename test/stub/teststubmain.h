@@ -24,6 +24,20 @@ public:
   void TestInt16(gint16 Param1, TestMessageHelper invocation);
   void TestChar(guchar Param1, TestMessageHelper invocation);
   void TestBoolean(bool Param1, TestMessageHelper invocation);
+  void TestStruct(std::tuple<gint32, Glib::ustring, double> Param1,
+                  TestMessageHelper invocation);
+  void TestDict(std::map<Glib::ustring, Glib::VariantBase> Param1,
+                TestMessageHelper invocation);
+  void TestIntArray(gdbus::FixedArray<gint32> Param1,
+                    TestMessageHelper invocation);
+  void TestDoubleArray(gdbus::FixedArray<double> Param1,
+                       TestMessageHelper invocation);
+  void TestByteArrayView(gdbus::FixedArray<guchar> Param1,
+                         TestMessageHelper invocation);
+  void TestStructArray(
+      std::vector<std::tuple<Glib::ustring, double, guint32>> Param1,
+      TestMessageHelper invocation);
+  void TestUnixFD(gdbus::Handle Param1, TestMessageHelper invocation);
   void TestAll(std::vector<std::string> in_Param1,
                std::vector<std::string> in_Param2,
                std::vector<std::string> in_Param3, std::string in_Param4,
@@ -144,6 +158,9 @@ public:
   bool TestPropReadBoolean_setHandler(bool value) { return true; }
   bool TestPropInternalReadPropertyChange_setHandler(gint32 value);
   bool TestPropInternalReadWritePropertyChange_setHandler(gint32 value);
+  // The objects of the subtree
+  bool TestPropReadWriteString_setHandler(const std::string &object_path,
+                                          std::string value);
 
 private:
   std::vector<std::string> m_PropReadByteStringArrayValue;